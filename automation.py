@@ -3,27 +3,161 @@ from utility import is_implication, get_constants, get_init_vars, list_merge, de
      append_quantifiers, relabel, deps_defunct, is_duplicate_upto_metavars, metavars_used, \
      vars_used, max_type_size, complement_tree, sorts_mark, sorts_rollback, is_equality, \
      target_depends
-from autoparse import parse_consts
+from libcache import load_library
+from terms import TermTable
+from disctree import fingerprint, matches_fingerprint
 from moves import check_targets_proved
 from unification import unify, substitute
 from nodes import DeadNode, AutoImplNode, AutoEqNode, AutoIffNode, ImpliesNode, AndNode, \
      SymbolNode, NeqNode, ForallNode, EqNode, NotNode
 from tree import TreeList
-from interface import nchars_to_chars, iswide_char
 from copy import deepcopy
+from collections import OrderedDict
+import heapq
+import sys
+import os
+import time
 import logic
 
 automation_limit = 500 # number of lines in hypothesis pane before automation gives up
+import_cache_entries = 256 # max number of prepared library theorems cached by automate
+import_cache_bytes = 64*1024*1024 # approximate max memory used by prepared library theorems
+hashcons_terms = False # whether automate keeps hash-consed terms for constants and duplicates
+best_first_depth = 8 # search depth of hypotheses beyond which best-first search does not go
+score_depth = 4 # score of an inference in best-first search per level of search depth
+score_size = 1 # score per unit of type size of the line an inference is applied to
+score_overlap = 2 # score subtracted per constant an inference shares with its target
+score_mv = 3 # score per metavariable an inference adds
 
 # Mode 0 : backwards reasoning only uses definitions, no metavars are allowed to be introduced in targets
 # Mode 1 : backwards reasoning may use any implication, new metavars are allowed to be introduced in targets using definitions
 # depth  : search depth on the hypothesis side
 
 try:
-    from flask import Flask, render_template
-    from flask_socketio import SocketIO, emit
+    import resource
 except:
-    pass
+    resource = None
+
+statm_path = '/proc/self/statm' # current memory use of the process, on Linux
+
+constant_bits = dict() # bit position assigned to each constant name
+
+def constants_mask(consts):
+    """
+    Given a list of constant names, return an integer bitmask with the bit for
+    each of the constants set. Constants which have not been seen before are
+    allocated the next free bit. Subset tests on lists of constants can then be
+    done with (mask1 & ~mask2) == 0.
+    """
+    mask = 0
+    for c in consts:
+        bit = constant_bits.get(c)
+        if bit == None:
+            bit = len(constant_bits)
+            constant_bits[c] = bit
+        mask |= 1 << bit
+    return mask
+
+def mask_consts(consts):
+    """
+    Given parsed constants for a library entry, return the same structure with
+    every list of constants replaced by its bitmask.
+    """
+    thmlist = []
+    for thm in consts[2]:
+        if isinstance(thm, AutoImplNode) or isinstance(thm, AutoIffNode) or isinstance(thm, AutoEqNode):
+            thmlist.append(type(thm)(constants_mask(thm.left), constants_mask(thm.right)))
+        else:
+            thmlist.append(constants_mask(thm))
+    return constants_mask(consts[0]), constants_mask(consts[1]), thmlist
+
+class ImportCache:
+    def __init__(self, max_entries, max_bytes):
+        self.entries = OrderedDict() # map from filepos to (vars, fake_tl, size), oldest first
+        self.max_entries = max_entries # maximum number of entries
+        self.max_bytes = max_bytes # maximum approximate memory used by entries
+        self.nbytes = 0 # approximate memory currently used by entries
+        self.hits = 0 # number of lookups which returned a prepared theorem
+        self.misses = 0 # number of lookups which did not
+
+    def get(self, filepos, vars):
+        """
+        Return a fresh copy of the fake tableau prepared for the library
+        theorem at the given filepos, or None if there is none. The copy is
+        only returned if it was prepared with the same variable subscript
+        record (vars) as supplied, as the names of variables in the prepared
+        theorem depend on it. The caller must set the sort tree of the copy.
+        """
+        entry = self.entries.get(filepos)
+        if entry == None or entry[0] != vars:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(filepos)
+        return deepcopy(entry[1])
+
+    def put(self, filepos, vars, fake_tl):
+        """
+        Store a copy of the given fake tableau, into which the library theorem
+        at the given filepos has been imported and cleaned up, starting from
+        the given variable subscript record (vars). The least recently used
+        entries are evicted to keep within the count and memory limits.
+        """
+        stree = fake_tl.stree
+        fake_tl.stree = None # the sort tree is shared with the real tableau
+        copy_tl = deepcopy(fake_tl)
+        fake_tl.stree = stree
+        size = approx_size(copy_tl.tlist0.data) + approx_size(copy_tl.tlist1.data) + \
+               approx_size(copy_tl.tlist2.data) + approx_size(copy_tl.constraints)
+        self.remove(filepos)
+        self.entries[filepos] = (deepcopy(vars), copy_tl, size)
+        self.nbytes += size
+        while self.entries and (len(self.entries) > self.max_entries or self.nbytes > self.max_bytes):
+            self.remove(next(iter(self.entries)))
+
+    def remove(self, filepos):
+        """
+        Remove the entry for the given filepos, if there is one.
+        """
+        if filepos in self.entries:
+            self.nbytes -= self.entries.pop(filepos)[2]
+
+def approx_size(obj):
+    """
+    Return the approximate memory used by the given object and everything
+    reachable from it through attributes, lists, tuples and dicts.
+    """
+    size = 0
+    seen = set()
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, list) or isinstance(obj, tuple):
+            stack.extend(obj)
+        elif isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif hasattr(obj, '__dict__'):
+            stack.append(obj.__dict__)
+        else:
+            stack.extend(slot_values(obj))
+    return size
+
+def slot_values(obj):
+    """
+    Return a list of the values of all the attributes of the given object which
+    are stored in slots, e.g. the children and sorts of a parse tree node.
+    """
+    values = []
+    for cls in type(obj).__mro__:
+        for name in getattr(cls, '__slots__', ()):
+            if hasattr(obj, name):
+                values.append(getattr(obj, name))
+    return values
 
 class SkolemNode:
     def __init__(self, lines):
@@ -37,8 +171,14 @@ class AutoData:
         self.const2 = const2 # constants on right side of implication
         self.nconst1 = nconst1 # negated constants on left side of implication or constants in predicate
         self.nconst2 = nconst2 # negated constants on right side of implication
+        self.mask1 = constants_mask(const1) if const1 != None else 0 # bitmask of const1
+        self.mask2 = constants_mask(const2) if const2 != None else 0 # bitmask of const2
+        self.nmask1 = constants_mask(nconst1) if nconst1 != None else 0 # bitmask of nconst1
+        self.nmask2 = constants_mask(nconst2) if nconst2 != None else 0 # bitmask of nconst2
         self.applied = [] # list of heads that have been applied to this
         self.num_mv = 0 # number of metavariables impl will increase or head has been increased
+        self.fingerprint = None # fingerprint of a head, for rejecting unifications with it
+        self.size = None # type size of the line, if computed by best-first search
         
     def __str__(self):
         return str(self.line)
@@ -46,16 +186,100 @@ class AutoData:
     def __repr__(self):
         return repr(self.line)
 
+def line_constants(screen, tl, atab, tree):
+    """
+    Return the constants used in the given tree, using the hash-consed terms
+    of the AutoTab if they are enabled.
+    """
+    if atab.terms != None:
+        return atab.terms.constants(tree)
+    return get_constants(screen, tl, tree)
+
+def line_complement_constants(screen, tl, atab, tree):
+    """
+    Return the constants used in the complement of the given tree, using the
+    hash-consed terms of the AutoTab if they are enabled.
+    """
+    if atab.terms != None:
+        return atab.terms.complement_constants(tree)
+    return get_constants(screen, tl, complement_tree(tree))
+
+fingerprint_stats = {"tests" : 0, "rejects" : 0} # unifications tested by unify_head and rejected
+
+def unify_head(screen, tl, tree, head, line):
+    """
+    Unify the given tree with the given line of the tableau, whose AutoData is
+    head, returning the same as unify. The fingerprint of the line is used to
+    reject trees that cannot unify with it without calling unify.
+    """
+    fingerprint_stats["tests"] += 1
+    if not matches_fingerprint(tree, head.fingerprint):
+        fingerprint_stats["rejects"] += 1
+        return False, [], []
+    return unify(screen, tl, tree, line)
+
+class AutoList:
+    """
+    The AutoData of one kind of line of the tableau (e.g. hypotheses which are
+    implications), keyed by line, so that lines can be found, added and
+    removed in constant time. Iterating gives the AutoData in the order they
+    were added. Lines may be added and removed while iterating, and the ones
+    added are reached before the iteration finishes.
+    """
+    def __init__(self):
+        self.nodes = dict() # line -> AutoData
+        self.order = [] # AutoData in order added, including removed ones
+        self.iterators = 0 # number of iterations in progress
+
+    def get(self, line):
+        return self.nodes.get(line)
+
+    def add(self, dat):
+        """
+        Add the given AutoData, replacing any for the same line.
+        """
+        self.nodes[dat.line] = dat
+        self.order.append(dat)
+
+    def remove(self, line):
+        """
+        Remove and return the AutoData for the given line, or None if there is
+        none. Removed entries are dropped from the iteration order when there
+        are more of them than entries and no iteration is in progress.
+        """
+        dat = self.nodes.pop(line, None)
+        if dat != None and self.iterators == 0 and len(self.order) > 2*len(self.nodes):
+            self.order = [t for t in self.order if self.nodes.get(t.line) is t]
+        return dat
+
+    def __iter__(self):
+        self.iterators += 1
+        try:
+            i = 0
+            while i < len(self.order):
+                dat = self.order[i]
+                if self.nodes.get(dat.line) is dat:
+                    yield dat
+                i += 1
+        finally:
+            self.iterators -= 1
+
+    def __len__(self):
+        return len(self.nodes)
+
 class AutoTab:
     def __init__(self, screen, tl):
         tlist0 = tl.tlist0.data
         tlist1 = tl.tlist1.data
         tlist2 = tl.tlist2.data
         self.tl = tl
+        self.terms = TermTable() if hashcons_terms else None # hash-consed terms, if enabled
         self.nhyps = len(tlist1)
         self.ntars = len(tlist2)
         self.vars = get_init_vars(screen, tl, tlist0[0]) if tlist0 else [] # vars in initial tableau
         self.depth = dict() # search depth at which hypothesis was found
+        self.unchecked1 = None # hyps modified since targets were last checked (None for unknown)
+        self.unchecked2 = None # targets modified since targets were last checked (None for unknown)
         for i in range(len(tlist1)):
             self.depth[i] = 0
         #self.sk_ref = None # where in the qz we have checked up to for new skolems
@@ -65,10 +289,10 @@ class AutoTab:
         #    while tree.left:
         #        tree = tree.left
         #    self.sk_ref = tree
-        qz_data = [AutoData(0, 0, get_constants(screen, tl, tlist0[0]), None, None, None)] if tlist0 else []
-        hyp_heads = []
-        hyp_impls = []
-        tar_heads = []
+        qz_data = [AutoData(0, 0, line_constants(screen, tl, self, tlist0[0]), None, None, None)] if tlist0 else []
+        hyp_heads = AutoList()
+        hyp_impls = AutoList()
+        tar_heads = AutoList()
         max_depth = 0
         max_width = 0
         function_depth = 1 # 1 to allow for is_blah predicates
@@ -80,26 +304,30 @@ class AutoTab:
             function_depth = max(function_depth, f)
             if is_implication(v):
                 v, univs = unquantify(screen, v, False)
-                c1 = get_constants(screen, tl, v.left)
-                c2 = get_constants(screen, tl, v.right)
-                nc1 = get_constants(screen, tl, complement_tree(v.left))
-                nc2 = get_constants(screen, tl, complement_tree(v.right))
+                c1 = line_constants(screen, tl, self, v.left)
+                c2 = line_constants(screen, tl, self, v.right)
+                nc1 = line_complement_constants(screen, tl, self, v.left)
+                nc2 = line_complement_constants(screen, tl, self, v.right)
                 dat = AutoData(i, 0, c1, c2, nc1, nc2)
-                hyp_impls.append(dat)
+                hyp_impls.add(dat)
                 dat.num_mv = len(metavars_used(v.right)) - len(metavars_used(v.left))
             else:
-                c = get_constants(screen, tl, v)
-                nc = get_constants(screen, tl, complement_tree(v))
-                hyp_heads.append(AutoData(i, 0, c, None, nc, None))
+                c = line_constants(screen, tl, self, v)
+                nc = line_complement_constants(screen, tl, self, v)
+                dat = AutoData(i, 0, c, None, nc, None)
+                dat.fingerprint = fingerprint(v)
+                hyp_heads.add(dat)
         for j in range(len(tlist2)):
            v = tlist2[j]
            d, w, f = max_type_size(screen, tl, v)
            max_depth = max(max_depth, d)
            max_width = max(max_width, w)
            function_depth = max(function_depth, f)
-           c = get_constants(screen, tl, v)
-           nc = get_constants(screen, tl, complement_tree(v))
-           tar_heads.append(AutoData(j, 0, c, None, nc, None))
+           c = line_constants(screen, tl, self, v)
+           nc = line_complement_constants(screen, tl, self, v)
+           dat = AutoData(j, 0, c, None, nc, None)
+           dat.fingerprint = fingerprint(v)
+           tar_heads.add(dat)
         self.hyp_heads = hyp_heads
         self.hyp_impls = hyp_impls
         self.tar_heads = tar_heads
@@ -117,58 +345,48 @@ def update_autotab(screen, tl, atab, dirty1, dirty2, interface, mv_diff=0):
     tlist0 = tl.tlist0.data
     tlist1 = tl.tlist1.data
     tlist2 = tl.tlist2.data
+    if atab.unchecked1 != None: # record changes for check_targets_proved
+        atab.unchecked1.update(dirty1)
+        atab.unchecked2.update(dirty2)
     for i in dirty1:
         version = -1
         if i < atab.nhyps: # delete old hypothesis
-            j = 0
-            while j < len(atab.hyp_heads):
-                t = atab.hyp_heads[j]
-                if t.line == i:
-                    version = atab.hyp_heads[j].version
-                    del atab.hyp_heads[j]
-                else:
-                    j += 1
-            j = 0
-            while j < len(atab.hyp_impls):
-                t = atab.hyp_impls[j]
-                if t.line == i:
-                    version = atab.hyp_impls[j].version
-                    del atab.hyp_impls[j]
-                else:
-                    j += 1
+            t = atab.hyp_heads.remove(i)
+            if t == None:
+                t = atab.hyp_impls.remove(i)
+            if t != None:
+                version = t.version
         # add new details
         v = tlist1[i]
         if is_implication(v) or is_equality(v):
             v, univs = unquantify(screen, v, False)
-            c1 = get_constants(screen, tl, v.left)
-            c2 = get_constants(screen, tl, v.right)
-            nc1 = get_constants(screen, tl, complement_tree(v.left))
-            nc2 = get_constants(screen, tl, complement_tree(v.right))
+            c1 = line_constants(screen, tl, atab, v.left)
+            c2 = line_constants(screen, tl, atab, v.right)
+            nc1 = line_complement_constants(screen, tl, atab, v.left)
+            nc2 = line_complement_constants(screen, tl, atab, v.right)
             dat = AutoData(i, version + 1, c1, c2, nc1, nc2)
-            atab.hyp_impls.append(dat)
+            atab.hyp_impls.add(dat)
             dat.num_mv = len(metavars_used(v.right)) - len(metavars_used(v.left))
         else:
-            c = get_constants(screen, tl, v)
-            nc = get_constants(screen, tl, complement_tree(v))
+            c = line_constants(screen, tl, atab, v)
+            nc = line_complement_constants(screen, tl, atab, v)
             dat = AutoData(i, version + 1, c, None, nc, None)
-            atab.hyp_heads.append(dat)
+            dat.fingerprint = fingerprint(v)
+            atab.hyp_heads.add(dat)
             dat.num_mv = mv_diff
     for j in dirty2:
         version = -1
         if j < atab.ntars: # delete old target
-            k = 0
-            while k < len(atab.tar_heads):
-                t = atab.tar_heads[k]
-                if t.line == j:
-                    version = atab.tar_heads[k].version
-                    del atab.tar_heads[k]
-                else:
-                    k += 1
+            t = atab.tar_heads.remove(j)
+            if t != None:
+                version = t.version
         # add new details
         v = tlist2[j]
-        c = get_constants(screen, tl, v)
-        nc = get_constants(screen, tl, complement_tree(v))
-        atab.tar_heads.append(AutoData(j, version + 1, c, None, nc, None))
+        c = line_constants(screen, tl, atab, v)
+        nc = line_complement_constants(screen, tl, atab, v)
+        dat = AutoData(j, version + 1, c, None, nc, None)
+        dat.fingerprint = fingerprint(v)
+        atab.tar_heads.add(dat)
             
     atab.nhyps = len(tlist1)
     atab.ntars = len(tlist2)
@@ -176,148 +394,95 @@ def update_autotab(screen, tl, atab, dirty1, dirty2, interface, mv_diff=0):
 
 def autotab_remove_deadnodes(screen, tl, atab, n1, n2, interface):
     list1 = tl.tlist1.data
-    list2 = tl.tlist1.data
+    list2 = tl.tlist2.data
     dirty1 = []
     dirty2 = []
     for i in range(n1, len(list1)):
         if isinstance(list1[i], DeadNode):
-            found = False
-            j = 0
-            while j < len(atab.hyp_heads):
-                if atab.hyp_heads[j].line == i:
-                    dirty1.append(i)
-                    del atab.hyp_heads[j]
-                    found = True
-                    break
-                else:
-                    j += 1
-            if not found:
-                j = 0
-                while j < len(atab.hyp_impls):
-                    if atab.hyp_impls[j].line == i:
-                        dirty1.append(i)
-                        del atab.hyp_impls[j]
-                        break
-                    else:
-                        j += 1
+            if atab.hyp_heads.remove(i) != None or atab.hyp_impls.remove(i) != None:
+                dirty1.append(i)
     for i in range(n2, len(list2)):
         if isinstance(list2[i], DeadNode):
-            j = 0
-            while j < len(atab.tar_heads):
-                if atab.tar_heads[j].line == i:
-                    dirty2.append(i)
-                    del atab.tar_heads[j]
-                    break
-                else:
-                    j += 1
+            if atab.tar_heads.remove(i) != None:
+                dirty2.append(i)
     return update_screen(screen, tl, interface, dirty1, dirty2)
 
 def create_index(screen, tl, library):
     """
     Read the library in and create an index of all theorems and definitions up
-    to but not including the theorem we are trying to prove.
+    to but not including the theorem we are trying to prove. The constants are
+    taken from the precompiled library cache, so that no parsing is required
+    unless the library has changed. Each entry of the index also contains the
+    constants in bitmask form.
     """
     index = []
-    title = library.readline()
-    while title: # check for EOF
-        title = title[7:-1]
-        const_str = library.readline()[0:-1]
-        success, consts = parse_consts(screen, const_str)
-        nconst_str = library.readline()[0:-1]
-        success, nconsts = parse_consts(screen, nconst_str)
-        #term_str = library.readline()[0:-1]
-        tags = library.readline() # skip tags
-        filepos = library.tell()
-        if filepos == tl.loaded_theorem:
+    for entry in load_library(screen, library.name).entries:
+        if entry.filepos == tl.loaded_theorem:
             break
-        index.append((title, consts, nconsts, filepos))
-        while title != '\n':
-            title = library.readline()
-        title = library.readline()
+        cmask = mask_consts(entry.consts) if isinstance(entry.consts, tuple) else None
+        ncmask = mask_consts(entry.nconsts) if isinstance(entry.nconsts, tuple) else None
+        index.append((entry.title, entry.consts, entry.nconsts, entry.filepos, cmask, ncmask))
     return index
 
 def get_autonode(screen, alist, line):
-    low = 0
-    high = len(alist) - 1
-
-    while low <= high:
-        mid = (low + high) // 2
-        if alist[mid].line < line:
-            low = mid + 1
-        elif alist[mid].line > line:
-            high = mid - 1
-        else:
-            return alist[mid]
-
-    return None
+    return alist.get(line)
 
-def filter_theorems1(screen, index, type_consts, consts):
+def filter_theorems1(screen, index, cindex, type_consts, consts):
     """
     Given a library index, filter out theorems all of whose precedents
     contain only constants in the given list and whose type constants
-    are all contained in the given list.
+    are all contained in the given list. The inverted constant index
+    (cindex) is used to find candidates, only theorems in the library
+    index being returned.
     """
     thms = []
-    for (title, c, nc, filepos) in index:
-        thmlist = c[2]
-        nthmlist = nc[2]
-        tconst = c[0]
-        for i in range(len(thmlist)):
-            thm = thmlist[i]
-            nthm = nthmlist[i]
-            if isinstance(thm, AutoImplNode) or isinstance(thm, AutoIffNode) or isinstance(thm, AutoEqNode):
-                tc = thm.left
-                tcr = thm.right
-                tnc = nthm.right
-                tncl = nthm.left
-                if set(tconst).issubset(type_consts):
-                    if set(tc).issubset(consts):
-                        if set(tcr).issubset(tc) or not set(tc).issubset(tcr):
-                            thms.append((title, c, nc, filepos, i))
-                    if set(tnc).issubset(consts):
-                        if set(tncl).issubset(tnc) or not set(tnc).issubset(tncl):
-                            thms.append((title, c, nc, filepos, i))
+    n = len(index)
+    keys = cindex.hyps.keys
+    tmask = constants_mask(type_consts)
+    for k in cindex.hyps.subsets(consts):
+        j, i = keys[k]
+        if j >= n:
+            break
+        (title, c, nc, filepos, cm, ncm) = index[j]
+        if (cm[0] & ~tmask) == 0:
+            thms.append((title, c, nc, filepos, i, cm, ncm))
     return thms
 
-def filter_theorems2(screen, index, consts, mode):
+def filter_theorems2(screen, index, cindex, consts, mode):
     """
     Given a library index, filter out theorems all of whose consequents
-    contain only constants in the given list.
+    contain only constants in the given list. The inverted constant
+    index (cindex) is used to find candidates.
     """
     thms = []
-    for (title, c, nc, filepos) in index:
-        thmlist = c[2]
-        nthmlist = nc[2]
-        for i in range(len(thmlist)):
-            thm = thmlist[i]
-            nthm = nthmlist[i]
-            if (mode > 0 and isinstance(thm, AutoImplNode)) or isinstance(thm, AutoIffNode) or isinstance(thm, AutoEqNode):
-                tc = thm.right
-                tcl = thm.left
-                tnc = nthm.left
-                tncr = nthm.right
-                if set(tc).issubset(consts):
-                    if set(tcl).issubset(tc) or not set(tc).issubset(tcl):
-                        thms.append((title, c, nc, filepos, i))
-                if set(tnc).issubset(consts):
-                    if set(tncr).issubset(tnc) or not set(tnc).issubset(tncr):
-                        thms.append((title, c, nc, filepos, i))
+    n = len(index)
+    keys = cindex.tars.keys
+    for k in cindex.tars.subsets(consts):
+        j, i = keys[k]
+        if j >= n:
+            break
+        (title, c, nc, filepos, cm, ncm) = index[j]
+        if mode > 0 or not isinstance(c[2][i], AutoImplNode):
+            thms.append((title, c, nc, filepos, i, cm, ncm))
     return thms
 
-def filter_theorems3(screen, index, consts1, consts2):
+def filter_theorems3(screen, index, cindex, consts1, consts2):
     """
     Given a library index, filter out theorems which are heads that
-    contain only constants in the given list.
+    contain only constants in the given list. The inverted constant
+    index (cindex) is used to find candidates.
     """
     thms = []
-    for (title, c, nc, filepos) in index:
-        thmlist = c[2]
-        for i in range(len(thmlist)):
-            thm = thmlist[i]
-            if not isinstance(thm, AutoImplNode) and not isinstance(thm, AutoEqNode) and \
-               not isinstance(thm, AutoIffNode):
-                if set(thm).issubset(consts1) or set(thm).issubset(consts2):
-                    thms.append((title, c, nc, filepos, i))
+    n = len(index)
+    keys = cindex.heads.keys
+    ids = set(cindex.heads.subsets(consts1))
+    ids.update(cindex.heads.subsets(consts2))
+    for k in sorted(ids):
+        j, i = keys[k]
+        if j >= n:
+            break
+        (title, c, nc, filepos, cm, ncm) = index[j]
+        thms.append((title, c, nc, filepos, i, cm, ncm))
     return thms
 
 def autocleanup(screen, tl, ttree):
@@ -345,6 +510,7 @@ def update_screen(screen, tl, interface, d1, d2):
         if not d1 and not d2:
             return False # nothing to update
     if interface == 'curses':
+        from interface import nchars_to_chars, iswide_char # imports curses
         pad1 = screen.pad1.pad
         pad2 = screen.pad2.pad
         if d1 != None:
@@ -374,6 +540,7 @@ def update_screen(screen, tl, interface, d1, d2):
         screen.pad2.refresh()
         screen.focus.refresh()
     elif interface == 'javascript':
+        from flask_socketio import emit
         dirtytxt0 = '' # don't display qz during automation
         dirtytxt1 = [str(tlist1[i]) for i in dirty1]
         dirtytxt2 = [str(tlist2[i]) for i in dirty2]
@@ -381,7 +548,21 @@ def update_screen(screen, tl, interface, d1, d2):
              'dirtytxt1': dirtytxt1, 'dirty2': dirty2, 'dirtytxt2': dirtytxt2, 'reset_mode': False})
     return len(tl.tlist1.data) > automation_limit
 
-def check_duplicates(screen, tl, ttree, n1, n2, tar, interface):
+def duplicate_candidates(terms, tlist, n):
+    """
+    Given a TermTable, return a dictionary mapping duplicate keys to the
+    indices i < n of the trees in tlist with that key, in increasing order.
+    """
+    buckets = dict()
+    for j in range(n):
+        key = terms.duplicate_key(terms.intern(tlist[j]))
+        if key in buckets:
+            buckets[key].append(j)
+        else:
+            buckets[key] = [j]
+    return buckets
+
+def check_duplicates(screen, tl, ttree, n1, n2, tar, interface, terms=None):
     """
     If n2 is equal to the number of targets in the tableau, check hypotheses
     starting at index n1 for duplicates with prior hypotheses (up to) possibly
@@ -392,6 +573,8 @@ def check_duplicates(screen, tl, ttree, n1, n2, tar, interface):
     be used to prove those targets are also replaced with DeadNode.
     The function returns True if there were *any* hypotheses or targets
     checked starting at the given indices which were not duplicate.
+    If a TermTable is supplied, only prior lines with the same duplicate key
+    are compared.
     """
     tlist1 = tl.tlist1.data
     tlist2 = tl.tlist2.data
@@ -399,20 +582,42 @@ def check_duplicates(screen, tl, ttree, n1, n2, tar, interface):
     dirty2 = []
     nodup_found = False
     if n2 == len(tlist2): # only check if not checking targets
+        if terms != None:
+            buckets = duplicate_candidates(terms, tlist1, n1)
+            dead_key = terms.duplicate_key(terms.intern(DeadNode(None)))
         for i in range(n1, len(tlist1)):
             nodup = True
-            for j in range(n1):
+            if terms != None:
+                key = terms.duplicate_key(terms.intern(tlist1[i]))
+                cands = buckets.get(key, [])
+            else:
+                cands = range(n1)
+            k = 0
+            while k < len(cands):
+                j = cands[k]
+                k += 1
                 if is_duplicate_upto_metavars(tlist1[i], tlist1[j]):
                     if deps_compatible(screen, tl, ttree, tar, j):
                         tlist1[i] = DeadNode(tlist1[i])
                         dirty1.append(i)
                         nodup = False
+                        if terms != None and key != dead_key:
+                            # a dead line is a duplicate of the later dead lines
+                            key = dead_key
+                            cands = [j2 for j2 in buckets.get(key, []) if j2 > j]
+                            k = 0
             if nodup:
                 nodup_found = True
     dup2 = True
+    if terms != None:
+        buckets = duplicate_candidates(terms, tlist2, n2)
     for i in range(n2, len(tlist2)):
         dup = False
-        for j in range(n2):
+        if terms != None:
+            cands = buckets.get(terms.duplicate_key(terms.intern(tlist2[i])), [])
+        else:
+            cands = range(n2)
+        for j in cands:
             if is_duplicate_upto_metavars(tlist2[i], tlist2[j]) and \
                target_depends(screen, tl, ttree, i, j):
                 dup = True
@@ -602,17 +807,567 @@ def check_sizes(screen, tl, atab, n1, n2, interface):
     update_screen(screen, tl, interface, dirty1, dirty2)
     return nooversize_found
 
-def automate(screen, tl, ttree, interface='curses'):
-    libthms_loaded = dict() # keep track of which library theorems we loaded, and where
-    fake_ttree = TargetNode(-1, []) # used for fake loading of library results
+def hypothesis_constants(screen, atab, hyps):
+    """
+    Given a list of hypotheses, return a pair (consts, mask) where consts is
+    the merged list of the constants in those which are heads, implications
+    or equalities, and mask is its bitmask.
+    """
+    hypc = []
+    hmask = 0 # bitmask of hypc
+    for k in hyps:
+        node = get_autonode(screen, atab.hyp_heads, k)
+        if node:
+            c = node.const1
+            hmask |= node.mask1
+        else:
+            node = get_autonode(screen, atab.hyp_impls, k)
+            if not node:
+                continue
+            c = list_merge(node.const1, node.const2)
+            hmask |= node.mask1 | node.mask2
+        hypc = list_merge(hypc, c)
+    return hypc, hmask
+
+class AutoSearch:
+    """
+    The state of a proof search by automate, other than the tableau and the
+    target dependency tree.
+    """
+    def __init__(self, screen, tl, interface):
+        self.interface = interface # interface to update as the tableau changes
+        self.atab = AutoTab(screen, tl) # automation data structure
+        self.library = open("library.dat", "r")
+        self.index = create_index(screen, tl, self.library) # library theorems that may be used
+        self.cindex = load_library(screen, self.library.name).const_index # inverted index of constants
+        self.libthms_loaded = dict() # keep track of which library theorems we loaded, and where
+        self.fake_ttree = TargetNode(-1, []) # used for fake loading of library results
+        self.import_cache = ImportCache(import_cache_entries, import_cache_bytes) # prepared library results
+        self.mode = 0 # mode 0 = no adding tar metavars, mode 1 = add tar metavars with iffs
+        self.current_depth = 1 # depth we are currently searching to
+        self.inferences = 0 # number of inferences tried
+        self.deadline = None # time.monotonic() by which to stop, if any
+        self.max_inferences = None # number of inferences after which to stop, if any
+        self.max_memory = None # bytes of memory after which to stop, if any
+        self.start_peak = peak_memory_used() # peak memory of the process before the search
+        self.reason = 'stalled' # why the search stopped (see AutoResult)
+
+    def budget_spent(self):
+        """
+        Return True if the time, inference or memory budget of the search has
+        run out, recording which in self.reason.
+        """
+        if self.deadline != None and time.monotonic() >= self.deadline:
+            self.reason = 'time'
+        elif self.max_inferences != None and self.inferences >= self.max_inferences:
+            self.reason = 'inferences'
+        elif self.max_memory != None and self.memory_exceeded():
+            self.reason = 'memory'
+        else:
+            return False
+        return True
+
+    def memory_exceeded(self):
+        """
+        Return True if the memory currently used by the process exceeds
+        self.max_memory. Where only the peak memory of the process is known,
+        the peak is only counted once the search has raised it, as memory used
+        and freed before the search began is not in use now.
+        """
+        used = memory_used()
+        if used != None:
+            return used > self.max_memory
+        return peak_memory_used() > max(self.max_memory, self.start_peak)
+
+def memory_used():
+    """
+    Return the memory currently used by the process in bytes, i.e. its
+    resident set size, or None if this is not known on this platform.
+    """
+    try:
+        with open(statm_path, "r") as f:
+            return int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+def peak_memory_used():
+    """
+    Return the peak memory used by the process in bytes, or 0 if this is not
+    known on this platform.
+    """
+    if resource == None:
+        return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else 1024*rss # bytes on macOS, kilobytes elsewhere
+
+class AutoResult:
+    """
+    The result of automate. It is true if all targets were proved, so that it
+    can be used as a boolean.
+    """
+    def __init__(self, proved, reason, targets, inferences, elapsed):
+        self.proved = proved # whether all targets were proved
+        self.reason = reason # why automate stopped: 'proved', 'stalled' (nothing more to try),
+                             # 'size' (tableau too large), 'time', 'inferences' or 'memory'
+        self.targets = targets # list of targets proved
+        self.inferences = inferences # number of inferences tried
+        self.elapsed = elapsed # time taken in seconds
+
+    def __bool__(self):
+        return self.proved
+
+    def __repr__(self):
+        return "AutoResult(proved="+str(self.proved)+", reason="+repr(self.reason)+ \
+               ", targets="+str(self.targets)+", inferences="+str(self.inferences)+ \
+               ", elapsed="+format(self.elapsed, ".2f")+")"
+
+def proved_targets(ttree):
+    """
+    Return the sorted list of targets marked as proved in the given target
+    dependency tree.
+    """
+    targets = []
+
+    def find(ttree):
+        if ttree.proved and ttree.num >= 0:
+            targets.append(ttree.num)
+        for t in ttree.andlist:
+            find(t)
+
+    find(ttree)
+    return sorted(targets)
+
+def auto_hyp_impl(screen, tl, ttree, search, i, hyp, imp):
+    """
+    Try to apply the implication or equality in the hypotheses with AutoData
+    imp to the head with AutoData hyp, for the benefit of target i, by modus
+    ponens, modus tollens or equality substitution. Returns a pair (progress,
+    stop) where progress is True if new hypotheses were found which are not
+    duplicate, oversize or trivial and stop is True if the tableau has become
+    too large to continue.
+    """
+    atab = search.atab
+    interface = search.interface
+    tlist1 = tl.tlist1.data
+    tlist2 = tl.tlist2.data
+    progress = False
+    line2 = hyp.line
+    hmask = hyp.mask1
+    hdepth = atab.depth[line2]
+    pos = (imp.mask1 & ~hmask) == 0
+    neg = (imp.nmask2 & ~hmask) == 0
+    line1 = imp.line
+    idepth = atab.depth[line1]
+    if imp.num_mv <= 0 and (pos or neg) and idepth < search.current_depth:
+        search.inferences += 1
+        unifies1 = False
+        unifies2 = False
+        unifies3 = False
+        if (hyp.line, hyp.version, True) not in imp.applied:
+            v1 = vars_used(screen, tl, tlist1[line1])
+            v2 = vars_used(screen, tl, tlist1[line2])
+            if v1 or v2: # ensure not applying metavar thm to metavar head
+                imp.applied.append((hyp.line, hyp.version, True))
+                thm = tlist1[line1]
+                thm, univs = unquantify(screen, thm, False) # remove quantifiers by taking temporary metavars
+                if isinstance(thm, ImpliesNode):
+                    if pos:
+                        prec, u = unquantify(screen, thm.left, True)
+                        if not isinstance(prec, AndNode):
+                            # check if precedent unifies with hyp
+                            unifies1, assign, macros = unify_head(screen, tl, prec, hyp, tlist1[line2])
+                            # check all metavars were assigned
+                            #if unifies1 and metavars_used(substitute(deepcopy(prec), assign)):
+                            #    unifies1 = False
+                    if neg:
+                        prec, u = unquantify(screen, thm.right, True)
+                        if not isinstance(prec, AndNode):
+                            # check if neg consequent unifies with hyp
+                            comp = complement_tree(prec)
+                            unifies2, assign, macros = unify_head(screen, tl, comp, hyp, tlist1[line2])
+                            # check all metavars were assigned
+                            #if unifies2 and metavars_used(substitute(deepcopy(comp), assign)):
+                            #    unifies2 = False
+                elif isinstance(thm, EqNode):
+                    unifies3, _, _ = logic.limited_equality_substitution(screen, tl, ttree, None, \
+                                                                line1, line2, True, True)
+        if unifies1 or unifies2 or unifies3:
+            # apply modus ponens and or modus tollens
+            dep = tl.tlist1.dependency(line1)
+            dep = target_compatible(screen, tl, ttree, dep, line2, True)
+            if dep:
+                success = False
+                n1 = len(tl.tlist1.data)
+                if unifies1:
+                    success, dirty1, dirty2 = logic.modus_ponens(screen, tl, ttree, dep, line1, [line2], True)
+                if not success and unifies2:
+                    success, dirty1, dirty2 = logic.modus_tollens(screen, tl, ttree, dep, line1, [line2], True)
+                if unifies3:
+                    success, dirty1, dirty2 = logic.limited_equality_substitution(screen, tl, ttree, dep, line1, line2, True, False)
+                if success:
+                    for k in dirty1:
+                        atab.depth[k] = max(hdepth, idepth) + 1
+                    mv_diff = hyp.num_mv + max(imp.num_mv, 0)
+                    update_autotab(screen, tl, atab, dirty1, dirty2, interface, mv_diff)
+                    dirty1, dirty2 = autocleanup(screen, tl, ttree)
+                    for k in dirty1:
+                        atab.depth[k] = max(hdepth, idepth) + 1
+                    update_autotab(screen, tl, atab, dirty1, dirty2, interface, mv_diff)
+                    #dirty1, dirty2, done, plist = check_targets_proved(screen, tl, ttree)
+                    update_screen(screen, tl, interface, dirty1, dirty2)
+                    c1 = check_duplicates(screen, tl, ttree, n1, len(tlist2), i, interface, atab.terms)
+                    c2 = check_sizes(screen, tl, atab, n1, len(tlist2), interface)
+                    c3 = check_trivial(screen, tl, atab, n1, interface)
+                    if c1 and c2 and c3:
+                        progress = True
+                    if autotab_remove_deadnodes(screen, tl, atab, n1, len(tlist2), interface):
+                        return progress, True
+    return progress, False
+
+def auto_hyp_libthm(screen, tl, ttree, search, i, hyp, libthm):
+    """
+    Try to apply the library theorem libthm, as returned by filter_theorems1,
+    to the head with AutoData hyp, for the benefit of target i, loading it
+    into the hypotheses if it applies. Returns a pair (progress, stop) as for
+    auto_hyp_impl.
+    """
+    atab = search.atab
+    interface = search.interface
+    tlist1 = tl.tlist1.data
+    tlist2 = tl.tlist2.data
+    progress = False
+    (title, c, nc, filepos, line, cm, ncm) = libthm
+    line2 = hyp.line
+    hdepth = atab.depth[line2]
+    search.inferences += 1
+    # check to see if thm already loaded
+    unifies1 = False
+    unifies2 = False
+    unifies3 = False
+    if filepos in search.libthms_loaded:
+        j = search.libthms_loaded[filepos] # get position loaded in tableau
+        tnode = get_autonode(screen, atab.hyp_impls, j + line)
+        idepth = atab.depth[j + line]
+        if tnode and tnode.num_mv <= 0 and \
+           (hyp.line, hyp.version, True) not in tnode.applied and \
+           idepth < search.current_depth:
+            tnode.applied.append((hyp.line, hyp.version, True))
+            thm = tlist1[j + line]
+            thm, univs = unquantify(screen, thm, False) # remove quantifiers by taking temporary metavars
+            if isinstance(thm, ImpliesNode):
+                prec, u = unquantify(screen, thm.left, True)
+                if not isinstance(prec, AndNode):
+                    # check if precedent unifies with hyp
+                    v1 = vars_used(screen, tl, prec)
+                    v2 = vars_used(screen, tl, tlist1[line2])
+                    if v1 or v2: # ensure not applying metavar thm to metavar head
+                        unifies1, assign, macros = unify_head(screen, tl, prec, hyp, tlist1[line2])
+                        # check all metavars were assigned
+                        #if unifies1 and metavars_used(substitute(deepcopy(prec), assign)):
+                        #    unifies1 = False
+                if not unifies1:
+                    prec, u = unquantify(screen, thm.right, False)
+                    if not isinstance(prec, AndNode):
+                        # check if precedent unifies with hyp
+                        v1 = vars_used(screen, tl, prec)
+                        v2 = vars_used(screen, tl, tlist1[line2])
+                        if v1 or v2: # ensure not applying metavar thm to metavar head
+                            comp = complement_tree(prec)
+                            unifies2, assign, macros = unify_head(screen, tl, comp, hyp, tlist1[line2])
+                            # check all metavars were assigned
+                            #if unifies2 and metavars_used(substitute(deepcopy(comp), assign)):
+                            #    unifies2 = False
+            elif isinstance(thm, EqNode):
+                v1 = vars_used(screen, tl, tlist1[j + line])
+                v2 = vars_used(screen, tl, tlist1[line2])
+                if v1 or v2:  # ensure not applying metavar thm to metavar head
+                    unifies3, _, _ = logic.limited_equality_substitution(screen, tl, ttree, None, \
+                                                         j + line, line2, True, True)
+    else: # library theorem not yet loaded
+        fake_tl = search.import_cache.get(filepos, tl.vars)
+        if fake_tl != None:
+            fake_tl.stree = tl.stree # copy sort tree from tl
+            sorts_mark(screen, tl)
+        else:
+            fake_tl = TreeList()
+            fake_tl.vars = deepcopy(tl.vars) # copy variable subscript record from tl
+            fake_tl.stree = tl.stree # copy sort tree from tl
+            sorts_mark(screen, tl)
+            logic.library_import(screen, fake_tl, search.library, filepos)
+            autocleanup(screen, fake_tl, search.fake_ttree)
+            search.import_cache.put(filepos, tl.vars, fake_tl)
+        thm = fake_tl.tlist1.data[line]
+        # check theorem has only one precedent
+        thm, univs = unquantify(screen, thm, False) # remove quantifiers by taking temporary metavars
+        if isinstance(thm, ImpliesNode):
+            mv_diff = len(metavars_used(thm.right)) - len(metavars_used(thm.left))
+            prec, u = unquantify(screen, thm.left, True)
+            if not isinstance(prec, AndNode) and mv_diff <= 0:
+                # check if precedent unifies with hyp
+                v1 = vars_used(screen, tl, prec)
+                v2 = vars_used(screen, tl, tlist1[line2])
+                if v1 or v2: # ensure not applying metavar thm to metavar head
+                    unifies1, assign, macros = unify_head(screen, fake_tl, prec, hyp, tlist1[line2])
+            if not unifies1:
+                prec, u = unquantify(screen, thm.right, False)
+                if not isinstance(prec, AndNode) and mv_diff <= 0:
+                    # check if precedent unifies with hyp
+                    v1 = vars_used(screen, tl, prec)
+                    v2 = vars_used(screen, tl, tlist1[line2])
+                    if v1 or v2: # ensure not applying metavar thm to metavar head
+                        unifies2, assign, macros = unify_head(screen, fake_tl, complement_tree(prec), hyp, tlist1[line2])
+        elif isinstance(thm, EqNode):
+            fake_tl.tlist1.data.append(tlist1[line2])
+            unifies3, _, _ = logic.limited_equality_substitution(screen, fake_tl, ttree, None, \
+                                                         line, len(fake_tl.tlist1.data) - 1, True, True)
+            del fake_tl.tlist1.data[len(fake_tl.tlist1.data) - 1]
+        if unifies1 or unifies2 or unifies3:
+            # transfer library result to tableau
+            dirty1 = []
+            dirty2 = []
+            j = len(tlist1)
+            fake_tlist0 = fake_tl.tlist0.data
+            if fake_tlist0:
+                append_quantifiers(tl.tlist0.data, fake_tlist0[0])
+            #wind_skolems(screen, tl, atab)
+            fake_list1 = fake_tl.tlist1.data
+            for k in range(len(fake_list1)):
+                append_tree(tlist1, fake_list1[k], dirty1)
+                atab.depth[len(tlist1) - 1] = 0
+            idepth = 0
+            search.libthms_loaded[filepos] = j
+            search.import_cache.remove(filepos)
+            tl.vars = fake_tl.vars
+            tl.stree = fake_tl.stree
+            update_autotab(screen, tl, atab, dirty1, dirty2, interface)
+            tnode = get_autonode(screen, atab.hyp_impls, j + line)
+            tnode.applied.append((hyp.line, hyp.version, True))
+        else:
+            sorts_rollback(screen, tl)
+    if unifies1 or unifies2 or unifies3:
+        line1 = j + line
+        # apply modus ponens
+        dep = tl.tlist1.dependency(line1)
+        dep = target_compatible(screen, tl, ttree, dep, line2, True)
+        if dep:
+            n1 = len(tlist1)
+            success = False
+            if unifies1:
+                success, dirty1, dirty2 = logic.modus_ponens(screen, tl, ttree, dep, line1, [line2], True)
+            elif unifies2:
+                success, dirty1, dirty2 = logic.modus_tollens(screen, tl, ttree, dep, line1, [line2], True)
+            elif unifies3:
+                success, dirty1, dirty2 = logic.limited_equality_substitution(screen, tl, ttree, dep, line1, line2, True, False)
+            if success:
+                for k in dirty1:
+                    atab.depth[k] = max(hdepth, idepth) + 1
+                update_autotab(screen, tl, atab, dirty1, dirty2, interface, 0)
+                dirty1, dirty2 = autocleanup(screen, tl, ttree)
+                for k in dirty1:
+                    atab.depth[k] = max(hdepth, idepth) + 1
+                update_autotab(screen, tl, atab, dirty1, dirty2, interface, 0)
+                #dirty1, dirty2, done, plist = check_targets_proved(screen, tl, ttree)
+                update_screen(screen, tl, interface, dirty1, dirty2)
+                c1 = check_duplicates(screen, tl, ttree, n1, len(tlist2), i, interface, atab.terms)
+                c2 = check_sizes(screen, tl, atab, n1, len(tlist2), interface)
+                c3 = check_trivial(screen, tl, atab, n1, interface)
+                if c1 and c2 and c3:
+                    progress = True
+                if autotab_remove_deadnodes(screen, tl, atab, n1, len(tlist2), interface):
+                    return progress, True
+    return progress, False
+
+def auto_load_libthm(screen, tl, ttree, search, filepos):
+    """
+    Load the library theorem at the given position in the library into the
+    hypotheses. Returns True if the tableau has become too large to continue.
+    """
+    atab = search.atab
+    interface = search.interface
+    search.inferences += 1
+    logic.library_import(screen, tl, search.library, filepos)
+    n1 = len(tl.tlist1.data)
+    n2 = len(tl.tlist1.data)       
+    j = len(tl.tlist1.data) - 1
+    atab.depth[j] = 0
+    update_autotab(screen, tl, atab, [j], [], interface)
+    search.libthms_loaded[filepos] = j
+    dirty1, dirty2 = autocleanup(screen, tl, ttree)
+    for k in dirty1:
+        atab.depth[k] = 0
+    update_autotab(screen, tl, atab, dirty1, dirty2, interface)
+    #dirty1, dirty2, done, plist = check_targets_proved(screen, tl, ttree)
+    update_screen(screen, tl, interface, dirty1, dirty2)
+    return autotab_remove_deadnodes(screen, tl, atab, n1, n2, interface)
+
+def auto_tar_libthm(screen, tl, ttree, search, i, tar, libthm):
+    """
+    Try to reason backwards from the target i, with AutoData tar, using the
+    library theorem libthm, as returned by filter_theorems2, loading it into
+    the hypotheses if it applies. Returns a pair (progress, stop) as for
+    auto_hyp_impl.
+    """
+    atab = search.atab
+    interface = search.interface
+    tlist1 = tl.tlist1.data
+    tlist2 = tl.tlist2.data
+    progress = False
+    (title, c, nc, filepos, line, cm, ncm) = libthm
+    search.inferences += 1
+    line2 = tar.line
+    unifies1 = False
+    unifies2 = False
+    unifies3 = False
+    if filepos in search.libthms_loaded:
+        j = search.libthms_loaded[filepos] # get position loaded in tableau
+        tnode = get_autonode(screen, atab.hyp_impls, j + line)
+        if tnode and (tar.line, tar.version, False) not in tnode.applied:
+            tnode.applied.append((tar.line, tar.version, False))
+            thm = tlist1[j + line]
+            thm, univs = unquantify(screen, thm, False) # remove quantifiers by taking temporary metavars
+            if isinstance(thm, ImpliesNode):
+                thm, _ = relabel(screen, tl, univs, thm, True)
+                prec, u = unquantify(screen, thm.right, False)
+                if not isinstance(prec, AndNode):
+                    # check if precedent unifies with hyp
+                    unifies1, assign, macros = unify_head(screen, tl, prec, tar, tlist2[line2])
+                if not unifies1:
+                    prec, u = unquantify(screen, thm.left, True)
+                    if not isinstance(prec, AndNode):
+                        # check if precedent unifies with hyp
+                        unifies2, assign, macros = unify_head(screen, tl, complement_tree(prec), tar, tlist2[line2])
+            elif isinstance(thm, EqNode):
+                unifies3, _, _ = logic.limited_equality_substitution(screen, tl, ttree, None, \
+                                                         j + line, line2, False, True)
+    else: # library theorem not yet loaded
+        fake_tl = search.import_cache.get(filepos, tl.vars)
+        if fake_tl != None:
+            fake_tl.stree = tl.stree # copy sort tree from tl
+            sorts_mark(screen, tl)
+        else:
+            fake_tl = TreeList()
+            fake_tl.vars = deepcopy(tl.vars) # copy variable subscript record from tl
+            fake_tl.stree = tl.stree # copy sort tree from tl
+            sorts_mark(screen, tl)
+            logic.library_import(screen, fake_tl, search.library, filepos)
+            autocleanup(screen, fake_tl, search.fake_ttree)
+            search.import_cache.put(filepos, tl.vars, fake_tl)
+        thm = fake_tl.tlist1.data[line]
+        thm, univs = unquantify(screen, thm, False) # remove quantifiers by taking temporary metavars
+        thm, _ = relabel(screen, fake_tl, univs, thm, True)
+        if isinstance(thm, ImpliesNode):
+            prec, u = unquantify(screen, thm.right, False)
+            # check theorem has only one precedent
+            if not isinstance(prec, AndNode):
+                # check if precedent unifies with hyp
+                unifies1, assign, macros = unify_head(screen, fake_tl, prec, tar, tlist2[line2])
+            if not unifies1:
+                prec, u = unquantify(screen, thm.left, True)
+                unifies2, assign, macros = unify_head(screen, fake_tl, complement_tree(prec), tar, tlist2[line2])
+        elif isinstance(thm, EqNode):
+            fake_tl.tlist2.data.append(tlist2[line2])
+            unifies3, _, _ = logic.limited_equality_substitution(screen, fake_tl, ttree, None, \
+                                                         line, len(fake_tl.tlist2.data) - 1, False, True)
+            del fake_tl.tlist2.data[len(fake_tl.tlist2.data) - 1]
+        if unifies1 or unifies2 or unifies3:
+            # transfer library result to tableau
+            dirty1 = []
+            dirty2 = []
+            j = len(tlist1)
+            fake_tlist0 = fake_tl.tlist0.data
+            if fake_tlist0:
+                append_quantifiers(tl.tlist0.data, fake_tlist0[0])
+            fake_list1 = fake_tl.tlist1.data
+            for k in range(len(fake_list1)):
+                append_tree(tlist1, fake_list1[k], dirty1)
+                atab.depth[len(tlist1) - 1] = 0
+            search.libthms_loaded[filepos] = j
+            search.import_cache.remove(filepos)
+            tl.vars = fake_tl.vars
+            tl.stree = fake_tl.stree
+            update_autotab(screen, tl, atab, dirty1, dirty2, interface)
+            tnode = get_autonode(screen, atab.hyp_impls, j + line)
+            tnode.applied.append((tar.line, tar.version, False))
+        else:
+            sorts_rollback(screen, tl)
+    if unifies1 or unifies2 or unifies3:
+        line1 = j + line
+        # apply modus ponens
+        dep = tl.tlist1.dependency(line1)
+        dep = target_compatible(screen, tl, ttree, dep, line2, False)
+        if dep:
+            n1 = len(tl.tlist1.data)
+            n2 = len(tl.tlist2.data)
+            var1 = metavars_used(tlist1[line1].left)
+            var2 = metavars_used(tlist1[line1].right)
+            if search.mode == 1 or set(var1).issubset(var2):
+                if unifies1:
+                    success, dirty1, dirty2 = logic.modus_ponens(screen, tl, ttree, dep, line1, [line2], False)
+                elif unifies2:
+                    success, dirty1, dirty2 = logic.modus_tollens(screen, tl, ttree, dep, line1, [line2], False)
+                elif unifies3:
+                    success, dirty1, dirty2 = logic.limited_equality_substitution(screen, tl, ttree, dep, line1, line2, False, False)
+                if success:
+                    for k in dirty1:
+                        atab.depth[k] = 0
+                    update_autotab(screen, tl, atab, dirty1, dirty2, interface)
+                    dirty1, dirty2 = autocleanup(screen, tl, ttree)
+                    for k in dirty1:
+                        atab.depth[k] = 0
+                    update_autotab(screen, tl, atab, dirty1, dirty2, interface)
+                    #dirty1, dirty2, done, plist = check_targets_proved(screen, tl, ttree)
+                    update_screen(screen, tl, interface, dirty1, dirty2)
+                    c1 = check_duplicates(screen, tl, ttree, n1, n2, i, interface, atab.terms)
+                    c2 = check_sizes(screen, tl, atab, n1, n2, interface)
+                    if c1 and c2:
+                        progress = True
+                    if autotab_remove_deadnodes(screen, tl, atab, n1, n2, interface):
+                        return progress, True
+                    #wind_skolems(screen, tl, atab)
+    return progress, False
+
+def automate(screen, tl, ttree, interface='curses', schedule='loop', deadline=None, \
+             max_inferences=None, max_memory=None):
+    """
+    Try to prove the targets of the tableau automatically. The schedule is
+    'loop' to work through the targets in order, trying the inferences that
+    can be made for each in turn and increasing the search depth when none
+    make progress, or 'best' to try the most promising inferences first (see
+    automate_best_first).
+    The search stops before the next inference once time.monotonic() passes
+    the deadline, max_inferences inferences have been tried or the memory
+    currently used by the process exceeds max_memory bytes (see
+    AutoSearch.memory_exceeded), if these are given. Any targets proved by
+    the inferences made so far are then marked as proved. Returns an
+    AutoResult, which is true if all targets are proved.
+    """
+    start = time.monotonic()
+    search = AutoSearch(screen, tl, interface)
+    search.deadline = deadline
+    search.max_inferences = max_inferences
+    search.max_memory = max_memory
+    if schedule == 'best':
+        done = automate_best_first(screen, tl, ttree, search)
+    else:
+        done = automate_loop(screen, tl, ttree, search)
+    search.library.close()
+    if not done and search.reason in ['time', 'inferences', 'memory']:
+        atab = search.atab
+        dirty1, dirty2, done, plist = check_targets_proved(screen, tl, ttree, atab.unchecked1, atab.unchecked2)
+        atab.unchecked1 = set()
+        atab.unchecked2 = set()
+        update_screen(screen, tl, interface, None, None)
+    if done:
+        search.reason = 'proved'
+    return AutoResult(done, search.reason, proved_targets(ttree), search.inferences, \
+                      time.monotonic() - start)
+
+def automate_loop(screen, tl, ttree, search):
+    atab = search.atab
+    interface = search.interface
     tlist1 = tl.tlist1.data
     tlist2 = tl.tlist2.data
-    atab = AutoTab(screen, tl) # initialise automation data structure
-    library = open("library.dat", "r")
-    index = create_index(screen, tl, library)
     done = False # whether all targets are proved
-    mode = 0 # mode 0 = no adding tar metavars, mode 1 = add tar metavars with iffs
-    current_depth = 1 # depth we are currently searching to
     depth_progress = False # whether we've made progress at current depth
     while True: # keep going until theorem proved or progress stalls
         # get next unproved target
@@ -636,391 +1391,72 @@ def automate(screen, tl, ttree, interface='curses'):
             for j in hyps:
                 hyp = get_autonode(screen, atab.hyp_heads, j)
                 hdepth = atab.depth[j]
-                if hyp and hdepth < current_depth: # hypothesis is a head
+                if hyp and hdepth < search.current_depth: # hypothesis is a head
                     progress = False
-                    line2 = hyp.line
                     hc = hyp.const1
                     ht = get_constants(screen, tl, tl.tlist0.data[0]) if tl.tlist0.data else []
                     # first check if any hyp_impls can be applied to head
                     for imp in atab.hyp_impls:
-                        pos = set(imp.const1).issubset(hc)
-                        neg = set(imp.nconst2).issubset(hc)
-                        line1 = imp.line
-                        idepth = atab.depth[line1]
-                        if imp.num_mv <= 0 and (pos or neg) and idepth < current_depth:
-                            unifies1 = False
-                            unifies2 = False
-                            unifies3 = False
-                            if (hyp.line, hyp.version, True) not in imp.applied:
-                                v1 = vars_used(screen, tl, tlist1[line1])
-                                v2 = vars_used(screen, tl, tlist1[line2])
-                                if v1 or v2: # ensure not applying metavar thm to metavar head
-                                    imp.applied.append((hyp.line, hyp.version, True))
-                                    thm = tlist1[line1]
-                                    thm, univs = unquantify(screen, thm, False) # remove quantifiers by taking temporary metavars
-                                    if isinstance(thm, ImpliesNode):
-                                        if pos:
-                                            prec, u = unquantify(screen, thm.left, True)
-                                            if not isinstance(prec, AndNode):
-                                                # check if precedent unifies with hyp
-                                                unifies1, assign, macros = unify(screen, tl, prec, tlist1[line2])
-                                                # check all metavars were assigned
-                                                #if unifies1 and metavars_used(substitute(deepcopy(prec), assign)):
-                                                #    unifies1 = False
-                                        if neg:
-                                            prec, u = unquantify(screen, thm.right, True)
-                                            if not isinstance(prec, AndNode):
-                                                # check if neg consequent unifies with hyp
-                                                comp = complement_tree(prec)
-                                                unifies2, assign, macros = unify(screen, tl, comp, tlist1[line2])
-                                                # check all metavars were assigned
-                                                #if unifies2 and metavars_used(substitute(deepcopy(comp), assign)):
-                                                #    unifies2 = False
-                                    elif isinstance(thm, EqNode):
-                                        unifies3, _, _ = logic.limited_equality_substitution(screen, tl, ttree, None, \
-                                                                                    line1, line2, True, True)
-                            if unifies1 or unifies2 or unifies3:
-                                # apply modus ponens and or modus tollens
-                                dep = tl.tlist1.dependency(line1)
-                                dep = target_compatible(screen, tl, ttree, dep, line2, True)
-                                if dep:
-                                    success = False
-                                    n1 = len(tl.tlist1.data)
-                                    if unifies1:
-                                        success, dirty1, dirty2 = logic.modus_ponens(screen, tl, ttree, dep, line1, [line2], True)
-                                    if not success and unifies2:
-                                        success, dirty1, dirty2 = logic.modus_tollens(screen, tl, ttree, dep, line1, [line2], True)
-                                    if unifies3:
-                                        success, dirty1, dirty2 = logic.limited_equality_substitution(screen, tl, ttree, dep, line1, line2, True, False)
-                                    if success:
-                                        for k in dirty1:
-                                            atab.depth[k] = max(hdepth, idepth) + 1
-                                        mv_diff = hyp.num_mv + max(imp.num_mv, 0)
-                                        update_autotab(screen, tl, atab, dirty1, dirty2, interface, mv_diff)
-                                        dirty1, dirty2 = autocleanup(screen, tl, ttree)
-                                        for k in dirty1:
-                                            atab.depth[k] = max(hdepth, idepth) + 1
-                                        update_autotab(screen, tl, atab, dirty1, dirty2, interface, mv_diff)
-                                        #dirty1, dirty2, done, plist = check_targets_proved(screen, tl, ttree)
-                                        update_screen(screen, tl, interface, dirty1, dirty2)
-                                        c1 = check_duplicates(screen, tl, ttree, n1, len(tlist2), i, interface)
-                                        c2 = check_sizes(screen, tl, atab, n1, len(tlist2), interface)
-                                        c3 = check_trivial(screen, tl, atab, n1, interface)
-                                        if c1 and c2 and c3:
-                                            hprogress = True
-                                            progress = True
-                                        if autotab_remove_deadnodes(screen, tl, atab, n1, len(tlist2), interface):
-                                            library.close()
-                                            return False
-                                        if done:
-                                            update_screen(screen, tl, interface, None, None)
-                                            library.close()
-                                            return True
+                        if search.budget_spent():
+                            return False
+                        p, stop = auto_hyp_impl(screen, tl, ttree, search, i, hyp, imp)
+                        if stop:
+                            search.reason = 'size'
+                            return False
+                        if p:
+                            hprogress = True
+                            progress = True
                     # if no progress, look for library result that can be applied to head
                     if not progress:
-                        libthms = filter_theorems1(screen, index, ht, hc)
-                        for (title, c, nc, filepos, line) in libthms:
-                            # check to see if thm already loaded
-                            unifies1 = False
-                            unifies2 = False
-                            unifies3 = False
-                            if filepos in libthms_loaded:
-                                j = libthms_loaded[filepos] # get position loaded in tableau
-                                tnode = get_autonode(screen, atab.hyp_impls, j + line)
-                                idepth = atab.depth[j + line]
-                                if tnode and tnode.num_mv <= 0 and \
-                                   (hyp.line, hyp.version, True) not in tnode.applied and \
-                                   idepth < current_depth:
-                                    tnode.applied.append((hyp.line, hyp.version, True))
-                                    thm = tlist1[j + line]
-                                    thm, univs = unquantify(screen, thm, False) # remove quantifiers by taking temporary metavars
-                                    if isinstance(thm, ImpliesNode):
-                                        prec, u = unquantify(screen, thm.left, True)
-                                        if not isinstance(prec, AndNode):
-                                            # check if precedent unifies with hyp
-                                            v1 = vars_used(screen, tl, prec)
-                                            v2 = vars_used(screen, tl, tlist1[line2])
-                                            if v1 or v2: # ensure not applying metavar thm to metavar head
-                                                unifies1, assign, macros = unify(screen, tl, prec, tlist1[line2])
-                                                # check all metavars were assigned
-                                                #if unifies1 and metavars_used(substitute(deepcopy(prec), assign)):
-                                                #    unifies1 = False
-                                        if not unifies1:
-                                            prec, u = unquantify(screen, thm.right, False)
-                                            if not isinstance(prec, AndNode):
-                                                # check if precedent unifies with hyp
-                                                v1 = vars_used(screen, tl, prec)
-                                                v2 = vars_used(screen, tl, tlist1[line2])
-                                                if v1 or v2: # ensure not applying metavar thm to metavar head
-                                                    comp = complement_tree(prec)
-                                                    unifies2, assign, macros = unify(screen, tl, comp, tlist1[line2])
-                                                    # check all metavars were assigned
-                                                    #if unifies2 and metavars_used(substitute(deepcopy(comp), assign)):
-                                                    #    unifies2 = False
-                                    elif isinstance(thm, EqNode):
-                                        v1 = vars_used(screen, tl, tlist1[j + line])
-                                        v2 = vars_used(screen, tl, tlist1[line2])
-                                        if v1 or v2:  # ensure not applying metavar thm to metavar head
-                                            unifies3, _, _ = logic.limited_equality_substitution(screen, tl, ttree, None, \
-                                                                                 j + line, line2, True, True)
-                            else: # library theorem not yet loaded
-                                fake_tl = TreeList()
-                                fake_tl.vars = deepcopy(tl.vars) # copy variable subscript record from tl
-                                fake_tl.stree = tl.stree # copy sort tree from tl
-                                sorts_mark(screen, tl)
-                                logic.library_import(screen, fake_tl, library, filepos)
-                                autocleanup(screen, fake_tl, fake_ttree)
-                                thm = fake_tl.tlist1.data[line]
-                                # check theorem has only one precedent
-                                thm, univs = unquantify(screen, thm, False) # remove quantifiers by taking temporary metavars
-                                if isinstance(thm, ImpliesNode):
-                                    mv_diff = len(metavars_used(thm.right)) - len(metavars_used(thm.left))
-                                    prec, u = unquantify(screen, thm.left, True)
-                                    if not isinstance(prec, AndNode) and mv_diff <= 0:
-                                        # check if precedent unifies with hyp
-                                        v1 = vars_used(screen, tl, prec)
-                                        v2 = vars_used(screen, tl, tlist1[line2])
-                                        if v1 or v2: # ensure not applying metavar thm to metavar head
-                                            unifies1, assign, macros = unify(screen, fake_tl, prec, tlist1[line2])
-                                    if not unifies1:
-                                        prec, u = unquantify(screen, thm.right, False)
-                                        if not isinstance(prec, AndNode) and mv_diff <= 0:
-                                            # check if precedent unifies with hyp
-                                            v1 = vars_used(screen, tl, prec)
-                                            v2 = vars_used(screen, tl, tlist1[line2])
-                                            if v1 or v2: # ensure not applying metavar thm to metavar head
-                                                unifies2, assign, macros = unify(screen, fake_tl, complement_tree(prec), tlist1[line2])
-                                elif isinstance(thm, EqNode):
-                                    fake_tl.tlist1.data.append(tlist1[line2])
-                                    unifies3, _, _ = logic.limited_equality_substitution(screen, fake_tl, ttree, None, \
-                                                                                 line, len(fake_tl.tlist1.data) - 1, True, True)
-                                    del fake_tl.tlist1.data[len(fake_tl.tlist1.data) - 1]
-                                if unifies1 or unifies2 or unifies3:
-                                    # transfer library result to tableau
-                                    dirty1 = []
-                                    dirty2 = []
-                                    j = len(tlist1)
-                                    fake_tlist0 = fake_tl.tlist0.data
-                                    if fake_tlist0:
-                                        append_quantifiers(tl.tlist0.data, fake_tlist0[0])
-                                    #wind_skolems(screen, tl, atab)
-                                    fake_list1 = fake_tl.tlist1.data
-                                    for k in range(len(fake_list1)):
-                                        append_tree(tlist1, fake_list1[k], dirty1)
-                                        atab.depth[len(tlist1) - 1] = 0
-                                    idepth = 0
-                                    libthms_loaded[filepos] = j
-                                    tl.vars = fake_tl.vars
-                                    tl.stree = fake_tl.stree
-                                    update_autotab(screen, tl, atab, dirty1, dirty2, interface)
-                                    tnode = get_autonode(screen, atab.hyp_impls, j + line)
-                                    tnode.applied.append((hyp.line, hyp.version, True))
-                                else:
-                                    sorts_rollback(screen, tl)
-                            if unifies1 or unifies2 or unifies3:
-                                line1 = j + line
-                                # apply modus ponens
-                                dep = tl.tlist1.dependency(line1)
-                                dep = target_compatible(screen, tl, ttree, dep, line2, True)
-                                if dep:
-                                    n1 = len(tlist1)
-                                    success = False
-                                    if unifies1:
-                                        success, dirty1, dirty2 = logic.modus_ponens(screen, tl, ttree, dep, line1, [line2], True)
-                                    elif unifies2:
-                                        success, dirty1, dirty2 = logic.modus_tollens(screen, tl, ttree, dep, line1, [line2], True)
-                                    elif unifies3:
-                                        success, dirty1, dirty2 = logic.limited_equality_substitution(screen, tl, ttree, dep, line1, line2, True, False)
-                                    if success:
-                                        for k in dirty1:
-                                            atab.depth[k] = max(hdepth, idepth) + 1
-                                        update_autotab(screen, tl, atab, dirty1, dirty2, interface, 0)
-                                        dirty1, dirty2 = autocleanup(screen, tl, ttree)
-                                        for k in dirty1:
-                                            atab.depth[k] = max(hdepth, idepth) + 1
-                                        update_autotab(screen, tl, atab, dirty1, dirty2, interface, 0)
-                                        #dirty1, dirty2, done, plist = check_targets_proved(screen, tl, ttree)
-                                        update_screen(screen, tl, interface, dirty1, dirty2)
-                                        c1 = check_duplicates(screen, tl, ttree, n1, len(tlist2), i, interface)
-                                        c2 = check_sizes(screen, tl, atab, n1, len(tlist2), interface)
-                                        c3 = check_trivial(screen, tl, atab, n1, interface)
-                                        if c1 and c2 and c3:
-                                            hprogress = True
-                                        if autotab_remove_deadnodes(screen, tl, atab, n1, len(tlist2), interface):
-                                            library.close()
-                                            return False
-                                        if done:
-                                            update_screen(screen, tl, interface, None, None)
-                                            library.close()
-                                            return True
+                        libthms = filter_theorems1(screen, search.index, search.cindex, ht, hc)
+                        for libthm in libthms:
+                            if search.budget_spent():
+                                return False
+                            p, stop = auto_hyp_libthm(screen, tl, ttree, search, i, hyp, libthm)
+                            if stop:
+                                search.reason = 'size'
+                                return False
+                            if p:
+                                hprogress = True
             tar = get_autonode(screen, atab.tar_heads, i)
             if not done and tar:
                 # check if constants in target are all in hypotheses
                 tarc = tar.const1
-                hypc = []
-                heads = [] # list of autonodes for target compatible hyp_heads
-                impls = [] # list of autonodes for target compatible hyp_impls
-                for k in hyps:
-                    node = get_autonode(screen, atab.hyp_heads, k)
-                    if node:
-                        heads.append(node)
-                        c = node.const1
-                    else:
-                        node = get_autonode(screen, atab.hyp_impls, k)
-                        if node:
-                            impls.append(node)
-                            c = list_merge(node.const1, node.const2)
-                    hypc = list_merge(hypc, c)
+                hypc, hmask = hypothesis_constants(screen, atab, hyps)
                 tprogress = False # whether or not some progress is made on the target side
                 # first see if there are any theorems/defns to load which are not implications
-                libthms = filter_theorems3(screen, index, hypc, tarc)
-                for (title, c, nc, filepos, line) in libthms:
-                    headc = c[2][line]
+                libthms = filter_theorems3(screen, search.index, search.cindex, hypc, tarc)
+                for (title, c, nc, filepos, line, cm, ncm) in libthms:
                     # check to see if constants of libthm are among the hyp constants hypc
-                    if set(headc).issubset(hypc):
+                    if (cm[2][line] & ~hmask) == 0:
                         # check to see if thm already loaded, if not, load it
-                        if filepos not in libthms_loaded:
-                            logic.library_import(screen, tl, library, filepos)
-                            n1 = len(tl.tlist1.data)
-                            n2 = len(tl.tlist1.data)       
-                            j = len(tl.tlist1.data) - 1
-                            atab.depth[j] = 0
-                            update_autotab(screen, tl, atab, [j], [], interface)
-                            libthms_loaded[filepos] = j
-                            dirty1, dirty2 = autocleanup(screen, tl, ttree)
-                            for k in dirty1:
-                                atab.depth[k] = 0
-                            update_autotab(screen, tl, atab, dirty1, dirty2, interface)
-                            #dirty1, dirty2, done, plist = check_targets_proved(screen, tl, ttree)
-                            update_screen(screen, tl, interface, dirty1, dirty2)
-                            if autotab_remove_deadnodes(screen, tl, atab, n1, n2, interface):
-                                library.close()
+                        if filepos not in search.libthms_loaded:
+                            if search.budget_spent():
+                                return False
+                            if auto_load_libthm(screen, tl, ttree, search, filepos):
+                                search.reason = 'size'
                                 return False
-                            if done:
-                                update_screen(screen, tl, interface, None, None)
-                                library.close()
-                                return True
                 # try to find a theorem that applies to the target
                 if not tprogress:
-                    libthms = filter_theorems2(screen, index, tarc, mode)
-                    for (title, c, nc, filepos, line) in libthms:
-                        implc = c[2][line].left
-                        nimplc = nc[2][line].right
-                        pos = set(implc).issubset(hypc)
-                        neg = set(nimplc).issubset(hypc)
+                    libthms = filter_theorems2(screen, search.index, search.cindex, tarc, search.mode)
+                    for libthm in libthms:
+                        (title, c, nc, filepos, line, cm, ncm) = libthm
+                        pos = (cm[2][line].left & ~hmask) == 0
+                        neg = (ncm[2][line].right & ~hmask) == 0
                         # check to see if constants of libthm are among the hyp constants hypc
                         if (pos or neg or \
                            not hypc or not atab.hyp_impls or not atab.hyp_heads):
-                            # check to see if thm already loaded
-                            line2 = tar.line
-                            unifies1 = False
-                            unifies2 = False
-                            unifies3 = False
-                            if filepos in libthms_loaded:
-                                j = libthms_loaded[filepos] # get position loaded in tableau
-                                tnode = get_autonode(screen, atab.hyp_impls, j + line)
-                                if tnode and (tar.line, tar.version, False) not in tnode.applied:
-                                    tnode.applied.append((tar.line, tar.version, False))
-                                    thm = tlist1[j + line]
-                                    thm, univs = unquantify(screen, thm, False) # remove quantifiers by taking temporary metavars
-                                    if isinstance(thm, ImpliesNode):
-                                        thm, _ = relabel(screen, tl, univs, thm, True)
-                                        prec, u = unquantify(screen, thm.right, False)
-                                        if not isinstance(prec, AndNode):
-                                            # check if precedent unifies with hyp
-                                            unifies1, assign, macros = unify(screen, tl, prec, tlist2[line2])
-                                        if not unifies1:
-                                            prec, u = unquantify(screen, thm.left, True)
-                                            if not isinstance(prec, AndNode):
-                                                # check if precedent unifies with hyp
-                                                unifies2, assign, macros = unify(screen, tl, complement_tree(prec), tlist2[line2])
-                                    elif isinstance(thm, EqNode):
-                                        unifies3, _, _ = logic.limited_equality_substitution(screen, tl, ttree, None, \
-                                                                                 j + line, line2, False, True)
-                            else: # library theorem not yet loaded
-                                fake_tl = TreeList()
-                                fake_tl.vars = deepcopy(tl.vars) # copy variable subscript record from tl
-                                fake_tl.stree = tl.stree # copy sort tree from tl
-                                sorts_mark(screen, tl)
-                                logic.library_import(screen, fake_tl, library, filepos)
-                                autocleanup(screen, fake_tl, fake_ttree)
-                                thm = fake_tl.tlist1.data[line]
-                                thm, univs = unquantify(screen, thm, False) # remove quantifiers by taking temporary metavars
-                                thm, _ = relabel(screen, fake_tl, univs, thm, True)
-                                if isinstance(thm, ImpliesNode):
-                                    prec, u = unquantify(screen, thm.right, False)
-                                    # check theorem has only one precedent
-                                    if not isinstance(prec, AndNode):
-                                        # check if precedent unifies with hyp
-                                        unifies1, assign, macros = unify(screen, fake_tl, prec, tlist2[line2])
-                                    if not unifies1:
-                                        prec, u = unquantify(screen, thm.left, True)
-                                        unifies2, assign, macros = unify(screen, fake_tl, complement_tree(prec), tlist2[line2])
-                                elif isinstance(thm, EqNode):
-                                    fake_tl.tlist2.data.append(tlist2[line2])
-                                    unifies3, _, _ = logic.limited_equality_substitution(screen, fake_tl, ttree, None, \
-                                                                                 line, len(fake_tl.tlist2.data) - 1, False, True)
-                                    del fake_tl.tlist2.data[len(fake_tl.tlist2.data) - 1]
-                                if unifies1 or unifies2 or unifies3:
-                                    # transfer library result to tableau
-                                    dirty1 = []
-                                    dirty2 = []
-                                    j = len(tlist1)
-                                    fake_tlist0 = fake_tl.tlist0.data
-                                    if fake_tlist0:
-                                        append_quantifiers(tl.tlist0.data, fake_tlist0[0])
-                                    fake_list1 = fake_tl.tlist1.data
-                                    for k in range(len(fake_list1)):
-                                        append_tree(tlist1, fake_list1[k], dirty1)
-                                        atab.depth[len(tlist1) - 1] = 0
-                                    libthms_loaded[filepos] = j
-                                    tl.vars = fake_tl.vars
-                                    tl.stree = fake_tl.stree
-                                    update_autotab(screen, tl, atab, dirty1, dirty2, interface)
-                                    tnode = get_autonode(screen, atab.hyp_impls, j + line)
-                                    tnode.applied.append((tar.line, tar.version, False))
-                                else:
-                                    sorts_rollback(screen, tl)
-                            if unifies1 or unifies2 or unifies3:
-                                line1 = j + line
-                                # apply modus ponens
-                                dep = tl.tlist1.dependency(line1)
-                                dep = target_compatible(screen, tl, ttree, dep, line2, False)
-                                if dep:
-                                    n1 = len(tl.tlist1.data)
-                                    n2 = len(tl.tlist2.data)
-                                    var1 = metavars_used(tlist1[line1].left)
-                                    var2 = metavars_used(tlist1[line1].right)
-                                    if mode == 1 or set(var1).issubset(var2):
-                                        if unifies1:
-                                            success, dirty1, dirty2 = logic.modus_ponens(screen, tl, ttree, dep, line1, [line2], False)
-                                        elif unifies2:
-                                            success, dirty1, dirty2 = logic.modus_tollens(screen, tl, ttree, dep, line1, [line2], False)
-                                        elif unifies3:
-                                            success, dirty1, dirty2 = logic.limited_equality_substitution(screen, tl, ttree, dep, line1, line2, False, False)
-                                        if success:
-                                            for k in dirty1:
-                                                atab.depth[k] = 0
-                                            update_autotab(screen, tl, atab, dirty1, dirty2, interface)
-                                            dirty1, dirty2 = autocleanup(screen, tl, ttree)
-                                            for k in dirty1:
-                                                atab.depth[k] = 0
-                                            update_autotab(screen, tl, atab, dirty1, dirty2, interface)
-                                            #dirty1, dirty2, done, plist = check_targets_proved(screen, tl, ttree)
-                                            update_screen(screen, tl, interface, dirty1, dirty2)
-                                            c1 = check_duplicates(screen, tl, ttree, n1, n2, i, interface)
-                                            c2 = check_sizes(screen, tl, atab, n1, n2, interface)
-                                            if c1 and c2:
-                                                tprogress = True
-                                            if autotab_remove_deadnodes(screen, tl, atab, n1, n2, interface):
-                                                library.close()
-                                                return False
-                                            if done:
-                                                update_screen(screen, tl, interface, None, None)
-                                                library.close()
-                                                return True
-                                            #wind_skolems(screen, tl, atab)
-            dirty1, dirty2, done, plist = check_targets_proved(screen, tl, ttree)
+                            if search.budget_spent():
+                                return False
+                            p, stop = auto_tar_libthm(screen, tl, ttree, search, i, tar, libthm)
+                            if stop:
+                                search.reason = 'size'
+                                return False
+                            if p:
+                                tprogress = True
+            dirty1, dirty2, done, plist = check_targets_proved(screen, tl, ttree, atab.unchecked1, atab.unchecked2)
+            atab.unchecked1 = set()
+            atab.unchecked2 = set()
             update_screen(screen, tl, interface, dirty1, dirty2)
             if done:
                 return True
@@ -1031,14 +1467,258 @@ def automate(screen, tl, ttree, interface='curses'):
                 depth_progress = True
         if not made_progress: # we aren't getting anywhere
             if depth_progress:
-                current_depth += 1 # search to higher depth
+                search.current_depth += 1 # search to higher depth
                 depth_progress = False
             else:
-                if mode < 1: # try more extreme things
-                    mode += 1
+                if search.mode < 1: # try more extreme things
+                    search.mode += 1
                 else:
                     update_screen(screen, tl, interface, None, None)
-                    library.close()
                     return False
 
-        
\ No newline at end of file
+def bit_count(mask):
+    return bin(mask).count("1")
+
+def consequent_mask(mask):
+    """
+    Given the bitmask of the constants of a line of a library theorem, as
+    returned by mask_consts, return the bitmask of the constants of its
+    consequent if it is an implication, otherwise of the whole line.
+    """
+    return mask if isinstance(mask, int) else mask.right
+
+def line_size(screen, tl, dat, tree):
+    """
+    Return the type size (depth plus width) of the given tree, which is the
+    line with the given AutoData. The size is kept in the AutoData.
+    """
+    if dat.size == None:
+        d, w, f = max_type_size(screen, tl, tree)
+        dat.size = d + w
+    return dat.size
+
+def score_inference(depth, size, overlap, mv):
+    """
+    Return the score of an inference for best-first search, given the search
+    depth of the hypotheses it will give, the type size of the line it is
+    applied to, the number of constants it shares with its target and the
+    number of metavariables it adds. Inferences with lower scores are made
+    first.
+    """
+    return score_depth*depth + score_size*size - score_overlap*overlap + score_mv*max(mv, 0)
+
+class AutoQueue:
+    """
+    Priority queue of the inferences which best-first search may make, each
+    with a score. Inferences with equal scores are made in the order pushed.
+    """
+    def __init__(self):
+        self.heap = [] # entries (score, count, kind, args)
+        self.count = 0 # number of inferences pushed
+        self.pushed = set() # keys of inferences pushed, so that none is pushed twice
+
+    def push(self, score, key, kind, args):
+        if key not in self.pushed:
+            self.pushed.add(key)
+            heapq.heappush(self.heap, (score, self.count, kind, args))
+            self.count += 1
+
+    def pop(self):
+        score, count, kind, args = heapq.heappop(self.heap)
+        return kind, args
+
+def schedule_impl(screen, tl, ttree, search, queue, i, hyp, imp):
+    """
+    Push the application of the implication or equality with AutoData imp to
+    the head with AutoData hyp, for the benefit of target i, if it might be
+    made by auto_hyp_impl.
+    """
+    atab = search.atab
+    hdepth = atab.depth[hyp.line]
+    idepth = atab.depth[imp.line]
+    pos = (imp.mask1 & ~hyp.mask1) == 0
+    neg = (imp.nmask2 & ~hyp.mask1) == 0
+    if imp.num_mv <= 0 and (pos or neg) and idepth < best_first_depth and \
+       (hyp.line, hyp.version, True) not in imp.applied:
+        tar = atab.tar_heads.get(i)
+        overlap = bit_count(imp.mask2 & tar.mask1) if tar else 0
+        size = line_size(screen, tl, hyp, tl.tlist1.data[hyp.line])
+        score = score_inference(max(hdepth, idepth) + 1, size, overlap, hyp.num_mv + imp.num_mv)
+        key = ('impl', hyp.line, hyp.version, imp.line, imp.version)
+        queue.push(score, key, 'impl', (i, hyp, imp))
+
+def schedule_head(screen, tl, ttree, search, queue, i, hyp):
+    """
+    Push the inferences that can be made with the head with AutoData hyp, for
+    the benefit of target i, using the implications and equalities in the
+    hypotheses and the library theorems returned by filter_theorems1.
+    """
+    atab = search.atab
+    key = ('head', hyp.line, hyp.version)
+    hdepth = atab.depth[hyp.line]
+    if key in queue.pushed or hdepth >= best_first_depth:
+        return
+    queue.pushed.add(key)
+    for imp in atab.hyp_impls:
+        if not isinstance(tl.tlist1.data[imp.line], DeadNode):
+            schedule_impl(screen, tl, ttree, search, queue, i, hyp, imp)
+    tar = atab.tar_heads.get(i)
+    tmask = tar.mask1 if tar else 0
+    size = line_size(screen, tl, hyp, tl.tlist1.data[hyp.line])
+    ht = get_constants(screen, tl, tl.tlist0.data[0]) if tl.tlist0.data else []
+    for libthm in filter_theorems1(screen, search.index, search.cindex, ht, hyp.const1):
+        (title, c, nc, filepos, line, cm, ncm) = libthm
+        overlap = bit_count(consequent_mask(cm[2][line]) & tmask)
+        key = ('hyplib', hyp.line, hyp.version, filepos, line)
+        queue.push(score_inference(hdepth + 1, size, overlap, 0), key, 'hyplib', (i, hyp, libthm))
+
+def schedule_target(screen, tl, ttree, search, queue, i):
+    """
+    Push the inferences that can be made for target i on the target side,
+    i.e. loading library theorems returned by filter_theorems3 whose
+    constants are all in the hypotheses and reasoning backwards from the
+    target with those returned by filter_theorems2.
+    """
+    atab = search.atab
+    tlist1 = tl.tlist1.data
+    tar = atab.tar_heads.get(i)
+    if not tar:
+        return
+    hyps = [j for j in range(len(tlist1)) if deps_compatible(screen, tl, ttree, i, j)]
+    hypc, hmask = hypothesis_constants(screen, atab, hyps)
+    size = line_size(screen, tl, tar, tl.tlist2.data[i])
+    for (title, c, nc, filepos, line, cm, ncm) in filter_theorems3(screen, search.index, search.cindex, hypc, tar.const1):
+        if (cm[2][line] & ~hmask) == 0 and filepos not in search.libthms_loaded:
+            overlap = bit_count(cm[2][line] & tar.mask1)
+            queue.push(score_inference(0, 0, overlap, 0), ('defn', filepos), 'defn', (filepos,))
+    for libthm in filter_theorems2(screen, search.index, search.cindex, tar.const1, search.mode):
+        (title, c, nc, filepos, line, cm, ncm) = libthm
+        pos = (cm[2][line].left & ~hmask) == 0
+        neg = (ncm[2][line].right & ~hmask) == 0
+        if pos or neg or not hypc or not atab.hyp_impls or not atab.hyp_heads:
+            overlap = bit_count(cm[2][line].left & hmask)
+            key = ('tarlib', tar.line, tar.version, filepos, line)
+            queue.push(score_inference(0, size, overlap, 0), key, 'tarlib', (i, tar, libthm))
+
+def schedule_lines(screen, tl, ttree, search, queue, lines1, lines2):
+    """
+    Push the inferences that can be made using the given lists of hypotheses
+    and targets, which are new or have changed, and those for any targets
+    whose compatible hypotheses have changed.
+    """
+    atab = search.atab
+    tlist1 = tl.tlist1.data
+    tlist2 = tl.tlist2.data
+    targets = [i for i in range(len(tlist2)) if not isinstance(tlist2[i], DeadNode)]
+    compatible = dict() # hypothesis -> list of compatible targets
+
+    def compatible_targets(j):
+        if j not in compatible:
+            compatible[j] = [i for i in targets if deps_compatible(screen, tl, ttree, i, j)]
+        return compatible[j]
+
+    touched = set(i for i in lines2 if i < len(tlist2) and not isinstance(tlist2[i], DeadNode))
+    for j in lines1:
+        if j >= len(tlist1) or isinstance(tlist1[j], DeadNode):
+            continue
+        tars = compatible_targets(j)
+        touched.update(tars)
+        hyp = atab.hyp_heads.get(j)
+        if hyp and tars:
+            schedule_head(screen, tl, ttree, search, queue, tars[0], hyp)
+        imp = atab.hyp_impls.get(j)
+        if imp:
+            for hyp in atab.hyp_heads:
+                if not isinstance(tlist1[hyp.line], DeadNode) and atab.depth[hyp.line] < best_first_depth:
+                    tars = compatible_targets(hyp.line)
+                    if tars:
+                        schedule_impl(screen, tl, ttree, search, queue, tars[0], hyp, imp)
+    for i in sorted(touched):
+        if i in lines2:
+            for j in range(len(tlist1)):
+                hyp = atab.hyp_heads.get(j)
+                if hyp and not isinstance(tlist1[j], DeadNode) and \
+                   deps_compatible(screen, tl, ttree, i, j):
+                    schedule_head(screen, tl, ttree, search, queue, i, hyp)
+        schedule_target(screen, tl, ttree, search, queue, i)
+
+def inference_valid(screen, tl, search, kind, args):
+    """
+    Return True if the given inference popped from the queue can still be
+    made, i.e. the lines it uses have not changed or died since it was pushed.
+    """
+    atab = search.atab
+    tlist1 = tl.tlist1.data
+    tlist2 = tl.tlist2.data
+    if kind == 'defn':
+        return args[0] not in search.libthms_loaded
+    i = args[0]
+    if isinstance(tlist2[i], DeadNode):
+        return False
+    if kind == 'tarlib':
+        return atab.tar_heads.get(args[1].line) is args[1]
+    hyp = args[1]
+    if atab.hyp_heads.get(hyp.line) is not hyp or isinstance(tlist1[hyp.line], DeadNode):
+        return False
+    if kind == 'impl':
+        imp = args[2]
+        return atab.hyp_impls.get(imp.line) is imp and not isinstance(tlist1[imp.line], DeadNode)
+    return True
+
+def automate_best_first(screen, tl, ttree, search):
+    """
+    Best-first search. Each inference automate_loop might make is pushed on
+    a queue, with a score given by score_inference, and the inference with
+    the lowest score is made next, rather than working through the targets
+    in order. Whenever the tableau changes, the inferences which can be made
+    with new and changed lines are pushed. Hypotheses of search depth
+    best_first_depth or more are not used. When the queue is empty, the
+    search continues in mode 1, and then gives up.
+    """
+    atab = search.atab
+    interface = search.interface
+    tlist1 = tl.tlist1.data
+    tlist2 = tl.tlist2.data
+    search.current_depth = best_first_depth
+    queue = AutoQueue()
+    dirty1, dirty2, done, plist = check_targets_proved(screen, tl, ttree, atab.unchecked1, atab.unchecked2)
+    atab.unchecked1 = set()
+    atab.unchecked2 = set()
+    update_screen(screen, tl, interface, dirty1, dirty2)
+    if done:
+        return True
+    schedule_lines(screen, tl, ttree, search, queue, range(len(tlist1)), range(len(tlist2)))
+    while True:
+        while queue.heap:
+            kind, args = queue.pop()
+            if not inference_valid(screen, tl, search, kind, args):
+                continue
+            if search.budget_spent():
+                return False
+            if kind == 'impl':
+                progress, stop = auto_hyp_impl(screen, tl, ttree, search, *args)
+            elif kind == 'hyplib':
+                progress, stop = auto_hyp_libthm(screen, tl, ttree, search, *args)
+            elif kind == 'defn':
+                stop = auto_load_libthm(screen, tl, ttree, search, *args)
+            else:
+                progress, stop = auto_tar_libthm(screen, tl, ttree, search, *args)
+            if stop:
+                search.reason = 'size'
+                return False
+            if atab.unchecked1 or atab.unchecked2: # tableau has changed
+                lines1 = sorted(atab.unchecked1)
+                lines2 = sorted(atab.unchecked2)
+                dirty1, dirty2, done, plist = check_targets_proved(screen, tl, ttree, atab.unchecked1, atab.unchecked2)
+                atab.unchecked1 = set()
+                atab.unchecked2 = set()
+                update_screen(screen, tl, interface, dirty1, dirty2)
+                if done:
+                    return True
+                schedule_lines(screen, tl, ttree, search, queue, lines1, lines2)
+        if search.mode < 1: # try more extreme things
+            search.mode += 1
+            schedule_lines(screen, tl, ttree, search, queue, [], range(len(tlist2)))
+        else:
+            update_screen(screen, tl, interface, None, None)
+            return False
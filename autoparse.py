@@ -2,6 +2,17 @@ from parsimonious.grammar import Grammar
 from parsimonious.nodes import NodeVisitor, Node
 from parsimonious import exceptions
 from nodes import AutoImplNode, AutoIffNode, AutoEqNode
+import json
+
+consts_version = 2 # version of the constants header written to the library
+
+# Version 1 (legacy) constants headers are python style lists, e.g.
+#    [['Real'], [], (['='], ['+', '='])]
+# and are parsed by the grammar below. Version 2 headers are a version prefix
+# followed by a single JSON array, e.g.
+#    2:[["Real"],[],{"impl":[["="],["+","="]]}]
+# in which implications, iffs and equalities are objects with a single key
+# "impl", "iff" or "eq" respectively and heads are lists of strings.
 
 conststring = Grammar(
     r"""
@@ -47,7 +58,7 @@ class ConststringVisitor(NodeVisitor):
     def visit_text(self, node, visited_children):
         return eval(node.text)
 
-def parse_consts(screen, string):
+def parse_legacy_consts(screen, string):
     try:
         ast = conststring.parse(string) # parse input
         visitor = ConststringVisitor()
@@ -57,4 +68,48 @@ def parse_consts(screen, string):
         return False, "Extra characters on line, starting at column "+str(index + 1)
     except exceptions.ParseError as inst:
         index = inst.pos
-        return False, "Error in statement starting at column "+str(index + 1)
\ No newline at end of file
+        return False, "Error in statement starting at column "+str(index + 1)
+
+auto_nodes = {"impl" : AutoImplNode, "iff" : AutoIffNode, "eq" : AutoEqNode}
+auto_keys = {AutoImplNode : "impl", AutoIffNode : "iff", AutoEqNode : "eq"}
+
+def parse_consts(screen, string):
+    """
+    Parse a constants header line from the library, in either the current or
+    the legacy format. Returns a pair (success, consts) where consts is a
+    triple consisting of the type constants, the constants of any predicate
+    and a list of theorems, each of which is either a list of constants (for
+    a head) or an AutoImplNode, AutoIffNode or AutoEqNode with lists of
+    constants on the left and right. If parsing fails, consts is replaced by
+    an error message.
+    """
+    if string.startswith('['):
+        return parse_legacy_consts(screen, string)
+    version, sep, data = string.partition(':')
+    if version != str(consts_version) or not sep:
+        return False, "Unknown constants header version"
+    try:
+        header = json.loads(data)
+        thmlist = []
+        for thm in header[2]:
+            if isinstance(thm, dict):
+                (key, (left, right)), = thm.items()
+                thmlist.append(auto_nodes[key](left, right))
+            else:
+                thmlist.append(thm)
+        return True, (header[0], header[1], thmlist)
+    except (ValueError, TypeError, KeyError, IndexError) as inst:
+        return False, "Invalid constants header: "+str(inst)
+
+def format_consts(consts):
+    """
+    Given a triple of constants, as returned by parse_consts, return a string
+    (without newline) encoding it as a constants header in the current format.
+    """
+    thmlist = []
+    for thm in consts[2]:
+        if isinstance(thm, list):
+            thmlist.append(thm)
+        else:
+            thmlist.append({auto_keys[type(thm)] : [thm.left, thm.right]})
+    return str(consts_version)+":"+json.dumps([consts[0], consts[1], thmlist], separators=(',', ':'))
@@ -0,0 +1,247 @@
+import sys
+import os
+import time
+import csv
+import json
+import argparse
+import multiprocessing
+from multiprocessing.connection import wait
+from libcache import load_library
+from prover import prove, NullScreen
+
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+
+# Batch prover
+#
+# Runs the headless prover (see prover.py) over a set of problems, each in its
+# own worker process, so that a crash, a stack overflow or a runaway
+# allocation in one problem cannot take down the run. Each worker has a time
+# limit and a memory limit. The time limit is enforced softly by the search
+# budget of automate and, failing that, by killing the worker shortly after.
+# The memory limit bounds the resident memory of the worker and is enforced
+# by the memory budget of automate, which stops the search cleanly. As a
+# backstop, the address space of the worker is capped somewhat above the
+# limit, as the address space of a process is always larger than its resident
+# memory, so that an allocation the budget misses fails with a MemoryError.
+#
+# Usage:
+#
+#    python batch.py [options] [problem ...]
+#
+# where each problem is "library" for every theorem in library.dat, a file of
+# problem text in the library statement format, or a directory of such files.
+# With no problems, the library and the tptp directory are run. The results
+# are printed as a table and written as JSON and CSV.
+#
+# Problems are loaded as the interface loads them: each theorem in the library
+# is proved using only the library before it. TPTP problems are reported as
+# unsupported, as there is no TPTP parser.
+
+kill_grace = 2 # seconds to wait past the time limit before killing a worker
+recursion_limit = 10000 # recursion limit of the workers
+address_space_headroom = 512 # MB of address space allowed beyond the memory limit
+
+statuses = ['proved', 'failed', 'timeout', 'memory', 'crash', 'error', 'unsupported']
+fields = ['problem', 'source', 'status', 'reason', 'time', 'inferences', 'lines', 'error']
+
+class Problem:
+    def __init__(self, name, source, problem):
+        self.name = name # title of the theorem or path of the file
+        self.source = source # where the problem came from, for the report
+        self.problem = problem # filepos or problem text passed to prove, or None if unsupported
+
+def library_problems(screen):
+    """
+    Return a list of Problems, one for each theorem/definition in library.dat,
+    in library order.
+    """
+    cache = load_library(screen)
+    return [Problem(entry.title, "library.dat:"+str(entry.filepos), entry.filepos) \
+            for entry in cache.entries]
+
+def file_problems(path):
+    """
+    Return a list of Problems for the given file, or for the files in the
+    given directory, in order of file name.
+    """
+    if os.path.isdir(path):
+        problems = []
+        for name in sorted(os.listdir(path)):
+            if not name.startswith('.'):
+                problems += file_problems(os.path.join(path, name))
+        return problems
+    if path.endswith('.tptp') or path.endswith('.p'):
+        return [Problem(path, path, None)]
+    with open(path, "r") as f:
+        return [Problem(path, path, f.read())]
+
+def collect_problems(screen, args):
+    """
+    Return the list of Problems named by the given command line arguments.
+    """
+    problems = []
+    for arg in args:
+        if arg == 'library':
+            problems += library_problems(screen)
+        elif os.path.exists(arg):
+            problems += file_problems(arg)
+        else:
+            raise Exception("No such problem or file: "+arg)
+    return problems
+
+def result_row(problem, status, elapsed, reason='', inferences='', lines='', error=''):
+    """
+    Return a row of the results table for the given problem.
+    """
+    return {'problem' : problem.name, 'source' : problem.source, 'status' : status, \
+            'reason' : reason, 'time' : round(elapsed, 3), 'inferences' : inferences, \
+            'lines' : lines, 'error' : error}
+
+def worker(conn, problem, schedule, time_limit, memory_limit):
+    """
+    Entry point of a worker process. Tries to prove the given problem and sends
+    a tuple (status, reason, inferences, lines, error) back on the given
+    connection. A worker that dies without sending a result is reported as a
+    crash by the pool.
+    """
+    sys.setrecursionlimit(recursion_limit)
+    max_memory = None
+    if memory_limit != None:
+        max_memory = memory_limit*1024*1024
+        if resource != None:
+            limit = (memory_limit + address_space_headroom)*1024*1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    try:
+        result, tl = prove(problem, schedule, time_limit, None, max_memory)
+        if result.proved:
+            status = 'proved'
+        elif result.reason == 'time':
+            status = 'timeout'
+        elif result.reason == 'memory':
+            status = 'memory'
+        else:
+            status = 'failed'
+        conn.send((status, result.reason, result.inferences, len(tl.tlist1.data), ''))
+    except MemoryError:
+        conn.send(('memory', '', '', '', 'MemoryError'))
+    except RecursionError:
+        conn.send(('crash', '', '', '', 'RecursionError'))
+    except Exception as e:
+        conn.send(('error', '', '', '', type(e).__name__+": "+str(e)))
+    conn.close()
+
+def run_batch(problems, jobs, schedule, time_limit, memory_limit, report=None):
+    """
+    Run the prover on each of the given Problems in a pool of at most jobs
+    worker processes, one process per problem. Returns the list of result rows
+    in the order of the problems. If report is given, it is called with each
+    row as it is completed.
+    """
+    ctx = multiprocessing.get_context()
+    results = [None for i in range(len(problems))]
+    pending = list(range(len(problems)))
+    pending.reverse()
+    running = dict() # connection -> (problem number, process, start time)
+
+    def finish(conn, i, row):
+        results[i] = row
+        del running[conn]
+        if report != None:
+            report(row)
+
+    while pending or running:
+        while pending and len(running) < jobs:
+            i = pending.pop()
+            problem = problems[i]
+            if problem.problem == None:
+                results[i] = result_row(problem, 'unsupported', 0.0, error='no TPTP parser')
+                if report != None:
+                    report(results[i])
+                continue
+            recv, send = ctx.Pipe(False)
+            p = ctx.Process(target=worker, args=(send, problem.problem, schedule, time_limit, memory_limit))
+            p.start()
+            send.close() # so that recv sees EOF if the worker dies
+            running[recv] = (i, p, time.monotonic())
+        if not running:
+            continue
+        ready = wait(list(running.keys()), 0.1)
+        now = time.monotonic()
+        for conn in ready:
+            i, p, start = running[conn]
+            try:
+                status, reason, inferences, lines, error = conn.recv()
+            except EOFError: # worker died without a result
+                p.join()
+                status, reason, inferences, lines = 'crash', '', '', ''
+                error = 'exit code '+str(p.exitcode)
+            conn.close()
+            p.join()
+            finish(conn, i, result_row(problems[i], status, now - start, reason, inferences, lines, error))
+        for conn in list(running.keys()):
+            i, p, start = running[conn]
+            if time_limit != None and now - start > time_limit + kill_grace:
+                p.kill()
+                p.join()
+                conn.close()
+                finish(conn, i, result_row(problems[i], 'timeout', now - start, 'killed'))
+    return results
+
+def format_row(row):
+    """
+    Return the given result row as a line of the printed table.
+    """
+    return "{:<12}{:>9.2f}  {}".format(row['status'], row['time'], row['problem']) + \
+           (" ("+row['error']+")" if row['error'] and row['status'] != 'unsupported' else '')
+
+def summary(results):
+    """
+    Return a dictionary from status to the number of results with that status.
+    """
+    counts = {s : 0 for s in statuses}
+    for row in results:
+        counts[row['status']] += 1
+    return {s : counts[s] for s in statuses if counts[s]}
+
+def write_json(path, results, options):
+    with open(path, "w") as f:
+        json.dump({'options' : options, 'summary' : summary(results), 'results' : results}, f, indent=1)
+
+def write_csv(path, results):
+    with open(path, "w", newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(results)
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Run the prover on a batch of problems.")
+    parser.add_argument('problems', nargs='*', default=['library', 'tptp'], \
+                        help="'library', problem files or directories (default: library tptp)")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help="number of workers")
+    parser.add_argument('-t', '--time', type=float, default=10, help="time limit per problem in seconds")
+    parser.add_argument('-m', '--memory', type=int, default=2048, help="resident memory limit per problem in MB")
+    parser.add_argument('-s', '--schedule', choices=['loop', 'best'], default='loop', help="automate schedule")
+    parser.add_argument('--json', default='results.json', help="JSON output file")
+    parser.add_argument('--csv', default='results.csv', help="CSV output file")
+    args = parser.parse_args(argv)
+    screen = NullScreen()
+    problems = collect_problems(screen, args.problems)
+
+    def report(row):
+        print(format_row(row))
+        sys.stdout.flush()
+
+    start = time.monotonic()
+    results = run_batch(problems, max(args.jobs, 1), args.schedule, args.time, args.memory, report)
+    elapsed = time.monotonic() - start
+    counts = summary(results)
+    print(", ".join(s+": "+str(counts[s]) for s in counts)+" in "+str(round(elapsed, 2))+"s")
+    options = {'jobs' : args.jobs, 'time' : args.time, 'memory' : args.memory, 'schedule' : args.schedule}
+    write_json(args.json, results, options)
+    write_csv(args.csv, results)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,778 @@
+import sys
+import time
+import signal
+from automation import create_index, constants_mask
+from autoparse import parse_consts, parse_legacy_consts, format_consts
+from automation import approx_size, slot_values, fingerprint_stats, autocleanup, automate, \
+     AutoData, AutoList
+from moves import check_targets_proved, solve_hydra, unify_pair
+from copy import deepcopy
+from tree import TreeList
+from nodes import LRNode, LeafNode, FnApplNode, TupleNode, VarNode, DeadNode
+from sorts import Constraint, NumberSort, clone
+import logic
+import tracemalloc
+from libcache import load_library
+from terms import TermTable
+from utility import get_constants, complement_tree, type_vars, initialise_sorts, \
+     process_sorts, TargetNode, sorts_equal, find_sort, sort_descendant, insert_sort, \
+     update_constraints, retype_vars, add_sibling, add_descendant, target_depends
+from unification import unify
+from disctree import ground_key, DiscriminationTree
+from prover import NullScreen
+
+def library_constant_sets(screen, library):
+    """
+    Return a list of all the lists of constants occurring in the constants
+    lines of the library, i.e. everything the automation does subset tests on.
+    """
+    tl = TreeList()
+    index = create_index(screen, tl, library)
+    sets = []
+    for (title, c, nc, filepos, cm, ncm) in index:
+        for consts in [c, nc]:
+            sets.append(consts[0])
+            for thm in consts[2]:
+                if isinstance(thm, list):
+                    sets.append(thm)
+                else:
+                    sets.append(thm.left)
+                    sets.append(thm.right)
+    return sets
+
+def bench_constant_masks(screen, library, reps=5):
+    """
+    Compare subset tests done on lists of constants, as set(c1).issubset(c2),
+    with the same tests done on bitmasks, as (m1 & ~m2) == 0, for every pair
+    of constant lists occurring in the library.
+    """
+    sets = library_constant_sets(screen, library)
+    masks = [constants_mask(c) for c in sets]
+    npairs = len(sets)*len(sets)
+    start = time.perf_counter()
+    for r in range(reps):
+        count1 = 0
+        for c1 in sets:
+            for c2 in sets:
+                if set(c1).issubset(c2):
+                    count1 += 1
+    list_time = (time.perf_counter() - start)/reps
+    start = time.perf_counter()
+    for r in range(reps):
+        count2 = 0
+        for m1 in masks:
+            for m2 in masks:
+                if (m1 & ~m2) == 0:
+                    count2 += 1
+    mask_time = (time.perf_counter() - start)/reps
+    if count1 != count2:
+        raise Exception("Bitmask subset tests disagree with list subset tests")
+    print("constant lists: "+str(len(sets))+", subset tests: "+str(npairs)+", subsets: "+str(count1))
+    print("list:    "+format(list_time*1e9/npairs, ".1f")+" ns/test")
+    print("bitmask: "+format(mask_time*1e9/npairs, ".1f")+" ns/test")
+    print("speedup: "+format(list_time/mask_time, ".2f")+"x")
+
+def bench_headers(screen, library, scales=[1, 2, 4, 8, 16]):
+    """
+    Time building the constants part of the library index, i.e. parsing the
+    two constants headers of every entry, for the legacy header format and
+    the current one. The library is replicated to show how the time scales
+    with the number of entries.
+    """
+    legacy = []
+    title = library.readline()
+    while title: # check for EOF
+        legacy.append(library.readline()[0:-1])
+        legacy.append(library.readline()[0:-1])
+        while title != '\n':
+            title = library.readline()
+        title = library.readline()
+    current = [format_consts(parse_legacy_consts(screen, v)[1]) for v in legacy]
+    print("entries      legacy (s)   current (s)   speedup")
+    for n in scales:
+        times = []
+        for headers in [legacy*n, current*n]:
+            start = time.perf_counter()
+            for v in headers:
+                success, consts = parse_consts(screen, v)
+                if not success:
+                    raise Exception(consts)
+            times.append(time.perf_counter() - start)
+        print(format(len(legacy)*n//2, "7d")+"   "+format(times[0], "12.4f")+"  "+ \
+              format(times[1], "12.4f")+"  "+format(times[0]/times[1], "8.1f")+"x")
+
+def library_trees(screen, library):
+    """
+    Return a list of all the parse trees (quantifier zones, hypotheses and
+    targets) of all the statements in the library.
+    """
+    trees = []
+    for entry in load_library(screen, library.name).entries:
+        stmt = entry.statement()
+        if stmt != None:
+            qz, hyps, tars = stmt
+            if qz != None:
+                trees.append(qz)
+            trees.extend(hyps)
+            trees.extend(tars)
+    return trees
+
+def terms_size(terms):
+    """
+    Return the approximate memory used by the terms in a TermTable, including
+    the table itself.
+    """
+    size = sys.getsizeof(terms.terms)
+    for (k, term) in terms.terms.items():
+        size += sys.getsizeof(k) + sys.getsizeof(term) + \
+                sys.getsizeof(term.data) + sys.getsizeof(term.args)
+    return size
+
+def bench_terms(screen, library, reps=5):
+    """
+    Intern every statement of the library in one TermTable and compare the
+    memory used with that of the parse trees. Then compare computing the
+    constants of every tree and of its complement with get_constants and
+    with the memoised constants of the hash-consed terms.
+    """
+    trees = library_trees(screen, library)
+    terms = TermTable()
+    start = time.perf_counter()
+    for tree in trees:
+        terms.intern(tree)
+    intern_time = time.perf_counter() - start
+    nodes = terms.hits + terms.misses
+    print("trees: "+str(len(trees))+", nodes: "+str(nodes)+", distinct terms: "+str(len(terms)))
+    print("intern time: "+format(intern_time*1e6/nodes, ".2f")+" us/node")
+    print("parse trees:      "+str(approx_size(trees))+" bytes")
+    print("hash-consed terms: "+str(terms_size(terms))+" bytes")
+    start = time.perf_counter()
+    for r in range(reps):
+        consts1 = [(get_constants(screen, None, tree), \
+                    get_constants(screen, None, complement_tree(tree))) for tree in trees]
+    tree_time = (time.perf_counter() - start)/reps
+    start = time.perf_counter()
+    for r in range(reps):
+        consts2 = [(terms.constants(tree), terms.complement_constants(tree)) for tree in trees]
+    term_time = (time.perf_counter() - start)/reps
+    if consts1 != consts2:
+        raise Exception("Constants of terms disagree with get_constants")
+    print("get_constants:  "+format(tree_time*1e3, ".2f")+" ms")
+    print("term constants: "+format(term_time*1e3, ".2f")+" ms")
+    print("speedup: "+format(tree_time/term_time, ".2f")+"x")
+
+def is_node(obj):
+    """
+    Return True if the given object is a parse tree node or a sort.
+    """
+    return isinstance(obj, LRNode) or isinstance(obj, LeafNode) or \
+           isinstance(obj, FnApplNode) or isinstance(obj, TupleNode) or \
+           isinstance(obj, Constraint)
+
+def count_nodes(trees):
+    """
+    Return the number of distinct parse tree nodes and sorts reachable from
+    the given list of trees.
+    """
+    seen = set()
+    count = 0
+    stack = list(trees)
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        if isinstance(obj, list) or isinstance(obj, tuple):
+            stack.extend(obj)
+        elif is_node(obj):
+            count += 1
+            if hasattr(obj, '__dict__'):
+                stack.extend(obj.__dict__.values())
+            else:
+                stack.extend(slot_values(obj))
+    return count
+
+def bench_memory(screen, library, reps=5):
+    """
+    Import every theorem and definition of the library into the hypotheses of
+    a single tableau and report the memory used per parse tree node, and the
+    time taken to deepcopy the tableau.
+    """
+    entries = load_library(screen, library.name).entries
+    tl = TreeList()
+    tracemalloc.start()
+    for entry in entries:
+        logic.library_import(screen, tl, library, entry.filepos)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    tlist1 = tl.tlist1.data
+    nodes = count_nodes(tlist1)
+    start = time.perf_counter()
+    for r in range(reps):
+        deepcopy(tlist1)
+    copy_time = (time.perf_counter() - start)/reps
+    print("hypotheses: "+str(len(tlist1))+", nodes: "+str(nodes))
+    print("memory: "+str(size)+" bytes, "+format(size/nodes, ".1f")+" bytes/node")
+    print("deepcopy: "+format(copy_time*1e3, ".2f")+" ms, "+ \
+          format(copy_time*1e9/nodes, ".1f")+" ns/node")
+
+def bench_clone(screen, library, reps=5):
+    """
+    Compare copying every hypothesis of a tableau holding the whole library
+    with deepcopy and with clone.
+    """
+    entries = load_library(screen, library.name).entries
+    tl = TreeList()
+    for entry in entries:
+        logic.library_import(screen, tl, library, entry.filepos)
+    tlist1 = tl.tlist1.data
+    start = time.perf_counter()
+    for r in range(reps):
+        for tree in tlist1:
+            deepcopy(tree)
+    deepcopy_time = (time.perf_counter() - start)/reps
+    start = time.perf_counter()
+    for r in range(reps):
+        for tree in tlist1:
+            clone(tree)
+    clone_time = (time.perf_counter() - start)/reps
+    for tree in tlist1:
+        if repr(clone(tree)) != repr(tree):
+            raise Exception("Clone differs from original")
+    print("hypotheses: "+str(len(tlist1)))
+    print("deepcopy: "+format(deepcopy_time*1e3, ".2f")+" ms")
+    print("clone:    "+format(clone_time*1e3, ".2f")+" ms")
+    print("speedup: "+format(deepcopy_time/clone_time, ".2f")+"x")
+
+def hypothesis_index(tlist1):
+    """
+    Return a discrimination tree of all the hypotheses in the given list which
+    are not dead, each stored under its line number.
+    """
+    index = DiscriminationTree()
+    for i in range(len(tlist1)):
+        if not isinstance(tlist1[i], DeadNode):
+            index.insert(tlist1[i], i)
+    return index
+
+def bench_index(screen, library):
+    """
+    Find all pairs of hypotheses that unify in a tableau holding the whole
+    library, as is done for targets and hypotheses by annotate_ttree, by
+    unifying every pair and by unifying only the pairs returned by a
+    discrimination tree of the hypotheses.
+    """
+    entries = load_library(screen, library.name).entries
+    tl = TreeList()
+    for entry in entries:
+        logic.library_import(screen, tl, library, entry.filepos)
+    tlist1 = tl.tlist1.data
+    start = time.perf_counter()
+    pairs1 = []
+    for i in range(len(tlist1)):
+        tree1 = tlist1[i]
+        for j in range(len(tlist1)):
+            if unify(screen, tl, tree1, tlist1[j])[0]:
+                pairs1.append((i, j))
+    all_time = time.perf_counter() - start
+    start = time.perf_counter()
+    pairs2 = []
+    calls = 0
+    index = hypothesis_index(tlist1)
+    for i in range(len(tlist1)):
+        tree1 = tlist1[i]
+        candidates = index.candidates(tree1)
+        for j in range(len(tlist1)):
+            if j in candidates:
+                calls += 1
+                if unify(screen, tl, tree1, tlist1[j])[0]:
+                    pairs2.append((i, j))
+    index_time = time.perf_counter() - start
+    if pairs1 != pairs2:
+        raise Exception("Discrimination tree missed a unification")
+    print("hypotheses: "+str(len(tlist1))+", unifying pairs: "+str(len(pairs1)))
+    print("unify calls: "+str(len(tlist1)*len(tlist1))+" -> "+str(calls))
+    print("all pairs: "+format(all_time*1e3, ".2f")+" ms")
+    print("indexed:   "+format(index_time*1e3, ".2f")+" ms")
+    print("speedup: "+format(all_time/index_time, ".2f")+"x")
+
+def bench_contradictions(screen, library):
+    """
+    Find all pairs of contradicting hypotheses in a tableau holding the whole
+    library and the complement of each of its statements, by unifying the
+    complement of each hypothesis with the hypotheses returned by a
+    discrimination tree, and by looking up ground hypotheses by their ground
+    keys, unifying only where one of the pair is not ground. The indexes and
+    keys are computed once per hypothesis, when it is added, so the time to
+    build them is reported separately.
+    """
+    entries = load_library(screen, library.name).entries
+    tl = TreeList()
+    for entry in entries:
+        logic.library_import(screen, tl, library, entry.filepos)
+    tlist1 = tl.tlist1.data
+    n = len(tlist1)
+    for i in range(n):
+        tlist1.append(complement_tree(deepcopy(tlist1[i])))
+    complements = [complement_tree(tree) for tree in tlist1]
+    start = time.perf_counter()
+    index = hypothesis_index(tlist1)
+    index_time = time.perf_counter() - start
+    start = time.perf_counter()
+    keys = [ground_key(tree) for tree in tlist1]
+    complement_keys = [ground_key(tree) for tree in complements]
+    ground = dict()
+    nonground_index = DiscriminationTree() # hypotheses which are not ground
+    for j in range(len(tlist1)):
+        if keys[j] != None:
+            ground.setdefault(keys[j], []).append(j)
+        else:
+            nonground_index.insert(tlist1[j], j)
+    key_time = time.perf_counter() - start
+    start = time.perf_counter()
+    pairs1 = set()
+    calls1 = 0
+    for i in range(len(tlist1)):
+        for j in index.candidates(complements[i]):
+            if i != j:
+                calls1 += 1
+                if unify(screen, tl, complements[i], tlist1[j])[0]:
+                    pairs1.add((i, j))
+    unify_time = time.perf_counter() - start
+    start = time.perf_counter()
+    pairs2 = set()
+    calls2 = 0
+    for i in range(len(tlist1)):
+        key = complement_keys[i]
+        if key != None:
+            for j in ground.get(key, []):
+                if i != j:
+                    pairs2.add((i, j))
+        for j in (index if key == None else nonground_index).candidates(complements[i]):
+            if i != j:
+                calls2 += 1
+                if unify(screen, tl, complements[i], tlist1[j])[0]:
+                    pairs2.add((i, j))
+    ground_time = time.perf_counter() - start
+    if pairs1 != pairs2:
+        raise Exception("Ground keys disagree with unification")
+    print("hypotheses: "+str(len(tlist1))+", ground: "+str(len([k for k in keys if k != None]))+ \
+          ", contradicting pairs: "+str(len(pairs1)))
+    print("unify calls: "+str(calls1)+" -> "+str(calls2))
+    print("setup: index "+format(index_time*1e3, ".2f")+" ms, keys "+format(key_time*1e3, ".2f")+" ms")
+    print("indexed:     "+format(unify_time*1e3, ".2f")+" ms")
+    print("ground keys: "+format(ground_time*1e3, ".2f")+" ms")
+    print("speedup: "+format(unify_time/ground_time, ".2f")+"x")
+
+def library_tableaux(screen, library):
+    """
+    Return a list of pairs (tl, ttree) of the tableaux of all the theorems of
+    the library, loaded and prepared as automate expects them. Theorems for
+    which sorts cannot be processed are skipped.
+    """
+    tableaux = []
+    for entry in load_library(screen, library.name).entries:
+        tl = TreeList()
+        try:
+            logic.library_load(screen, tl, library, entry.filepos)
+            logic.fill_macros(screen, tl)
+            type_vars(screen, tl)
+            initialise_sorts(screen, tl)
+            ok, error = process_sorts(screen, tl)
+            if not ok:
+                continue
+            ttree = TargetNode(-1, [TargetNode(i) for i in range(len(tl.tlist2.data))])
+            autocleanup(screen, tl, ttree)
+        except Exception: # some library entries can't be processed yet
+            continue
+        tableaux.append((tl, ttree))
+    return tableaux
+
+def legacy_find_sort(stree, s):
+    """
+    Find the sort s in the tree of sorts rooted at \\mathcal{U} by searching
+    the tree, as find_sort did before lookups were memoised.
+    """
+    if sorts_equal(s, stree[0].sort):
+        return stree[0]
+    stack = list(reversed(stree[0].subsorts))
+    while stack:
+        t = stack.pop()
+        if sorts_equal(s, t.sort):
+            return t
+        stack.extend(reversed(t.subsorts))
+    return None
+
+def legacy_sort_descendant(s1, s2):
+    """
+    As sort_descendant, but searching the tree rather than memoising.
+    """
+    if sorts_equal(s1.sort, s2):
+        return s1
+    for t in s1.subsorts:
+        if t.follow:
+            r = legacy_sort_descendant(t, s2)
+            if r:
+                return r
+    return None
+
+def bench_sorts(screen, library, scales=[10, 100, 1000], ntests=20000):
+    """
+    Build sort trees with the given numbers of sorts (sets declared as
+    subsorts of one another, forming a binary tree below the number sorts)
+    and check whether pairs of sorts can be coerced to one another, as
+    coerce_sorts does, by searching the tree and with the memoised lookups
+    of the sort tree.
+    """
+    print("sorts      search (ns/test)   memoised (ns/test)   speedup")
+    for n in scales:
+        tl = TreeList()
+        initialise_sorts(screen, tl)
+        sorts = [NumberSort("\\mathbb{C}", None)]
+        for i in range(n):
+            s = VarNode("S_"+str(i))
+            insert_sort(screen, tl, sorts[i//2], s)
+            sorts.append(s)
+        pairs = [(sorts[(i*7919) % len(sorts)], sorts[(i*104729) % len(sorts)]) for i in range(ntests)]
+        start = time.perf_counter()
+        res1 = []
+        for (s1, s2) in pairs:
+            b = legacy_find_sort(tl.stree, s1)
+            res1.append(legacy_sort_descendant(b, s2) if b else None)
+        search_time = time.perf_counter() - start
+        start = time.perf_counter()
+        res2 = []
+        for (s1, s2) in pairs:
+            b = find_sort(screen, tl, s1)
+            res2.append(sort_descendant(screen, tl, b, s2) if b else None)
+        memo_time = time.perf_counter() - start
+        if any(r1 is not r2 for (r1, r2) in zip(res1, res2)):
+            raise Exception("Memoised sort lookups disagree with search")
+        print(format(n, "5d")+"   "+format(search_time*1e9/ntests, "16.1f")+"   "+ \
+              format(memo_time*1e9/ntests, "18.1f")+"   "+format(search_time/memo_time, "7.1f")+"x")
+
+def bench_checks(screen, library, count=60, limit=1):
+    """
+    Run automate on the first count theorems of the library for limit seconds
+    each, so that their tableaux grow, then compare the time check_targets_proved
+    takes when it has to try all unifications again with the time it takes
+    when told that no line has been modified since its last call.
+    """
+    tableaux = library_tableaux(screen, library)[0:count]
+    signal.signal(signal.SIGALRM, timeout_handler)
+    for (tl, ttree) in tableaux:
+        signal.alarm(limit)
+        try:
+            automate(screen, tl, ttree, None)
+        except Timeout:
+            pass
+        signal.alarm(0)
+    full_time = 0
+    incr_time = 0
+    for (tl, ttree) in tableaux:
+        start = time.perf_counter()
+        check_targets_proved(screen, tl, ttree)
+        full_time += time.perf_counter() - start
+        start = time.perf_counter()
+        check_targets_proved(screen, tl, ttree, [], [])
+        incr_time += time.perf_counter() - start
+    lines = sum(len(tl.tlist1.data) + len(tl.tlist2.data) for (tl, ttree) in tableaux)
+    print("lines: "+str(lines)+", full check: "+format(1000*full_time, ".1f")+" ms, "+ \
+          "incremental check: "+format(1000*incr_time, ".1f")+" ms")
+
+def legacy_target_depends(ttree, i, j):
+    """
+    As target_depends, but searching the target tree from the root for j and
+    then for i below it, as it did before target trees were indexed.
+    """
+    def find(ttree, i):
+        if ttree.num == i:
+            return ttree
+        for P in ttree.andlist:
+            t = find(P, i)
+            if t:
+                return t
+        return None
+
+    root = find(ttree, j)
+    return root != None and find(root, i) != None
+
+def bench_targets(screen, library, scales=[10, 100, 1000], ntests=20000):
+    """
+    Build target trees with the given numbers of targets, by splitting and
+    reasoning backwards from targets with add_sibling and add_descendant,
+    and check whether pairs of targets depend on one another by searching
+    the tree and with the Euler tour of the tree.
+    """
+    print("targets    search (ns/test)   tour (ns/test)   speedup")
+    for n in scales:
+        tl = TreeList()
+        ttree = TargetNode(-1, [TargetNode(0)])
+        for j in range(1, n):
+            if j % 3 == 0:
+                add_sibling(screen, tl, ttree, j//2, j)
+            else:
+                add_descendant(ttree, j - 1, j)
+        pairs = [((i*7919) % n, (i*104729) % n) for i in range(ntests)]
+        start = time.perf_counter()
+        res1 = [legacy_target_depends(ttree, i, j) for (i, j) in pairs]
+        search_time = time.perf_counter() - start
+        start = time.perf_counter()
+        res2 = [target_depends(screen, tl, ttree, i, j) for (i, j) in pairs]
+        tour_time = time.perf_counter() - start
+        if res1 != res2:
+            raise Exception("Target tour disagrees with search")
+        print(format(n, "5d")+"   "+format(search_time*1e9/ntests, "16.1f")+"   "+ \
+              format(tour_time*1e9/ntests, "14.1f")+"   "+format(search_time/tour_time, "7.1f")+"x")
+
+def find_start_index(lst, chosen_set):
+    """
+    Given a list lst of items, find the index of the first element of the list
+    such that no element from that point on (inclusive) is in the list of items
+    denoted chosen_set.
+    """
+    index = len(lst)
+    for i in reversed(range(len(lst))):
+        if lst[i] in chosen_set:
+            break
+        index = i
+    return index
+
+def legacy_generate_pairs(V, L, r, i=0, last_chosen_c=None):
+    """
+    Iterate through the whole cartesian product of ways of killing the heads
+    V of a hydra, as was done before the hydra solver.
+    """
+    if last_chosen_c is None:
+        last_chosen_c = []
+    if i == r:
+        yield []
+    else:
+        start_index = find_start_index(V[i], set(last_chosen_c))
+        for c_index in range(start_index, len(V[i])):
+            c = V[i][c_index]
+            last_chosen_c.append(c)
+            for d in range(L[c]):
+                for rest in legacy_generate_pairs(V, L, r, i + 1, last_chosen_c):
+                    yield [(c, d)] + rest
+            last_chosen_c.remove(c)
+
+def bench_hydras(screen, library, scales=[2, 4, 6], width=6):
+    """
+    Kill the heads of hydras with the given numbers of heads, each a target
+    P_k(x) sharing the metavariable x, where each target unifies with width
+    hypotheses P_k(a_j) but only one choice of a_j works for all targets.
+    The ways of killing the heads are found by unifying each of the cartesian
+    product of choices in turn and with the hydra solver.
+    """
+    print("heads    product (ms)   solver (ms)   speedup")
+    for r in scales:
+        tl = TreeList()
+        tlist1 = tl.tlist1.data
+        tlist2 = tl.tlist2.data
+        x = VarNode("x", is_metavar=True)
+        unifications = []
+        for k in range(r):
+            tlist2.append(FnApplNode(VarNode("P_"+str(k)), [x]))
+            unifications.append([])
+            for j in range(width):
+                # only a_0 is a hypothesis for every target
+                a = "a_"+str(j if k == 0 or j == 0 else width*k + j)
+                unifications[k].append(len(tlist1))
+                tlist1.append(FnApplNode(VarNode("P_"+str(k)), [VarNode(a)]))
+        V = [[k] for k in range(r)]
+        L = [width for k in range(r)]
+        start = time.perf_counter()
+        res1 = []
+        for v in legacy_generate_pairs(V, L, r):
+            assign = []
+            for (c, d) in v:
+                unifies, assign = unify_pair(screen, tl, unifications, c, d, assign)
+                if not unifies:
+                    break
+            if unifies:
+                res1.append(v)
+        product_time = time.perf_counter() - start
+        start = time.perf_counter()
+        res2 = list(solve_hydra(screen, tl, V, L, unifications))
+        solver_time = time.perf_counter() - start
+        if sorted(res1) != sorted(res2):
+            raise Exception("Hydra solver disagrees with cartesian product")
+        print(format(r, "5d")+"   "+format(product_time*1e3, "12.2f")+"   "+ \
+              format(solver_time*1e3, "11.2f")+"   "+format(product_time/solver_time, "7.1f")+"x")
+
+def bench_autotab(screen, library, scales=[100, 1000, 10000], nupdates=20000):
+    """
+    Replace the AutoData of lines of a tableau with the given numbers of lines,
+    as update_autotab does when lines are modified, and then look each line
+    up, using lists searched linearly and using an AutoList.
+    """
+    print("lines    lists (us/op)   AutoList (us/op)   speedup")
+    for n in scales:
+        lines = [(i*7919) % n for i in range(nupdates)]
+        start = time.perf_counter()
+        alist = [AutoData(i, 0, None, None, None, None) for i in range(n)]
+        for i in lines:
+            j = 0
+            while j < len(alist):
+                if alist[j].line == i:
+                    version = alist[j].version
+                    del alist[j]
+                else:
+                    j += 1
+            alist.append(AutoData(i, version + 1, None, None, None, None))
+        res1 = []
+        for i in lines:
+            for t in alist:
+                if t.line == i:
+                    res1.append(t.version)
+                    break
+        list_time = time.perf_counter() - start
+        start = time.perf_counter()
+        atab = AutoList()
+        for i in range(n):
+            atab.add(AutoData(i, 0, None, None, None, None))
+        for i in lines:
+            version = atab.remove(i).version
+            atab.add(AutoData(i, version + 1, None, None, None, None))
+        res2 = [atab.get(i).version for i in lines]
+        dict_time = time.perf_counter() - start
+        if res1 != res2 or [t.line for t in alist] != [t.line for t in atab]:
+            raise Exception("AutoList disagrees with lists")
+        print(format(n, "5d")+"   "+format(list_time*1e6/(2*nupdates), "13.2f")+"   "+ \
+              format(dict_time*1e6/(2*nupdates), "16.2f")+"   "+format(list_time/dict_time, "7.1f")+"x")
+
+class Timeout(Exception):
+    pass
+
+def timeout_handler(signum, frame):
+    raise Timeout()
+
+def bench_automate(screen, library, count=60, limit=2):
+    """
+    Run automate on the first count theorems of the library, giving up on
+    each after limit seconds. Report how many of the unifications tried
+    against heads were rejected by their fingerprints and how many results
+    of sorts_compatible and coerce_sorts were found in the sort tree memo.
+    """
+    tableaux = library_tableaux(screen, library)[0:count]
+    tests = fingerprint_stats["tests"]
+    rejects = fingerprint_stats["rejects"]
+    proved = 0
+    signal.signal(signal.SIGALRM, timeout_handler)
+    start = time.perf_counter()
+    for (tl, ttree) in tableaux:
+        signal.alarm(limit)
+        try:
+            if automate(screen, tl, ttree, None):
+                proved += 1
+        except Timeout:
+            pass
+        signal.alarm(0)
+    total_time = time.perf_counter() - start
+    hits = sum(tl.stree.hits for (tl, ttree) in tableaux)
+    misses = sum(tl.stree.misses for (tl, ttree) in tableaux)
+    tests = fingerprint_stats["tests"] - tests
+    rejects = fingerprint_stats["rejects"] - rejects
+    print("theorems: "+str(len(tableaux))+", proved: "+str(proved)+", time: "+format(total_time, ".1f")+" s")
+    print("fingerprint tests: "+str(tests)+", rejects: "+str(rejects)+" ("+ \
+          format(100*rejects/max(tests, 1), ".1f")+"%)")
+    print("sort memo hits: "+str(hits)+", misses: "+str(misses)+" ("+ \
+          format(100*hits/max(hits + misses, 1), ".1f")+"% hit rate)")
+
+def bench_schedules(screen, library, count=60, limit=2):
+    """
+    Run automate on the first count theorems of the library with each of its
+    schedules, giving up on each theorem after limit seconds, and report how
+    many are proved, how long it takes and how many hypotheses the tableaux
+    of the theorems proved by both have in the end.
+    """
+    print("schedule   proved   time (s)   lines")
+    results = dict()
+    for schedule in ['loop', 'best']:
+        tableaux = library_tableaux(screen, library)[0:count]
+        proved = []
+        signal.signal(signal.SIGALRM, timeout_handler)
+        start = time.perf_counter()
+        for (tl, ttree) in tableaux:
+            signal.alarm(limit)
+            try:
+                proved.append(bool(automate(screen, tl, ttree, None, schedule)))
+            except Timeout:
+                proved.append(False)
+            signal.alarm(0)
+        total_time = time.perf_counter() - start
+        results[schedule] = (proved, total_time, [len(tl.tlist1.data) for (tl, ttree) in tableaux])
+    both = [k for k in range(len(results['loop'][0])) if results['loop'][0][k] and results['best'][0][k]]
+    for schedule in ['loop', 'best']:
+        proved, total_time, lines = results[schedule]
+        print(format(schedule, "8s")+"   "+format(proved.count(True), "6d")+"   "+ \
+              format(total_time, "8.1f")+"   "+format(sum(lines[k] for k in both), "5d"))
+
+def bench_typing(screen, library, count=60, limit=1):
+    """
+    Run automate on the first count theorems of the library for limit seconds
+    each, so that their tableaux grow, then compare the time to type each
+    tableau again from scratch with the time to type again only the lines
+    depending on the last binder in its quantifier zone, as cleanup does
+    when it changes a binder.
+    """
+    tableaux = library_tableaux(screen, library)[0:count]
+    signal.signal(signal.SIGALRM, timeout_handler)
+    for (tl, ttree) in tableaux:
+        signal.alarm(limit)
+        try:
+            automate(screen, tl, ttree, None)
+        except Timeout:
+            pass
+        signal.alarm(0)
+    full_time = 0
+    incr_time = 0
+    full_lines = 0
+    incr_lines = 0
+    for (tl, ttree) in tableaux:
+        if not tl.tlist0.data:
+            continue
+        qz = tl.tlist0.data[0]
+        while qz.left:
+            qz = qz.left
+        full_lines += len(tl.tlist1.data) + len(tl.tlist2.data)
+        start = time.perf_counter()
+        tl.constraints_processed = (0, 0, 0)
+        tl.sorts_processed = (0, 0, 0)
+        update_constraints(screen, tl)
+        process_sorts(screen, tl)
+        full_time += time.perf_counter() - start
+        start = time.perf_counter()
+        retype_vars(tl, [qz.var.name()], [], [])
+        incr_lines += len(tl.constraints_dirty[1]) + len(tl.constraints_dirty[2])
+        update_constraints(screen, tl)
+        process_sorts(screen, tl)
+        incr_time += time.perf_counter() - start
+    print("full retype: "+str(full_lines)+" lines, "+format(1000*full_time, ".1f")+" ms")
+    print("incremental retype: "+str(incr_lines)+" lines, "+format(1000*incr_time, ".1f")+" ms")
+
+benchmarks = {
+    "masks" : bench_constant_masks,
+    "headers" : bench_headers,
+    "terms" : bench_terms,
+    "memory" : bench_memory,
+    "clone" : bench_clone,
+    "index" : bench_index,
+    "automate" : bench_automate,
+    "schedules" : bench_schedules,
+    "autotab" : bench_autotab,
+    "sorts" : bench_sorts,
+    "typing" : bench_typing,
+    "targets" : bench_targets,
+    "checks" : bench_checks,
+    "hydras" : bench_hydras,
+    "contradictions" : bench_contradictions
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] if len(sys.argv) > 1 else list(benchmarks.keys())
+    for name in names:
+        print("== "+name+" ==")
+        with open("library.dat", "r") as library:
+            benchmarks[name](NullScreen(), library)
@@ -0,0 +1,258 @@
+from nodes import VarNode, FnApplNode, LRNode, EqNode, TupleNode, SymbolNode, \
+     NaturalNode, BoolNode, LambdaNode
+from sorts import SetSort, TupleSort, Universum
+
+# Discrimination trees
+#
+# A discrimination tree is a trie of the skeletons of a collection of parse
+# trees. The skeleton of a tree is the list of its node symbols in preorder,
+# each with the number of children that follow it, where any subtree that
+# unify may match against anything (metavariables, unexpanded universe
+# macros, Universum) is replaced by a wildcard. Symbols are chosen so that
+# two trees can only unify if their skeletons match, treating a wildcard on
+# either side as matching a whole subtree on the other. The tree can therefore
+# be used to find, for a given tree, the few trees in the collection that are
+# worth the cost of a full unification. It never rules out a tree that would
+# unify, but it may return trees that don't. Trees can only be inserted, so
+# the ProofCache of check_targets_proved (see moves.py) keeps one index of the
+# hypotheses and targets between calls, adding lines as they appear and
+# ignoring stale entries for lines that have since changed.
+#
+# Only the head of an equality is indexed, as unify tries both orientations
+# of its sides, and only the type of nodes unify does not look inside (e.g.
+# number sorts, constraints).
+#
+# A fingerprint is the part of a skeleton near the root of a tree. It is
+# cheap to compute and compare, and is used to reject pairs of trees that
+# cannot unify before calling unify.
+#
+# A ground key is a canonical form of a ground tree, i.e. one without
+# metavariables or anything else unify may match against more than one
+# thing (unexpanded universe macros, sorts, lambdas, etc.). Two ground trees
+# unify if and only if their keys are equal, so ground trees that unify
+# can be found with a hash table rather than by unification.
+
+# symbol standing for any subtree
+wildcard_symbol = '*'
+wildcard = (wildcard_symbol, 0)
+
+def head(tree):
+    """
+    Return a pair (symbol, children) where symbol is the symbol of the root of
+    the given tree in a skeleton and children is the list of its subtrees that
+    are part of the skeleton.
+    """
+    if tree == None:
+        return None, []
+    elif (isinstance(tree, VarNode) or isinstance(tree, FnApplNode)) and tree.is_metavar:
+        return wildcard_symbol, []
+    elif isinstance(tree, FnApplNode) and tree.name() == 'universe':
+        return wildcard_symbol, []
+    elif isinstance(tree, Universum):
+        return wildcard_symbol, []
+    elif isinstance(tree, VarNode):
+        return (VarNode, tree.name()), []
+    elif isinstance(tree, FnApplNode):
+        return (FnApplNode, len(tree.args)), [tree.var] + tree.args
+    elif isinstance(tree, EqNode):
+        return EqNode, []
+    elif isinstance(tree, LRNode):
+        return type(tree), [tree.left, tree.right]
+    elif isinstance(tree, NaturalNode) or isinstance(tree, BoolNode):
+        return (type(tree), tree.value), []
+    elif isinstance(tree, SymbolNode):
+        return (SymbolNode, tree.name()), []
+    elif isinstance(tree, SetSort):
+        if tree.sort == tree:
+            return (SetSort, None), []
+        return SetSort, [tree.sort]
+    elif isinstance(tree, TupleSort):
+        return (TupleSort, len(tree.sorts)), tree.sorts
+    elif isinstance(tree, TupleNode):
+        return (TupleNode, len(tree.args)), tree.args
+    else:
+        return type(tree), []
+
+def skeleton_symbols(tree, symbols):
+    """
+    Append the skeleton of the given tree to the list symbols. Each entry is a
+    pair (symbol, arity) where arity is the number of subtrees that follow.
+    """
+    symbol, children = head(tree)
+    symbols.append((symbol, len(children)))
+    for v in children:
+        skeleton_symbols(v, symbols)
+
+def skeleton(tree):
+    """
+    Return the skeleton of the given tree as a list of (symbol, arity) pairs.
+    """
+    symbols = []
+    skeleton_symbols(tree, symbols)
+    return symbols
+
+def subtree_ends(symbols):
+    """
+    Given a skeleton, return a list whose i-th entry is the index just past
+    the end of the subtree starting at index i.
+    """
+    ends = [0 for i in range(len(symbols))]
+    for i in range(len(symbols) - 1, -1, -1):
+        j = i + 1
+        for k in range(symbols[i][1]):
+            j = ends[j]
+        ends[i] = j
+    return ends
+
+class DiscNode:
+    __slots__ = ('children', 'items')
+
+    def __init__(self):
+        self.children = dict() # (symbol, arity) -> child node
+        self.items = [] # items whose skeleton ends at this node
+
+class DiscriminationTree:
+    def __init__(self):
+        self.root = DiscNode() # root of the trie of skeletons
+        self.size = 0 # number of items in the tree
+
+    def insert(self, tree, item):
+        """
+        Insert the given item into the discrimination tree under the skeleton
+        of the given tree.
+        """
+        node = self.root
+        for s in skeleton(tree):
+            child = node.children.get(s)
+            if child == None:
+                child = DiscNode()
+                node.children[s] = child
+            node = child
+        node.items.append(item)
+        self.size += 1
+
+    def candidates(self, tree):
+        """
+        Return the set of items that were inserted with a tree that may unify
+        with the given tree.
+        """
+        symbols = skeleton(tree)
+        ends = subtree_ends(symbols)
+        found = set()
+
+        def skip(node, n, nodes):
+            # find all nodes reached from node by skipping n stored subtrees
+            if n == 0:
+                nodes.append(node)
+                return
+            for (s, child) in node.children.items():
+                skip(child, n - 1 + s[1], nodes)
+
+        def match(node, pos):
+            if pos == len(symbols):
+                found.update(node.items)
+                return
+            s = symbols[pos]
+            if s == wildcard: # query wildcard matches any stored subtree
+                nodes = []
+                skip(node, 1, nodes)
+                for n in nodes:
+                    match(n, pos + 1)
+            else:
+                child = node.children.get(s)
+                if child != None:
+                    match(child, pos + 1)
+                child = node.children.get(wildcard)
+                if child != None: # stored wildcard matches the query subtree
+                    match(child, ends[pos])
+
+        match(self.root, 0)
+        return found
+
+# depth of a tree down to which its fingerprint records the skeleton
+fingerprint_depth = 3
+
+def fingerprint(tree, depth=fingerprint_depth):
+    """
+    Return a fingerprint of the given tree, i.e. its skeleton down to the
+    given depth as nested tuples (symbol, children). Wildcards and subtrees
+    below the given depth are represented by None.
+    """
+    if depth == 0:
+        return None
+    symbol, children = head(tree)
+    if symbol == wildcard_symbol:
+        return None
+    return symbol, tuple(fingerprint(v, depth - 1) for v in children)
+
+def matches_fingerprint(tree, fp):
+    """
+    Return False if the given tree cannot unify with a tree with the given
+    fingerprint. Only as much of the tree is visited as is needed to find a
+    mismatch.
+    """
+    if fp == None:
+        return True
+    symbol, children = head(tree)
+    if symbol == wildcard_symbol:
+        return True
+    if symbol != fp[0]:
+        return False
+    for i in range(len(children)):
+        if not matches_fingerprint(children[i], fp[1][i]):
+            return False
+    return True
+
+def ground_key(tree):
+    """
+    Return the ground key of the given tree, or None if it is not ground. The
+    key is a nested tuple which follows unify: variables are compared by name
+    only, binders by their bodies only and the sides of an equality as a
+    set, as unify tries both orientations.
+    """
+    def key(tree):
+        # returns False if the tree is not ground
+        if tree == None:
+            return None
+        elif isinstance(tree, VarNode):
+            if tree.is_metavar:
+                return False
+            return VarNode, tree.name()
+        elif isinstance(tree, FnApplNode):
+            if tree.is_metavar or tree.name() == 'universe':
+                return False
+            var = key(tree.var)
+            if var == False:
+                return False
+            args = tuple(key(v) for v in tree.args)
+            if False in args:
+                return False
+            return FnApplNode, var, args
+        elif isinstance(tree, EqNode):
+            left = key(tree.left)
+            right = key(tree.right)
+            if left == False or right == False:
+                return False
+            return EqNode, frozenset((left, right))
+        elif isinstance(tree, NaturalNode) or isinstance(tree, BoolNode):
+            return type(tree), tree.value
+        elif isinstance(tree, SymbolNode):
+            if tree.name() == '\\emptyset': # unify compares sorts of empty sets
+                return False
+            return SymbolNode, tree.name()
+        elif isinstance(tree, TupleNode):
+            args = tuple(key(v) for v in tree.args)
+            if False in args:
+                return False
+            return TupleNode, args
+        elif isinstance(tree, LRNode) and not isinstance(tree, LambdaNode):
+            left = key(tree.left)
+            right = key(tree.right)
+            if left == False or right == False:
+                return False
+            return type(tree), left, right
+        else:
+            return False
+
+    k = key(tree)
+    return None if k == False else k
@@ -3,7 +3,7 @@ from flask_socketio import SocketIO, emit
 from tree import TreeList
 from logic import modus_ponens, modus_tollens, cleanup, clear_tableau, filter_library, \
      library_load, fill_macros, library_import, equality_substitution
-from utility import filter_titles, initialise_sorts, type_vars, process_sorts, \
+from utility import initialise_sorts, type_vars, process_sorts, \
      TargetNode, target_compatible, update_constraints, process_sorts, complement_tree, \
      trim_spaces, find_all, prune_move_list, treelist_prune
 from moves import check_targets_proved
@@ -156,10 +156,8 @@ def handle_request_library_filter(data):
     letter = data['letter']
     print("filter tags:"+tags+", letter:"+letter)
     library = open("library.dat", "r")
-    filtered_titles = filter_library(screen, tl, library, tags)
+    filtered_titles = filter_library(screen, tl, library, tags, letter)
     library.close()
-    if letter != '':
-        filtered_titles = filter_titles(filtered_titles, letter)
     strings = [v[1] for v in filtered_titles]
     emit('update_dropdown', {'strings': strings})
 
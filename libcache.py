@@ -0,0 +1,423 @@
+import os
+import pickle
+import hashlib
+import mmap
+from parsimonious import exceptions
+from autoparse import parse_consts
+from parser import statement, StatementVisitor
+from nodes import AutoImplNode, AutoIffNode, AutoEqNode
+from utility import tags_to_list
+
+cache_version = 5 # bump whenever the format of the cache file changes
+cache_suffix = ".cache" # the cache for library.dat is library.dat.cache
+
+library_caches = dict() # compiled libraries already loaded by this process
+library_maps = dict() # map from library path to (mtime, size, mmap) of the library
+
+class LibraryEntry:
+    def __init__(self, title, consts, nconsts, tags, filepos, blocks, body):
+        self.title = title # title of the theorem/definition
+        self.consts = consts # parsed constants line
+        self.nconsts = nconsts # parsed negated constants line
+        self.tags = tags # tag string as it appears in the library
+        self.filepos = filepos # file position of the quantifier zone
+        self.blocks = blocks # (offset, length) of the qz, hypothesis and target blocks
+        self.body = body # pickled (qz, hyps, tars) or None if not parseable
+
+    def statement(self):
+        """
+        Return freshly unpickled (qz, hyps, tars) parse trees for the entry.
+        The trees are new objects on every call, so the caller may modify them
+        in place. If the entry could not be parsed, None is returned.
+        """
+        if self.body == None:
+            return None
+        return pickle.loads(self.body)
+
+class ConstantPostings:
+    def __init__(self):
+        self.postings = dict() # map from constant to ids of keys containing it
+        self.sizes = [] # number of distinct constants in each key
+        self.keys = [] # (entry number, sub-implication) for each key
+        self.empty = [] # ids of keys with no constants, which always match
+
+    def add(self, n, i, consts):
+        """
+        Add a key for sub-implication i of library entry n with the given list
+        of constants. Keys must be added in library order, so that sorting ids
+        gives the same order as a scan of the library.
+        """
+        k = len(self.keys)
+        consts = set(consts)
+        self.keys.append((n, i))
+        self.sizes.append(len(consts))
+        if consts:
+            for c in consts:
+                if c in self.postings:
+                    self.postings[c].append(k)
+                else:
+                    self.postings[c] = [k]
+        else:
+            self.empty.append(k)
+
+    def subsets(self, consts):
+        """
+        Return the ids of all keys whose constants are a subset of the given
+        constants, in library order. Each key is counted once for each of its
+        constants which occurs in the postings of the query, so that a key is
+        a subset precisely when its count reaches its size.
+        """
+        counts = dict()
+        ids = list(self.empty)
+        sizes = self.sizes
+        for c in set(consts):
+            for k in self.postings.get(c, []):
+                m = counts.get(k, 0) + 1
+                counts[k] = m
+                if m == sizes[k]:
+                    ids.append(k)
+        ids.sort()
+        return ids
+
+class ConstantIndex:
+    def __init__(self):
+        self.hyps = ConstantPostings() # implications usable forwards from hypotheses
+        self.tars = ConstantPostings() # implications usable backwards from targets
+        self.heads = ConstantPostings() # theorems which are just a head
+
+    def add(self, n, consts, nconsts):
+        """
+        Add the constants of library entry n to the index. Implications are
+        added to hyps and tars along with their contrapositives, and only if
+        the side of the implication that is not matched doesn't consist of
+        constants already occurring on the side that is matched, which makes
+        the implication useless in that direction. Each key appears in the
+        order the filter functions would consider it.
+        """
+        thmlist = consts[2]
+        nthmlist = nconsts[2]
+        for i in range(len(thmlist)):
+            thm = thmlist[i]
+            nthm = nthmlist[i]
+            if isinstance(thm, AutoImplNode) or isinstance(thm, AutoIffNode) or isinstance(thm, AutoEqNode):
+                if useful_direction(thm.left, thm.right):
+                    self.hyps.add(n, i, thm.left)
+                if useful_direction(nthm.right, nthm.left):
+                    self.hyps.add(n, i, nthm.right)
+                if useful_direction(thm.right, thm.left):
+                    self.tars.add(n, i, thm.right)
+                if useful_direction(nthm.left, nthm.right):
+                    self.tars.add(n, i, nthm.left)
+            else:
+                self.heads.add(n, i, thm)
+
+def useful_direction(c1, c2):
+    """
+    Given the constants c1 of the side of an implication being matched and the
+    constants c2 of the other side, return True if c2 is contained in c1 or c1
+    is not contained in c2.
+    """
+    return set(c2).issubset(c1) or not set(c1).issubset(c2)
+
+class LibraryCache:
+    def __init__(self, mtime, size, digest):
+        self.version = cache_version # format version of the cache
+        self.mtime = mtime # mtime (ns) of the library when compiled
+        self.size = size # size of the library when compiled
+        self.digest = digest # sha256 of the library when compiled
+        self.entries = [] # list of LibraryEntry in library order
+        self.filepos = dict() # map from file position to LibraryEntry
+        self.const_index = ConstantIndex() # inverted index of entry constants
+        self.tags = dict() # map from tag to set of numbers of entries with that tag
+        self.titles = TitleTrie() # prefix trie of entry titles
+
+    def add_entry(self, entry):
+        """
+        Append the given LibraryEntry to the cache and add it to all indices.
+        """
+        n = len(self.entries)
+        self.entries.append(entry)
+        self.filepos[entry.filepos] = entry
+        if isinstance(entry.consts, tuple) and isinstance(entry.nconsts, tuple):
+            self.const_index.add(n, entry.consts, entry.nconsts)
+        for tag in tags_to_list(entry.tags):
+            if tag in self.tags:
+                self.tags[tag].add(n)
+            else:
+                self.tags[tag] = {n}
+        self.titles.insert(entry.title, n)
+
+    def filter(self, taglist, prefix=''):
+        """
+        Return a list of pairs (filepos, title) for all entries, in library
+        order, which have all the tags in the given list and whose title starts
+        with the given prefix. The first character of the prefix also matches
+        its upper case version.
+        """
+        ids = None
+        for tag in sorted(taglist, key=lambda t: len(self.tags.get(t, ()))):
+            if ids == None:
+                ids = set(self.tags.get(tag, ()))
+            else:
+                ids &= self.tags.get(tag, set())
+            if not ids:
+                return []
+        if prefix:
+            matches = self.titles.find(prefix)
+            if prefix[0].upper() != prefix[0]:
+                matches = matches + self.titles.find(prefix[0].upper()+prefix[1:])
+            ids = set(matches) if ids == None else ids.intersection(matches)
+        if ids == None:
+            ids = range(len(self.entries))
+        return [(self.entries[n].filepos, self.entries[n].title) for n in sorted(ids)]
+
+class TitleTrie:
+    def __init__(self):
+        self.children = dict() # map from next character of title to subtrie
+        self.entries = [] # numbers of entries whose titles have this prefix
+
+    def insert(self, title, n):
+        """
+        Insert the title of entry number n into the trie.
+        """
+        node = self
+        for c in title:
+            child = node.children.get(c)
+            if child == None:
+                child = TitleTrie()
+                node.children[c] = child
+            node = child
+            node.entries.append(n)
+
+    def find(self, prefix):
+        """
+        Return the numbers of all entries whose title starts with the given
+        (nonempty) prefix.
+        """
+        node = self
+        for c in prefix:
+            node = node.children.get(c)
+            if node == None:
+                return []
+        return node.entries
+
+def library_digest(path):
+    """
+    Return the sha256 hex digest of the file at the given path.
+    """
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def parse_statement(string):
+    """
+    Parse a single line of the library without any user interaction. Returns
+    the parse tree or None if the line does not parse.
+    """
+    try:
+        ast = statement.parse(string)
+        visitor = StatementVisitor()
+        return visitor.visit(ast)
+    except exceptions.ParseError:
+        return None
+
+def read_blocks(library):
+    """
+    Read the quantifier zone, hypotheses and targets of a library entry from
+    the current position of the open library file (library). Returns a pair
+    consisting of a list of (offset, length) pairs giving the byte range of
+    the quantifier zone, hypothesis and target blocks of the entry, and a
+    triple (qz, hyps, tars) of the lines of the entry, without newlines,
+    where qz is None if there is no quantifier zone.
+    """
+    qz = None
+    hyps = []
+    tars = []
+    start = library.tell()
+    fstr = library.readline()
+    if fstr != '------------------------------\n':
+        qz = fstr[0:-1]
+        qz_block = (start, library.tell() - start)
+        library.readline()
+    else:
+        qz_block = (start, 0)
+    start = library.tell()
+    end = start
+    fstr = library.readline()
+    while fstr != '------------------------------\n' and fstr != '':
+        hyps.append(fstr[0:-1])
+        end = library.tell()
+        fstr = library.readline()
+    hyp_block = (start, end - start)
+    start = library.tell()
+    end = start
+    fstr = library.readline()
+    while fstr != '\n' and fstr != '':
+        tars.append(fstr[0:-1])
+        end = library.tell()
+        fstr = library.readline()
+    tar_block = (start, end - start)
+    return [qz_block, hyp_block, tar_block], (qz, hyps, tars)
+
+def parse_lines(qz, hyps, tars):
+    """
+    Given the lines (qz, hyps, tars) of a library entry, as returned by
+    read_blocks, return a triple of parse trees for them, or None if any of
+    the lines fails to parse.
+    """
+    qz_tree = None
+    if qz != None:
+        qz_tree = parse_statement(qz)
+        if qz_tree == None:
+            return None
+    hyp_trees = [parse_statement(hyp) for hyp in hyps]
+    tar_trees = [parse_statement(tar) for tar in tars]
+    if None in hyp_trees or None in tar_trees:
+        return None
+    return qz_tree, hyp_trees, tar_trees
+
+def library_map(path):
+    """
+    Return a read only mmap of the library at the given path. The map is kept
+    open and only replaced when the library changes.
+    """
+    st = os.stat(path)
+    if path in library_maps:
+        mtime, size, m = library_maps[path]
+        if mtime == st.st_mtime_ns and size == st.st_size:
+            return m
+        m.close()
+        del library_maps[path]
+    with open(path, "rb") as f:
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    library_maps[path] = (st.st_mtime_ns, st.st_size, m)
+    return m
+
+def entry_lines(path, entry):
+    """
+    Given the path of a library and a LibraryEntry in its compiled form, return
+    the lines (qz, hyps, tars) of the entry, as per read_blocks. The body of
+    the entry is read with a single slice of an mmap of the library, the
+    blocks then being split using the offset table of the entry.
+    """
+    qz_block, hyp_block, tar_block = entry.blocks
+    start = qz_block[0]
+    body = library_map(path)[start:tar_block[0] + tar_block[1]]
+    qz = None
+    if qz_block[1]:
+        qz = body[0:qz_block[1]].decode()[0:-1]
+    hyps = body[hyp_block[0] - start:hyp_block[0] - start + hyp_block[1]].decode().split('\n')[0:-1]
+    tars = body[tar_block[0] - start:tar_block[0] - start + tar_block[1]].decode().split('\n')[0:-1]
+    return qz, hyps, tars
+
+def compile_entries(screen, cache, path, start):
+    """
+    Parse the library at the given path, from file position start (which must
+    be the start of an entry) to the end, including the constants lines and
+    all statements, and add the entries to the given LibraryCache. File
+    positions are those that would be reported when reading the library
+    sequentially, so they are compatible with positions used elsewhere.
+    """
+    with open(path, "r") as library:
+        library.seek(start)
+        title = library.readline()
+        while title: # check for EOF
+            const_str = library.readline()[0:-1]
+            success, consts = parse_consts(screen, const_str)
+            nconst_str = library.readline()[0:-1]
+            success, nconsts = parse_consts(screen, nconst_str)
+            tags = library.readline()[0:-1]
+            filepos = library.tell()
+            blocks, lines = read_blocks(library)
+            stmt = parse_lines(*lines)
+            body = None if stmt == None else pickle.dumps(stmt)
+            cache.add_entry(LibraryEntry(title[7:-1], consts, nconsts, tags, filepos, blocks, body))
+            title = library.readline()
+
+def compile_library(screen, path, mtime, size, digest):
+    """
+    Parse the entire library at the given path and return a LibraryCache
+    containing the result.
+    """
+    cache = LibraryCache(mtime, size, digest)
+    compile_entries(screen, cache, path, 0)
+    return cache
+
+def read_cache(cache_path):
+    """
+    Load a compiled library from disk. Returns None if there is no cache file,
+    it can't be read or it has the wrong version.
+    """
+    try:
+        with open(cache_path, "rb") as f:
+            cache = pickle.load(f)
+    except Exception:
+        return None
+    if not isinstance(cache, LibraryCache) or cache.version != cache_version:
+        return None
+    return cache
+
+def write_cache(cache_path, cache):
+    """
+    Write a compiled library to disk. The file is written under a temporary
+    name and moved into place so that concurrent readers never see a partial
+    file. Failure to write (e.g. a read only directory) is not an error, the
+    cache is simply not persisted.
+    """
+    tmp_path = cache_path+"."+str(os.getpid())
+    try:
+        with open(tmp_path, "wb") as f:
+            pickle.dump(cache, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+def load_library(screen, path="library.dat"):
+    """
+    Return the compiled LibraryCache for the library at the given path. The
+    compiled library is kept in memory and in a cache file next to the library.
+    It is brought up to date whenever the library changes. If only the mtime
+    of the library has changed, its hash is checked before deciding to
+    recompile, and if entries have only been appended to the library (e.g. by
+    library_export), only the new entries are compiled.
+    """
+    st = os.stat(path)
+    cache = library_caches.get(path)
+    if cache != None and cache.mtime == st.st_mtime_ns and cache.size == st.st_size:
+        return cache
+    cache_path = path+cache_suffix
+    if cache == None or cache.size != st.st_size:
+        disk_cache = read_cache(cache_path)
+        if disk_cache != None:
+            cache = disk_cache
+    if cache != None and (cache.mtime != st.st_mtime_ns or cache.size != st.st_size):
+        with open(path, "rb") as f:
+            data = f.read()
+        if cache.size == len(data) and cache.digest == hashlib.sha256(data).hexdigest():
+            cache.mtime = st.st_mtime_ns # contents unchanged, just touched
+        elif cache.size < len(data) and (cache.size == 0 or data[cache.size - 2:cache.size] == b"\n\n") and \
+             cache.digest == hashlib.sha256(data[0:cache.size]).hexdigest():
+            compile_entries(screen, cache, path, cache.size) # entries were appended
+            cache.mtime = st.st_mtime_ns
+            cache.size = len(data)
+            cache.digest = hashlib.sha256(data).hexdigest()
+        else:
+            cache = None
+        if cache != None:
+            write_cache(cache_path, cache)
+    if cache == None:
+        cache = compile_library(screen, path, st.st_mtime_ns, st.st_size, library_digest(path))
+        write_cache(cache_path, cache)
+    library_caches[path] = cache
+    return cache
+
+def library_entry(screen, library, filepos):
+    """
+    Given an open library file (library) and a file position (filepos) as used
+    by the library functions, return the compiled LibraryEntry at that
+    position, or None if there is none.
+    """
+    cache = load_library(screen, library.name)
+    return cache.filepos.get(filepos)
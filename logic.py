@@ -2,13 +2,15 @@ from utility import unquantify, relabel, append_tree, replace_tree, \
      add_descendant, target_compatible, complement_tree, process_constraints, \
      get_constants, merge_lists, skolemize_quantifiers, skolemize_statement, \
      add_sibling, vars_used, domain, codomain, universe, metavars_used, \
-     tags_to_list, canonicalise_tags, record_move, duplicate_move
+     tags_to_list, canonicalise_tags, record_move, duplicate_move, retype_vars
 from unification import check_macros, unify, substitute, same_tree
 from copy import deepcopy
 from nodes import AndNode, OrNode, ImpliesNode, LRNode, LeafNode, ForallNode, \
      ExistsNode, TupleNode, FnApplNode, NotNode, IffNode, SetOfNode, EqNode, \
-     SymbolNode, SubseteqNode, VarNode
+     SymbolNode, SubseteqNode, VarNode, AutoImplNode, AutoIffNode, AutoEqNode
 from parser import to_ast
+from autoparse import format_consts
+from libcache import library_entry, load_library, entry_lines
 from sorts import FunctionConstraint, DomainTuple, PredSort
 
 def fill_macros(screen, tl):
@@ -428,27 +430,97 @@ def clear_tableau(screen, tl):
     tl.constraints = dict()
     tl.constraints_processed = (0, 0, 0)
     tl.sorts_processed = (0, 0, 0)
+    tl.constraints_dirty = (set(), set(), set())
+    tl.sorts_dirty = (set(), set(), set())
+    tl.var_lines = dict()
+    tl.proof_cache = None
     tl.tlist1.dep = dict()
     tl.loaded_theorem = None
     tl.focus = tl.tlist0
     tl.moves = []
 
-def filter_library(screen, tl, library, tags):
+def filter_library(screen, tl, library, tags, prefix=''):
+    """
+    Given an open library file (library) and a string of hashtags (tags),
+    return a list of pairs (filepos, title) for all the theorems/definitions
+    in the library which have all of the given tags. If a prefix is given,
+    only those whose title begins with it are returned (the first letter
+    may also match its upper case version). The tag and title indices of the
+    precompiled library are used rather than reading through the library.
+    """
     tags = canonicalise_tags(tags) # deal with constraint shorthands
     taglist = tags_to_list(tags)
-    print("taglist:"+str(taglist))
-    filtered_titles = []
-    title = library.readline()
-    while title: # check for EOF
-        library.readline() # skip constants for now
-        library.readline() # skip terms for now
-        libtaglist = tags_to_list(library.readline()[0:-1])
-        if all(elem in libtaglist for elem in taglist):
-            filtered_titles.append((library.tell(), title[7:-1]))
-        while title != '\n':
-            title = library.readline()
-        title = library.readline()
-    return filtered_titles
+    return load_library(screen, library.name).filter(taglist, prefix)
+
+def read_statement(screen, library, filepos):
+    """
+    Given an open library file (library) and a fileposition (filepos), return
+    a triple (qz, hyps, tars) consisting of the quantifier zone (or None), the
+    list of hypotheses and the list of targets of the theorem/definition at the
+    given position. Where possible the precompiled library cache is used, so
+    that no parsing is required. Otherwise the text of the entry is read with
+    a single slice of a memory map of the library, using the offset table of
+    the cache, and parsed. The trees returned are always fresh copies.
+    """
+    entry = library_entry(screen, library, filepos)
+    if entry:
+        stmt = entry.statement()
+        if stmt:
+            return stmt
+        qz, hyps, tars = entry_lines(library.name, entry)
+        qz = to_ast(screen, qz) if qz != None else None
+        hyps = [to_ast(screen, hyp) for hyp in hyps]
+        tars = [to_ast(screen, tar) for tar in tars]
+        return qz, hyps, tars
+    library.seek(filepos)
+    qz = None
+    hyps = []
+    tars = []
+    fstr = library.readline()
+    if fstr != '------------------------------\n':
+        qz = to_ast(screen, fstr[0:-1])
+        library.readline()
+    fstr = library.readline()
+    while fstr != '------------------------------\n':
+        hyps.append(to_ast(screen, fstr[0:-1]))
+        fstr = library.readline()
+    fstr = library.readline()
+    while fstr != '\n':
+        tars.append(to_ast(screen, fstr[0:-1]))
+        fstr = library.readline()
+    return qz, hyps, tars
+
+def join_theorem(qz, hyps, tars):
+    """
+    Given the quantifier zone (or None), list of hypotheses and list of targets
+    of a theorem/definition, return it as a single tree, with the hypotheses
+    and targets joined by conjunctions and an implication, inside the
+    quantifier zone. The trees passed in are used to build the result.
+    """
+    jtars = tars[0]
+    for i in tars[1:]:
+        jtars = AndNode(jtars, i)
+    if hyps:
+        jhyps = hyps[0]
+        for node in hyps[1:]:
+            jhyps = AndNode(jhyps, node)
+        jtars = ImpliesNode(jhyps, jtars)
+    if qz != None:
+        t = qz
+        while t.left:
+            t = t.left
+        t.left = jtars
+        return qz
+    return jtars
+
+def read_theorem(screen, library, filepos):
+    """
+    Given an open library file (library) and a fileposition (filepos), return
+    the theorem/definition at the given position as a single tree, as per
+    join_theorem.
+    """
+    qz, hyps, tars = read_statement(screen, library, filepos)
+    return join_theorem(qz, hyps, tars)
 
 def library_load(screen, tl, library, filepos):
     """
@@ -461,33 +533,16 @@ def library_load(screen, tl, library, filepos):
     """
     dirty1 = []
     dirty2 = []
-    library.seek(filepos)
     tlist0 = tl.tlist0.data
     tlist1 = tl.tlist1.data
     tlist2 = tl.tlist2.data
-    fstr = library.readline()
-    if fstr != '------------------------------\n':
-        stmt = to_ast(screen, fstr[0:-1])
-        append_tree(tlist0, stmt, None)
-        library.readline()
-        fstr = library.readline()
-        while fstr != '------------------------------\n':
-            stmt = to_ast(screen, fstr[0:-1])
-            append_tree(tlist1, stmt, dirty1)
-            fstr = library.readline()
-        fstr = library.readline()
-        while fstr != '\n':
-            stmt = to_ast(screen, fstr[0:-1])
-            append_tree(tlist2, stmt, dirty2)
-            fstr = library.readline()
-    else:
-        library.readline()
-        library.readline()
-        fstr = library.readline()
-        while fstr != '\n':
-            stmt = to_ast(screen, fstr[0:-1])
-            append_tree(tlist2, stmt, dirty2)
-            fstr = library.readline()
+    qz, hyps, tars = read_statement(screen, library, filepos)
+    if qz != None:
+        append_tree(tlist0, qz, None)
+    for stmt in hyps:
+        append_tree(tlist1, stmt, dirty1)
+    for stmt in tars:
+        append_tree(tlist2, stmt, dirty2)
     return dirty1, dirty2
 
 def library_import(screen, tl, library, filepos):
@@ -497,45 +552,7 @@ def library_import(screen, tl, library, filepos):
     returns True if the operation was successful, otherwise False. In theory,
     the function should not fail.
     """
-    library.seek(filepos)
-    fstr = library.readline()
-    hyps = []
-    tars = []
-    if fstr != '------------------------------\n':
-        tree = to_ast(screen, fstr[0:-1])
-        t = tree
-        while t.left:
-            t = t.left
-        library.readline()
-        fstr = library.readline()
-        while fstr != '------------------------------\n':
-            hyps.append(to_ast(screen, fstr[0:-1]))
-            fstr = library.readline()
-        fstr = library.readline()
-        while fstr != '\n':
-            tars.append(to_ast(screen, fstr[0:-1]))
-            fstr = library.readline()
-        if hyps:
-            jhyps = hyps[0]
-            for node in hyps[1:]:
-                jhyps = AndNode(jhyps, node)
-        jtars = tars[0]
-        for i in tars[1:]:
-            jtars = AndNode(jtars, i)
-        if hyps:
-            t.left = ImpliesNode(jhyps, jtars)
-        else:
-            t.left = jtars
-    else:
-        library.readline()
-        library.readline()
-        fstr = library.readline()
-        while fstr != '\n':
-            tars.append(to_ast(screen, fstr[0:-1]))
-            fstr = library.readline()
-        tree = tars[0]
-        for i in tars[1:]:
-            tree = AndNode(tree, i)
+    tree = read_theorem(screen, library, filepos)
     tlist1 = tl.tlist1.data
     stmt, _ = relabel(screen, tl, [], tree)
     ok = process_constraints(screen, stmt, tl.constraints)
@@ -555,45 +572,14 @@ def fake_import(screen, tl, library, filepos):
     form P => (Q iff R), the remaining iff being split as normal in the list
     of theorems that results. Equalities are stated in both directions.
     """
-    library.seek(filepos)
-    fstr = library.readline()
-    hyps = []
-    tars = []
-    if fstr != '------------------------------\n':
-        tree = to_ast(screen, fstr[0:-1])
-        t = tree
-        while t.left:
-            t = t.left
-        library.readline()
-        fstr = library.readline()
-        while fstr != '------------------------------\n':
-            hyps.append(to_ast(screen, fstr[0:-1]))
-            fstr = library.readline()
-        fstr = library.readline()
-        while fstr != '\n':
-            tars.append(to_ast(screen, fstr[0:-1]))
-            fstr = library.readline()
-        if hyps:
-            jhyps = hyps[0]
-            for node in hyps[1:]:
-                jhyps = AndNode(jhyps, node)
-        jtars = tars[0]
-        for i in tars[1:]:
-            jtars = AndNode(jtars, i)
-        if hyps:
-            t.left = ImpliesNode(jhyps, jtars)
-        else:
-            t.left = jtars
-    else:
-        library.readline()
-        library.readline()
-        fstr = library.readline()
-        while fstr != '\n':
-            tars.append(to_ast(screen, fstr[0:-1]))
-            fstr = library.readline()
-        tree = tars[0]
-        for i in tars[1:]:
-            tree = AndNode(tree, i)
+    tree = read_theorem(screen, library, filepos)
+    return split_theorem(screen, tl, tree)
+
+def split_theorem(screen, tl, tree):
+    """
+    Given a theorem/definition as a single tree, as per join_theorem, return
+    the triple (qz, tpred, impls) described in fake_import.
+    """
     # peel any binders
     if (isinstance(tree, ForallNode) and not isinstance(tree.left, ImpliesNode)) or \
         isinstance(tree, ExistsNode):
@@ -646,60 +632,96 @@ def fake_import(screen, tl, library, filepos):
         i += 1
     return qz, tpred, impls
 
+def library_constants(screen, tl, tree):
+    """
+    Given a theorem/definition as a single tree, as per join_theorem, return
+    a pair (consts, nconsts) giving the constants headers for the library,
+    in the format returned by parse_consts. The second header contains the
+    constants of the complements of the statements, for modus tollens.
+    """
+    qz, tpred, impls = split_theorem(screen, tl, tree)
+    c0 = get_constants(screen, tl, qz)
+    c1 = get_constants(screen, tl, tpred)
+    c2 = []
+    nc2 = []
+    for v in impls:
+        if isinstance(v, ImpliesNode):
+            if v.iff:
+                c2.append(AutoIffNode(get_constants(screen, tl, v.left), \
+                                      get_constants(screen, tl, v.right)))
+                nc2.append(AutoIffNode(get_constants(screen, tl, complement_tree(v.left)), \
+                                       get_constants(screen, tl, complement_tree(v.right))))
+            else:
+                c2.append(AutoImplNode(get_constants(screen, tl, v.left), get_constants(screen, tl, v.right)))
+                nc2.append(AutoImplNode(get_constants(screen, tl, complement_tree(v.left)), \
+                                        get_constants(screen, tl, complement_tree(v.right))))
+        elif isinstance(v, EqNode):
+            c2.append(AutoEqNode(get_constants(screen, tl, v.left), get_constants(screen, tl, v.right)))
+            nc2.append(AutoEqNode(get_constants(screen, tl, v.left), get_constants(screen, tl, v.right)))
+        else:
+            c2.append(get_constants(screen, tl, v))
+            nc2.append(get_constants(screen, tl, complement_tree(v)))
+    return (c0, c1, c2), (c0, c1, nc2)
+
 def library_export(screen, tl, library, title, tags):
     """
     Given a library file (library) open for appending, a title string and a
     string which is a comma separated list of tags, write the current tableau
-    to the library as a theorem/definition.
+    to the library as a theorem/definition. The constants headers are written
+    in the current format (see format_consts). The precompiled library,
+    including its tag and title indices, is then brought up to date.
     """
     tlist0 = tl.tlist0.data
     tlist1 = tl.tlist1.data
     tlist2 = tl.tlist2.data
-    c0 = get_constants(screen, tl, tlist0[0]) 
-    if len(tlist1) == 0 and len(tlist2) == 1 and \
-       (isinstance(tlist2[0], IffNode) or isinstance(tlist2[0], EqNode)):
-        is_iff = True
-        c1 = get_constants(screen, tl, tlist2[0].left)
-        c2 = get_constants(screen, tl, tlist2[0].right)
-    else:
-        is_iff = False
-        c1 = merge_lists([get_constants(screen, tl, v) for v in tlist1])
-        c2 = merge_lists([get_constants(screen, tl, v) for v in tlist2])
-    consts = "["+str(is_iff)+", "+str(c0)+", "+str(c1)+", "+str(c2)+"]\n"
-    library.write(title+"\n")
-    library.write(consts+"\n")
-    library.write(tags+"\n")
-    qz_written = False
+    qz_str = ''
     if tlist0:
-        library.write(repr(tlist0[0]))
-        qz_written = True
+        qz_str += repr(tlist0[0])
     for hyp in tlist1:
         while isinstance(hyp, ExistsNode):
-            if qz_written:
-                library.write(" ")
-            library.write(repr(ExistsNode(hyp.var, None)))
+            if qz_str:
+                qz_str += " "
+            qz_str += repr(ExistsNode(hyp.var, None))
             hyp = hyp.left
-            qz_written = True
     for tar in tlist2:
         while isinstance(tar, ForallNode):
-            if qz_written:
-                library.write(" ")
-            library.write(repr(ForallNode(tar.var, None)))
+            if qz_str:
+                qz_str += " "
+            qz_str += repr(ForallNode(tar.var, None))
             tar = tar.left
-            qz_written = True
-    if qz_written:
-        library.write("\n")
-    library.write("------------------------------\n")
+    hyp_strs = []
     for hyp in tlist1:
         while isinstance(hyp, ExistsNode):
             hyp = hyp.left
-        library.write(repr(hyp)+"\n")
-    library.write("------------------------------\n")
+        hyp_strs.append(repr(hyp))
+    tar_strs = []
     for tar in tlist2:
         while isinstance(tar, ForallNode):
             tar = tar.left
-        library.write(repr(tar)+"\n")
+        tar_strs.append(repr(tar))
+    if tar_strs:
+        # compute the headers from the statement as it will be read back in
+        qz = to_ast(screen, qz_str) if qz_str else None
+        tree = join_theorem(qz, [to_ast(screen, v) for v in hyp_strs], \
+                                [to_ast(screen, v) for v in tar_strs])
+        consts, nconsts = library_constants(screen, tl, tree)
+    else:
+        consts = nconsts = ([], [], [])
+    library.write(title+"\n")
+    library.write(format_consts(consts)+"\n")
+    library.write(format_consts(nconsts)+"\n")
+    library.write(tags+"\n")
+    if qz_str:
+        library.write(qz_str+"\n")
+    library.write("------------------------------\n")
+    for hyp in hyp_strs:
+        library.write(hyp+"\n")
+    library.write("------------------------------\n")
+    for tar in tar_strs:
+        library.write(tar+"\n")
     library.write("\n")
+    library.flush()
+    load_library(screen, library.name) # refresh the library indices
 
 def cleanup(screen, tl, ttree):
     """
@@ -738,12 +760,10 @@ def cleanup(screen, tl, ttree):
     sk = []
     qz = []
     mv = []
+    changed = [] # variables whose binders are added or changed
     if tl0:
         sq, deps, sk, ex = skolemize_quantifiers(tl0[0], deps, sk, [])
         qzext = []
-        if len(ex) > 0: # constraint of new skolem variable will need to be recomputed
-           tl.constraints_processed = (0, 0, 0)
-           tl.sorts_processed = (0, 0, 0)
         for i in range(len(ex)):
             n = sk[i][1] # number of dependencies
             domain_constraints = [v.var.constraint if isinstance(v, ForallNode) else v.constraint for v in deps[0:n]]
@@ -756,6 +776,7 @@ def cleanup(screen, tl, ttree):
             var = VarNode(ex[i].name(), fn_constraint)
             var.skolemized = True # make sure we don't skolemize it again
             qzext.append(ExistsNode(var, None))
+            changed.append(var.name()) # constraint of new skolem variable will need to be recomputed
         if qzext:
             root = qzext[0]
             t = root
@@ -935,8 +956,8 @@ def cleanup(screen, tl, ttree):
                     mv.pop()
 
     if qz:
-        tl.constraints_processed = (0, 0, 0)
-        tl.sorts_processed = (0, 0, 0)
+        for v in qz:
+            changed.append(v.var.name())
         if tl0:
             t = tl0[0]
             while t.left:
@@ -951,4 +972,7 @@ def cleanup(screen, tl, ttree):
             t = t.left
         t.left = None
 
+    if changed: # only lines depending on these binders need typing again
+        retype_vars(tl, changed, dirty1, dirty2)
+
     return dirty1, dirty2
\ No newline at end of file
@@ -19,20 +19,220 @@ from utility import unquantify, relabel, append_tree, \
      append_tree2, replace_tree, replace_tree2, add_sibling, add_descendant, \
      skolemize_quantifiers, skolemize_statement, insert_sort, target_compatible, \
      target_depends, deps_defunct, deps_intersect, deps_compatible, \
-     complement_tree, tags_to_list, canonicalise_tags, filter_titles, \
-     trim_spaces, find_all, find_start_index, metavars_used, target_metavars, \
+     complement_tree, tags_to_list, canonicalise_tags, \
+     trim_spaces, find_all, metavars_used, target_metavars, \
      domain, codomain, system_unary_functions, \
      system_binary_functions, system_predicates, list_merge, get_constraint, \
      get_constants, merge_lists, process_constraints, get_terms, get_init_vars, \
      sorts_compatible, coerce_sorts, sorts_equal, vars_used, list_merge, \
-     treelist_prune
+     treelist_prune, SortTree
+from disctree import DiscriminationTree, ground_key
 import logic
 
-from editor import edit
 from parser import to_ast
-from interface import nchars_to_chars
+from autoparse import format_consts
 
-def annotate_ttree(screen, tl, ttree, hydras, tarmv):
+# The editor and interface modules import curses, so they are imported only
+# by the moves which interact with the user. The proof checking in this
+# module can then be used without a terminal (see prover.py).
+
+class ProofCache:
+    """
+    The unifications tried by check_targets_proved, kept between calls so that
+    on each call only those involving hypotheses and targets which are new or
+    have changed since the last call need to be tried again. A line has
+    changed if the object at its index is no longer the one the results are
+    for (e.g. because it was replaced or marked dead) or if it is listed as
+    having been modified in place. The results are only valid for the target
+    tree, quantifier zone and sort tree they were computed with. Ground
+    hypotheses and complements are also kept in hash tables by their ground
+    keys, so that contradictions between ground hypotheses are found without
+    unification.
+    """
+    def __init__(self, tl, ttree):
+        self.ttree = ttree # target tree results are for
+        self.qz = tl.tlist0.data[0] if tl.tlist0.data else None # first binder of quantifier zone
+        self.version = tl.stree.version # version of sort tree
+        self.hyps = [] # hypotheses results are for
+        self.tars = [] # targets results are for
+        self.mv1 = [] # metavariables used by each hypothesis
+        self.mv2 = [] # metavariables used by each target
+        self.hyp_index = DiscriminationTree() # live hypotheses (and stale entries)
+        self.tar_index = DiscriminationTree() # live targets (and stale entries)
+        self.complements = dict() # i -> complement of live hypothesis i
+        self.complement_index = DiscriminationTree() # complements (and stale entries)
+        self.keys = dict() # i -> (ground key of live hyp i, of its complement)
+        self.ground = dict() # ground key -> live hyps with that key
+        self.ground_complements = dict() # ground key -> live hyps whose complement has that key
+        self.nonground_index = DiscriminationTree() # live hyps which are not ground (and stale entries)
+        self.nonground_complement_index = DiscriminationTree() # complements which are not ground (and stale entries)
+        self.candidates = dict() # j -> hyps that may unify with live target j
+        self.matches = dict() # j -> hyps which unify with target j
+        self.contradictions = set() # (i, j) where complement of hyp i unifies with hyp j
+        self.converse = dict() # j -> (i -> whether hyp i unifies with target j)
+        self.tautologies = dict() # j -> whether sides of equality j unify
+
+    def valid(self, tl, ttree):
+        """
+        Return True if the results can be reused for the given tableau and
+        target tree.
+        """
+        qz = tl.tlist0.data[0] if tl.tlist0.data else None
+        return self.ttree == ttree and self.qz == qz and \
+               isinstance(tl.stree, SortTree) and self.version == tl.stree.version and \
+               len(self.hyps) <= len(tl.tlist1.data) and len(self.tars) <= len(tl.tlist2.data)
+
+    def unifies(self, screen, tl, tree1, tree2):
+        unifies, assign, macros = unify(screen, tl, tree1, tree2)
+        return unifies and check_macros(screen, tl, macros, assign, tl.tlist0.data)
+
+    def update(self, screen, tl, dirty1, dirty2):
+        """
+        Try again all the unifications involving hypotheses and targets which
+        are new, have been replaced or are listed in dirty1 and dirty2 as
+        having been modified in place.
+        """
+        tlist1 = tl.tlist1.data
+        tlist2 = tl.tlist2.data
+        changed1 = set(i for i in dirty1 if i < len(self.hyps))
+        changed2 = set(j for j in dirty2 if j < len(self.tars))
+        for i in range(len(tlist1)):
+            if i >= len(self.hyps):
+                self.hyps.append(tlist1[i])
+                self.mv1.append([])
+                changed1.add(i)
+            elif tlist1[i] is not self.hyps[i]:
+                self.hyps[i] = tlist1[i]
+                changed1.add(i)
+        for j in range(len(tlist2)):
+            if j >= len(self.tars):
+                self.tars.append(tlist2[j])
+                self.mv2.append([])
+                changed2.add(j)
+            elif tlist2[j] is not self.tars[j]:
+                self.tars[j] = tlist2[j]
+                changed2.add(j)
+        if not changed1 and not changed2:
+            return
+        live1 = [i for i in sorted(changed1) if not isinstance(tlist1[i], DeadNode)]
+        live2 = [j for j in sorted(changed2) if not isinstance(tlist2[j], DeadNode)]
+        # discard results for changed lines and index their new versions
+        for i in changed1:
+            self.mv1[i] = metavars_used(tlist1[i])
+            self.complements.pop(i, None)
+            if i in self.keys:
+                key1, key2 = self.keys.pop(i)
+                if key1 != None:
+                    self.ground[key1].discard(i)
+                if key2 != None:
+                    self.ground_complements[key2].discard(i)
+        for i in live1:
+            self.complements[i] = complement_tree(tlist1[i])
+            self.hyp_index.insert(tlist1[i], i)
+            self.complement_index.insert(self.complements[i], i)
+            key1 = ground_key(tlist1[i])
+            key2 = ground_key(self.complements[i])
+            self.keys[i] = (key1, key2)
+            if key1 != None:
+                self.ground.setdefault(key1, set()).add(i)
+            else:
+                self.nonground_index.insert(tlist1[i], i)
+            if key2 != None:
+                self.ground_complements.setdefault(key2, set()).add(i)
+            else:
+                self.nonground_complement_index.insert(self.complements[i], i)
+        for j in changed2:
+            self.mv2[j] = metavars_used(tlist2[j])
+            self.candidates.pop(j, None)
+            self.matches.pop(j, None)
+            self.converse.pop(j, None)
+            self.tautologies.pop(j, None)
+        for j in live2:
+            self.tar_index.insert(tlist2[j], j)
+        if changed1:
+            for j in self.candidates:
+                self.candidates[j] -= changed1
+                self.matches[j] -= changed1
+            for j in self.converse:
+                for i in changed1:
+                    self.converse[j].pop(i, None)
+            self.contradictions = set((i, j) for (i, j) in self.contradictions \
+                                      if i not in changed1 and j not in changed1)
+        # unify changed targets with all hypotheses
+        for j in live2:
+            self.candidates[j] = set(i for i in self.hyp_index.candidates(tlist2[j]) \
+                                     if not isinstance(tlist1[i], DeadNode))
+            self.matches[j] = set(i for i in self.candidates[j] \
+                                  if self.unifies(screen, tl, tlist2[j], tlist1[i]))
+        # unify changed hypotheses with unchanged targets
+        for i in live1:
+            for j in self.tar_index.candidates(tlist1[i]):
+                if j in self.candidates and j not in changed2 and i not in self.candidates[j]:
+                    self.candidates[j].add(i)
+                    if self.unifies(screen, tl, tlist2[j], tlist1[i]):
+                        self.matches[j].add(i)
+        # find contradictions involving changed hypotheses, looking up pairs
+        # of ground trees by key and unifying only if one has metavariables
+        for i in live1:
+            key1, key2 = self.keys[i]
+            if key2 != None:
+                for j in self.ground.get(key2, []):
+                    if i != j:
+                        self.contradictions.add((i, j))
+            index = self.hyp_index if key2 == None else self.nonground_index
+            for j in index.candidates(self.complements[i]):
+                if i != j and j in self.complements and \
+                       (key2 == None or self.keys[j][0] == None) and \
+                       self.unifies(screen, tl, self.complements[i], tlist1[j]):
+                    self.contradictions.add((i, j))
+            if key1 != None:
+                for k in self.ground_complements.get(key1, []):
+                    if k != i and k not in changed1:
+                        self.contradictions.add((k, i))
+            index = self.complement_index if key1 == None else self.nonground_complement_index
+            for k in index.candidates(tlist1[i]):
+                if k != i and k not in changed1 and k in self.complements and \
+                       (key1 == None or self.keys[k][1] == None) and \
+                       self.unifies(screen, tl, self.complements[k], tlist1[i]):
+                    self.contradictions.add((k, i))
+
+    def converse_unifies(self, screen, tl, i, j):
+        """
+        Return True if live hypothesis i unifies with live target j, with the
+        hypothesis first.
+        """
+        if i not in self.candidates[j]:
+            return False
+        if j not in self.converse:
+            self.converse[j] = dict()
+        if i not in self.converse[j]:
+            self.converse[j][i] = self.unifies(screen, tl, tl.tlist1.data[i], tl.tlist2.data[j])
+        return self.converse[j][i]
+
+    def tautology(self, screen, tl, j):
+        """
+        Return True if the sides of the equality target j unify.
+        """
+        if j not in self.tautologies:
+            tree = tl.tlist2.data[j]
+            self.tautologies[j] = self.unifies(screen, tl, tree.left, tree.right)
+        return self.tautologies[j]
+
+def proof_cache(screen, tl, ttree, dirty1=None, dirty2=None):
+    """
+    Return the ProofCache for the given tableau and target tree, brought up to
+    date. If dirty1 and dirty2 are None, nothing is known about which lines
+    have been modified in place and all unifications are tried again.
+    """
+    if dirty1 == None or dirty2 == None or tl.proof_cache == None or \
+       not tl.proof_cache.valid(tl, ttree):
+        tl.proof_cache = ProofCache(tl, ttree)
+        dirty1 = []
+        dirty2 = []
+    tl.proof_cache.update(screen, tl, dirty1, dirty2)
+    return tl.proof_cache
+
+def annotate_ttree(screen, tl, ttree, hydras, tarmv, cache=None):
     """
     Goes through the target dependency tree, ttree, and annotates each node
     with a list (called unifies) of hypotheses that unify with the associated
@@ -47,6 +247,8 @@ def annotate_ttree(screen, tl, ttree, hydras, tarmv):
     appear in the hypotheses i and j that don't appear in the target. To
     enable this, the function must be supplied with a list, tarmv, of the
     metavariables used in targets.
+    The unifications are looked up in a ProofCache, cache, for the tableau.
+    If none is supplied, one is created.
     The function not only appends the list of unifications to the target
     dependency tree nodes but also returns a list of the counts of such
     unifications and a list of lists of the unifications in the format we
@@ -58,58 +260,50 @@ def annotate_ttree(screen, tl, ttree, hydras, tarmv):
     ttree_full = ttree
     unification_count = [0 for i in range(len(tlist2))]
     unifications = [[] for i in range(len(tlist2))]
+    if cache == None:
+        cache = proof_cache(screen, tl, ttree)
+    contradictions = sorted(cache.contradictions)
     
     def mark(ttree):
         if ttree.proved:
             return
         if ttree.num != -1:
             ttree.unifies = []
-            for i in range(len(tlist1)):
-                if not isinstance(tlist2[ttree.num], DeadNode) and not isinstance(tlist1[i], DeadNode) and \
-                       deps_compatible(screen, tl, ttree_full, ttree.num, i):
-                    unifies, assign, macros = unify(screen, tl, tlist2[ttree.num], tlist1[i])
-                    unifies = unifies and check_macros(screen, tl, macros, assign, tl.tlist0.data)
-                    if unifies:
+            if not isinstance(tlist2[ttree.num], DeadNode):
+                for i in sorted(cache.matches[ttree.num]):
+                    if not isinstance(tlist1[i], DeadNode) and \
+                           deps_compatible(screen, tl, ttree_full, ttree.num, i):
                         ttree.unifies.append(i)
                         unification_count[ttree.num] += 1
                         unifications[ttree.num].append(i)
                         if ttree.metavars not in hydras:
                             hydras.append(ttree.metavars)
             if isinstance(tlist2[ttree.num], EqNode): # equality may be a tautology
-                unifies, assign, macros = unify(screen, tl, tlist2[ttree.num].left, tlist2[ttree.num].right)
-                unifies = unifies and check_macros(screen, tl, macros, assign, tl.tlist0.data)
-                if unifies:
+                if cache.tautology(screen, tl, ttree.num):
                     ttree.unifies.append(-1) # -1 signifies tautology P = P
                     unification_count[ttree.num] += 1
                     unifications[ttree.num].append(-1)
                     if ttree.metavars not in hydras:
                         hydras.append(ttree.metavars)
-            for i in range(len(tlist1)):
-                if not isinstance(tlist1[i], DeadNode) and \
+            for (i, j) in contradictions:
+                if not isinstance(tlist1[i], DeadNode) and not isinstance(tlist1[j], DeadNode) and \
                         deps_compatible(screen, tl, ttree_full, ttree.num, i): # a contradiction to hyp i would prove this target
-                    tree1 = complement_tree(tlist1[i])
-                    mv1 = metavars_used(tlist1[i])
-                    for j in range(len(tlist1)):
-                        if i != j:
-                            di = deps_intersect(screen, tl, ttree_full, i, j)
-                            dep_ok = False
-                            for d in di:
-                                if target_depends(screen, tl, ttree_full, ttree.num, d):
-                                    dep_ok = True # ttree.num is a descendent of d
-                                    break
-                            if dep_ok and not isinstance(tlist1[j], DeadNode): # this contradiction can prove target ttree.num
-                                tree2 = tlist1[j]
-                                unifies, assign, macros = unify(screen, tl, tree1, tree2)
-                                unifies = unifies and check_macros(screen, tl, macros, assign, tl.tlist0.data)
-                                if unifies:
-                                    mv2 = metavars_used(tlist1[j])
-                                    if all(var in ttree.metavars or var not in tarmv for var in mv1) and \
-                                       all(var in ttree.metavars or var not in tarmv for var in mv2): # check no additional mvars involved
-                                        ttree.unifies.append((i, j)) # (i, j) signifies a contradiction between hyps i and j
-                                        unification_count[ttree.num] += 1
-                                        unifications[ttree.num].append((i, j))
-                                        if ttree.metavars not in hydras:
-                                            hydras.append(ttree.metavars)
+                    di = deps_intersect(screen, tl, ttree_full, i, j)
+                    dep_ok = False
+                    for d in di:
+                        if target_depends(screen, tl, ttree_full, ttree.num, d):
+                            dep_ok = True # ttree.num is a descendent of d
+                            break
+                    if dep_ok: # this contradiction can prove target ttree.num
+                        mv1 = cache.mv1[i]
+                        mv2 = cache.mv1[j]
+                        if all(var in ttree.metavars or var not in tarmv for var in mv1) and \
+                           all(var in ttree.metavars or var not in tarmv for var in mv2): # check no additional mvars involved
+                            ttree.unifies.append((i, j)) # (i, j) signifies a contradiction between hyps i and j
+                            unification_count[ttree.num] += 1
+                            unifications[ttree.num].append((i, j))
+                            if ttree.metavars not in hydras:
+                                hydras.append(ttree.metavars)
                     
         for t in ttree.andlist:
             mark(t)
@@ -117,35 +311,61 @@ def annotate_ttree(screen, tl, ttree, hydras, tarmv):
     mark(ttree)
     return unification_count, unifications
 
-def generate_pairs(V, L, r, i=0, last_chosen_c=None):
+def unify_pair(screen, tl, unifications, c, d, assign):
+    """
+    Try to extend the list of metavariable assignments assign by the d-th of
+    the unifications that might prove target c. This could be a unification
+    of the target with a hypothesis, of a hypothesis with the negation of
+    another or of the two sides of a target that is an equality. Returns a
+    pair (unifies, assign) where assign is a new list of assignments if the
+    unification succeeds. The given list is not modified.
+    """
+    tlist1 = tl.tlist1.data
+    tlist2 = tl.tlist2.data
+    hyp = unifications[c][d]
+    if isinstance(hyp, tuple):
+        (i, j) = hyp
+        tree1 = complement_tree(tlist1[i])
+        tree2 = tlist1[j]
+        unifies, assign2, macros = unify(screen, tl, tree1, tree2, assign)
+    else:
+        if isinstance(tlist2[c], DeadNode):
+            return False, assign
+        if hyp == -1: # signifies tautology P = P
+            unifies, assign2, macros = unify(screen, tl, tlist2[c].left, tlist2[c].right, assign)
+        else:
+            if isinstance(tlist1[hyp], DeadNode):
+                return False, assign
+            unifies, assign2, macros = unify(screen, tl, tlist2[c], tlist1[hyp], assign)
+    unifies = unifies and check_macros(screen, tl, macros, assign2, tl.tlist0.data)
+    return unifies, (assign2 if unifies else assign)
+
+def solve_hydra(screen, tl, V, L, unifications):
     """
-    Creates a generator for iterating through all possible ways of closing
-    targets. A target can only close if it belongs to a set of targets which
-    are all satisfied (either by matching a hypothesis, being proved by a
-    contradiction in the hypotheses or being an equality which is a tautology)
-    and the collective metavariables for which, do not appear elsewhere, and
-    can all be filled in via unification in a consistent way.
-    Of course, it may be that one such target is not a leaf in the target
-    dependency tree. In such a case, we are happy to prove that target, instead
-    of all its descendants in the tree, which creates a combinatorial explosion
-    in the number of ways to prove targets.
+    Creates a generator for iterating through all the ways of killing all the
+    heads of a hydra, i.e. lists S of pairs (c, d) such that, for each head
+    V[i], proving target c_i by the d_i-th unification that might prove it
+    kills the head, and all of the unifications can be done in a compatible
+    way (wrt metavariable assignments coming from the unifications).
 
-    Here is a description of how this function works:
-    V is a list of nonempty lists. The length of V is r. Each list in V is a list
-    of indices in the range 0 to m - 1 inclusive. List L is a list of indices.
+    Here V is a list of nonempty lists of targets, one for each head, namely
+    the targets on the head that could be proved. The list item L[j] is the
+    number of different unifications that could prove target j, given by
+    unifications[j]. The list S has the same length as V and S[i] is a pair
+    (c_i, d_i) where c_i is one of the targets in V[i] and d_i is in the range
+    0 to L[c_i] - 1 inclusive. Moreover the index of c_i in V[i] must exceed
+    that of any target c_k in V[i] chosen for a head k < i.
 
-    This function creates a generator for iterating over all lists S of pairs of
-    integers (c, d) defined as follows. The list S has length r. S[i] is a pair
-    of integers (c_i, d_i) as follows. The index c_i should be one of the integers
-    of V[i]. However, its index in V[i] should exceed that of the greatest index
-    j for which V[i][j] = c_k for some k < i. The integer d_i should be some
-    integer in the range 0 to L[c_i] - 1 inclusive.
+    Rather than trying each of the cartesian product of choices in turn, the
+    solver extends a list of assignments one head at a time and backtracks as
+    soon as a choice does not unify with the choices already made, so that no
+    extension of a failing choice is tried. Heads with the fewest choices are
+    dealt with first, and sets of choices which have failed to unify are
+    remembered, so that they are not tried again when reached in a different
+    order.
 
-    The interpretation is as follows. The list item L[j] is a count of the number
-    of different unifications that could prove target j. The list item V[i] is a
-    list of targets that could be proved which would suffice to prove the i-th
-    target of some list of targets we've identified as being able to be proved
-    as a block (taking into account metavariables).
+    The lists are yielded as they are found, so that targets can be marked as
+    proved (and lines that are no longer needed killed) between them.
 
     TODO: It's not clear that the condition to pick the c_i from the tail of the
     V[i] not containing any previous c_k's is correct. If a c_i is picked which
@@ -155,19 +375,46 @@ def generate_pairs(V, L, r, i=0, last_chosen_c=None):
     reduce complexity, but perhaps it should at least allow the same c_i to be
     picked more than once.
     """
-    if last_chosen_c is None:
-        last_chosen_c = []
-    if i == r:
-        yield []
-    else:
-        start_index = find_start_index(V[i], set(last_chosen_c))
-        for c_index in range(start_index, len(V[i])):
-            c = V[i][c_index]
-            last_chosen_c.append(c)
-            for d in range(L[c]):
-                for rest in generate_pairs(V, L, r, i + 1, last_chosen_c):
-                    yield [(c, d)] + rest
-            last_chosen_c.remove(c)
+    r = len(V)
+    if r == 0:
+        return
+    position = [dict((c, k) for k, c in enumerate(heads)) for heads in V] # index of each target in V[i]
+    choices = [[(c, d) for c in V[i] for d in range(L[c])] for i in range(r)]
+    order = sorted(range(r), key=lambda i: len(choices[i])) # fewest choices first
+    chosen = [None for i in range(r)] # current choice for each head
+    failed = set() # sets of choices that don't unify
+
+    def allowed(i, c):
+        # check the choice of c for head i respects the order of the targets in V
+        for k in range(r):
+            if chosen[k] != None:
+                ck = chosen[k][0]
+                if k < i and ck in position[i] and position[i][ck] >= position[i][c]:
+                    return False
+                if k > i and c in position[k] and position[k][c] >= position[k][ck]:
+                    return False
+        return True
+
+    def search(n, assign, choice_set):
+        if n == r:
+            yield [chosen[i] for i in range(r)]
+            return
+        i = order[n]
+        for (c, d) in choices[i]:
+            if not allowed(i, c):
+                continue
+            new_set = choice_set | {(c, d)}
+            if new_set in failed:
+                continue
+            unifies, new_assign = unify_pair(screen, tl, unifications, c, d, assign)
+            if not unifies:
+                failed.add(new_set)
+                continue
+            chosen[i] = (c, d)
+            yield from search(n + 1, new_assign, new_set)
+            chosen[i] = None
+
+    yield from search(0, [], frozenset())
 
 def find_hydra_heads(screen, tl, ttree, hydras_done, hydras_todo, hydra):
     """
@@ -227,34 +474,17 @@ def try_unifications(screen, tl, ttree, unifications, gen):
     the list as proved. Each of the unifications could be a unification of a
     target with a hypothesis, unification of a hypothesis with the negation of
     another or unification of two sides of a target that is an equality.
+    The unifications are done again in order, as targets and hypotheses may
+    have been killed since gen found them.
     """
     dirty1 = []
     dirty2 = []
     plist = []
-    tlist1 = tl.tlist1.data
-    tlist2 = tl.tlist2.data
     for v in gen: # list of pairs (c, d) where c = targ to unify, d is index into list of hyps that it may unify with (or pair)
         assign = []
         unifies = False
         for (c, d) in v:
-            hyp = unifications[c][d]
-            if isinstance(hyp, tuple):
-                (i, j) = hyp
-                tree1 = complement_tree(tlist1[i])
-                tree2 = tlist1[j]
-                unifies, assign, macros = unify(screen, tl, tree1, tree2, assign)
-            else:
-                if isinstance(tlist2[c], DeadNode):
-                    unifies = False
-                    break
-                if hyp == -1: # signifies tautology P = P
-                    unifies, assign, macros = unify(screen, tl, tlist2[c].left, tlist2[c].right, assign)
-                else:
-                    if isinstance(tlist1[hyp], DeadNode):
-                        unifies = False
-                        break
-                    unifies, assign, macros = unify(screen, tl, tlist2[c], tlist1[hyp], assign)
-            unifies = unifies and check_macros(screen, tl, macros, assign, tl.tlist0.data)
+            unifies, assign = unify_pair(screen, tl, unifications, c, d, assign)
             if not unifies:
                 break
         if unifies:
@@ -265,7 +495,7 @@ def try_unifications(screen, tl, ttree, unifications, gen):
                 plist += pl
     return dirty1, dirty2, plist
                 
-def check_zero_metavar_unifications(screen, tl, ttree, tarmv):
+def check_zero_metavar_unifications(screen, tl, ttree, tarmv, cache=None):
     """
     Some targets do not contain metavariables, and when these can be unified
     with a hypothesis that doesn't involve metavariables used in other targets
@@ -274,36 +504,40 @@ def check_zero_metavar_unifications(screen, tl, ttree, tarmv):
     metavariables. As per the general machinery, a proof of a target in this
     way could involve either unification with a hypothesis, contradiction of
     two hypotheses or a target which is an equality with both sides the same.
+    As for annotate_ttree, a ProofCache, cache, for the tableau can be
+    supplied.
     """
     dirty1 = []
     dirty2 = []
     plist = []
     tlist1 = tl.tlist1.data
     tlist2 = tl.tlist2.data
-    for i in range(len(tlist1)):
-        mv1 = metavars_used(tlist1[i])
-        if not isinstance(tlist1[i], DeadNode) and not any(v in tarmv for v in mv1):
-            for j in range(len(tlist2)):
-                mv2 = metavars_used(tlist2[j])
-                if not isinstance(tlist2[j], DeadNode) and not any(v in tarmv for v in mv2):
-                    if deps_compatible(screen, tl, ttree, j, i):
-                        unifies, assign, macros = unify(screen, tl, tlist1[i], tlist2[j])
-                        unifies = unifies and check_macros(screen, tl, macros, assign, tl.tlist0.data)
-                        if unifies:
-                            d1, d2, pl = mark_proved(screen, tl, ttree, j, i)
-                            dirty1 += d1
-                            dirty2 += d2
-                            plist += pl
-    d1, d2, pl = check_contradictions(screen, tl, ttree, tarmv)
+    if cache == None:
+        cache = proof_cache(screen, tl, ttree)
+    pairs = sorted((i, j) for j in cache.candidates for i in cache.candidates[j])
+    last = None # last hypothesis i considered
+    for (i, j) in pairs:
+        if i != last: # whether hyp i can be used is decided before trying any j
+            last = i
+            mv1 = cache.mv1[i]
+            usable = not isinstance(tlist1[i], DeadNode) and not any(v in tarmv for v in mv1)
+        if usable:
+            mv2 = cache.mv2[j]
+            if not isinstance(tlist2[j], DeadNode) and not any(v in tarmv for v in mv2):
+                if deps_compatible(screen, tl, ttree, j, i):
+                    if cache.converse_unifies(screen, tl, i, j):
+                        d1, d2, pl = mark_proved(screen, tl, ttree, j, i)
+                        dirty1 += d1
+                        dirty2 += d2
+                        plist += pl
+    d1, d2, pl = check_contradictions(screen, tl, ttree, tarmv, cache)
     dirty1 += d1
     dirty2 += d2
     plist += pl
     for i in range(len(tlist2)):
         if isinstance(tlist2[i], EqNode):
-            if not metavars_used(tlist2[i]):
-                unifies, assign, macros = unify(screen, tl, tlist2[i].left, tlist2[i].right)
-                unifies = unifies and check_macros(screen, tl, macros, assign, tl.tlist0.data)
-                if unifies:
+            if not cache.mv2[i]:
+                if cache.tautology(screen, tl, i):
                     d1, d2, p1 = mark_proved(screen, tl, ttree, i, -1)
                     dirty1 += d1
                     dirty2 += d2
@@ -362,38 +596,41 @@ def mark_proved(screen, tl, ttree, n, reason=None):
     process(dirty1, dirty2, plist, ttree, n)
     return dirty1, dirty2, plist
 
-def check_contradictions(screen, tl, ttree, tarmv):
+def check_contradictions(screen, tl, ttree, tarmv, cache=None):
     """
     Check for any contradictions amongst hypotheses that don't involve metavars
     in the list tarmv (taken to be a list of all metavars appearing in
     targets). Mark any targets proved for which the contradicting hypotheses
-    are target compatible.
+    are target compatible. As for annotate_ttree, a ProofCache, cache, for
+    the tableau can be supplied.
     """
     dirty1 = []
     dirty2 = []
     plist = []
     tlist1 = tl.tlist1.data
-    for i in range(len(tlist1)):
-        mv1 = metavars_used(tlist1[i])
-        if not isinstance(tlist1[i], DeadNode) and not any(v in tarmv for v in mv1):
-            tree1 = complement_tree(tlist1[i])
-            for j in range(0, i):
-                mv2 = metavars_used(tlist1[j])
-                if not isinstance(tlist1[j], DeadNode) and not any(v in tarmv for v in mv2):
-                    di = deps_intersect(screen, tl, ttree, i, j)
-                    if di: # hyps i and j can be used to prove targets
-                        tree2 = tlist1[j]
-                        unifies, assign, macros = unify(screen, tl, tree1, tree2)
-                        unifies = unifies and check_macros(screen, tl, macros, assign, tl.tlist0.data)
-                        if unifies: # we found a contradiction
-                            for t in di:
-                                d1, d2, pl = mark_proved(screen, tl, ttree, t, (i, j))
-                                dirty1 += d1
-                                dirty2 += d2
-                                plist += pl
+    if cache == None:
+        cache = proof_cache(screen, tl, ttree)
+    last = None # last hypothesis i considered
+    for (i, j) in sorted(cache.contradictions):
+        if j >= i:
+            continue
+        if i != last: # whether hyp i can be used is decided before trying any j
+            last = i
+            mv1 = cache.mv1[i]
+            usable = not isinstance(tlist1[i], DeadNode) and not any(v in tarmv for v in mv1)
+        if usable:
+            mv2 = cache.mv1[j]
+            if not isinstance(tlist1[j], DeadNode) and not any(v in tarmv for v in mv2):
+                di = deps_intersect(screen, tl, ttree, i, j)
+                if di: # hyps i and j can be used to prove targets
+                    for t in di: # we found a contradiction
+                        d1, d2, pl = mark_proved(screen, tl, ttree, t, (i, j))
+                        dirty1 += d1
+                        dirty2 += d2
+                        plist += pl
     return dirty1, dirty2, plist
 
-def check_targets_proved(screen, tl, ttree):
+def check_targets_proved(screen, tl, ttree, dirty1=None, dirty2=None):
     """
     This is the main wrapper which is called every move to see if we are done.
     First it computes all metavariables used in the targets. It then checks a
@@ -412,22 +649,27 @@ def check_targets_proved(screen, tl, ttree):
     may be created, and these are appended to the list if they aren't the same
     as a hydra we already dealt with. If all the original targets are proved
     at the end of this process, the function returns True, otherwise False.
+    The unifications tried are kept in a ProofCache between calls. If the
+    lists dirty1 and dirty2 of hypotheses and targets modified in place since
+    the last call are supplied, only unifications involving those and any
+    new or replaced lines are tried again.
     """
+    cache = proof_cache(screen, tl, ttree, dirty1, dirty2)
     dirty1 = []
     dirty2 = []
     plist = []
     hydras_done = []
     hydras_todo = []
     tarmv = target_metavars(screen, tl, ttree)
-    d1, d2, pl = check_zero_metavar_unifications(screen, tl, ttree, tarmv)
+    d1, d2, pl = check_zero_metavar_unifications(screen, tl, ttree, tarmv, cache)
     dirty1 += d1
     dirty2 += d2
     plist += pl
-    unification_count, unifications = annotate_ttree(screen, tl, ttree, hydras_todo, tarmv)
+    unification_count, unifications = annotate_ttree(screen, tl, ttree, hydras_todo, tarmv, cache)
     while hydras_todo:
         hydra = hydras_todo.pop()
         heads = find_hydra_heads(screen, tl, ttree, hydras_done, hydras_todo, hydra)
-        gen = generate_pairs(heads, unification_count, len(heads))
+        gen = solve_hydra(screen, tl, heads, unification_count, unifications)
         d1, d2, pl = try_unifications(screen, tl, ttree, unifications, gen)
         dirty1 += d1
         dirty2 += d2
@@ -473,6 +715,7 @@ def select_substring(screen, tl):
     The start and end character indices are also returned, standing for the
     substring including the start index but not the end index.
     """
+    from interface import nchars_to_chars
     window = screen.win1
     pad = screen.pad1
     tlist = tl.tlist1
@@ -658,23 +901,12 @@ def library_import(screen, tl):
     results whose title begins with that letter (optional). Pressing
     Enter then loads the given result from the library into the tableau. 
     """
+    from editor import edit
     tags = edit(screen, "Tags: ", 6, True)
     if tags == None:
         return
-    tags = canonicalise_tags(tags) # deal with constraint shorthands
-    taglist = tags_to_list(tags)
     library = open("library.dat", "r")
-    filtered_titles = []
-    title = library.readline()
-    while title: # check for EOF
-        library.readline() # skip constants for now
-        library.readline() # skip terms for now
-        libtaglist = tags_to_list(library.readline()[0:-1])
-        if all(elem in libtaglist for elem in taglist):
-            filtered_titles.append((library.tell(), title[7:-1]))
-        while title != '\n':
-            title = library.readline()
-        title = library.readline()
+    filtered_titles = logic.filter_library(screen, tl, library, tags)
     filtered_titles2 = deepcopy(filtered_titles)
     i = 0
     if filtered_titles:
@@ -690,7 +922,7 @@ def library_import(screen, tl):
                    i -= 1
                    screen.status(filtered_titles2[i][1])
             elif c.isalpha():
-                filtered_titles2 = filter_titles(filtered_titles, c)
+                filtered_titles2 = logic.filter_library(screen, tl, library, tags, c)
                 i = 0
                 if filtered_titles2:
                     screen.status(filtered_titles2[i][1])
@@ -725,23 +957,12 @@ def library_load(screen, tl):
     (optional). Pressing Enter then loads the given result from the
     library into the tableau. 
     """
+    from editor import edit
     tags = edit(screen, "Tags: ", 6, True)
     if tags == None:
         return
-    tags = canonicalise_tags(tags) # deal with constraint shorthands
-    taglist = tags_to_list(tags)
     library = open("library.dat", "r")
-    filtered_titles = []
-    title = library.readline()
-    while title: # check for EOF
-        library.readline() # skip constants for now
-        library.readline() # skip terms for now
-        libtaglist = tags_to_list(library.readline()[0:-1])
-        if all(elem in libtaglist for elem in taglist):
-            filtered_titles.append((library.tell(), title[7:-1]))
-        while title != '\n':
-            title = library.readline()
-        title = library.readline()
+    filtered_titles = logic.filter_library(screen, tl, library, tags)
     filtered_titles2 = deepcopy(filtered_titles)
     i = 0
     if filtered_titles:
@@ -757,7 +978,7 @@ def library_load(screen, tl):
                    i -= 1
                    screen.status(filtered_titles2[i][1])
             elif c.isalpha():
-                filtered_titles2 = filter_titles(filtered_titles, c)
+                filtered_titles2 = logic.filter_library(screen, tl, library, tags, c)
                 i = 0
                 if filtered_titles2:
                     screen.status(filtered_titles2[i][1])
@@ -795,6 +1016,7 @@ def library_export(screen, tl):
     parse tree. The function will prompt to give a label for the theorem,
     which can be anything, and any hashtags to be specified for the theorem.
     """
+    from editor import edit
     title = edit(screen, "Title: ", 7, True)
     if title == None:
         return
@@ -1082,8 +1304,9 @@ def cleanup(screen, tl, ttree):
 def convert(screen, tl):
     """
     Reads every theorem/definition in the library and writes them back out
-    to library2.dat. This is used to update the constant headers and to check
-    that the library is in order.
+    to library2.dat. This is used to update the constant headers (which are
+    written in the current format, see format_consts) and to check that the
+    library is in order.
     """
     library = open("library.dat", "r")
     library2 = open("library2.dat", "a")
@@ -1093,39 +1316,10 @@ def convert(screen, tl):
         terms = library.readline() # read terms
         tags = library.readline() # read tags
         filepos = library.tell()
-        qz, tpred, impls = logic.fake_import(screen, tl, library, filepos)
-        c0 = get_constants(screen, tl, qz) 
-        c1 = get_constants(screen, tl, tpred)
-        c2 = []
-        nc2 = []
-        for v in impls:
-            if isinstance(v, ImpliesNode):
-                if v.iff:
-                    c2.append(("\\iff", get_constants(screen, tl, v.left), \
-                                        get_constants(screen, tl, v.right)))
-                    nc2.append(("\\iff", get_constants(screen, tl, complement_tree(v.left)), \
-                                        get_constants(screen, tl, complement_tree(v.right))))
-                else:
-                    c2.append((get_constants(screen, tl, v.left), get_constants(screen, tl, v.right)))
-                    nc2.append((get_constants(screen, tl, complement_tree(v.left)), \
-                                get_constants(screen, tl, complement_tree(v.right))))
-            elif isinstance(v, EqNode):
-                c2.append(("=", get_constants(screen, tl, v.left), get_constants(screen, tl, v.right)))
-                nc2.append(("=", get_constants(screen, tl, v.left), get_constants(screen, tl, v.right)))
-            else:
-                c2.append(get_constants(screen, tl, v))
-                nc2.append(get_constants(screen, tl, complement_tree(v)))
-        #var = get_init_vars(screen, tl, qz) 
-        #d1 = get_terms(screen, tl, tpred, var)
-        #d2 = []
-        #for v in impls:
-        #    if isinstance(v, ImpliesNode):
-        #        d2.append((get_terms(screen, tl, v.left, var), get_terms(screen, tl, v.right, var)))
-        #    else:
-        #        d2.append(get_terms(screen, tl, v, var))
-        const_str = "["+str(c0)+", "+str(c1)+", "+", ".join(str(v) for v in c2)+"]\n"
-        nconst_str = "["+str(c0)+", "+str(c1)+", "+", ".join(str(v) for v in nc2)+"]\n"
-        #terms_str = "["+str(d1)+", "+", ".join(str(v) for v in d2)+"]\n"
+        tree = logic.read_theorem(screen, library, filepos)
+        consts, nconsts = logic.library_constants(screen, tl, tree)
+        const_str = format_consts(consts)+"\n"
+        nconst_str = format_consts(nconsts)+"\n"
         library2.write(title)
         library2.write(const_str)
         library2.write(nconst_str)
@@ -1,5 +1,5 @@
 from sorts import NumberSort, Constraint, Universum, SetSort, TupleSort, PredSort, \
-                  FunctionConstraint, univar
+                  FunctionConstraint, univar, deepcopy_slots, clone
 from typeclass import OrderedSemiringClass
 
 def isatomic(node):
@@ -32,16 +32,34 @@ def needs_paren_right(tree, child):
 # Common class for all leaf nodes, i.e. nodes containing no expr children
 
 class LeafNode:
-    pass 
+    __slots__ = ()
+    __deepcopy__ = deepcopy_slots
 
 # Common class for all nodes with a left and right child (may be None)
 class LRNode:
+    __slots__ = ('left', 'right', 'paren', 'sort')
+    __deepcopy__ = deepcopy_slots
+
     def __init__(self, left, right):
         self.left = left
         self.right = right
         self.paren = False # for temporary marking as in parentheses during parsing
         self.sort = None
 
+    def clone(self):
+        """
+        Return a copy of the tree. Immutable leaves are shared with the
+        original rather than copied.
+        """
+        new = type(self).__new__(type(self))
+        new.left = clone(self.left)
+        new.right = clone(self.right)
+        if hasattr(self, 'paren'):
+            new.paren = self.paren
+        if hasattr(self, 'sort'):
+            new.sort = clone(self.sort)
+        return new
+
     def paren_str(self, child):
         if not isatomic(child) and precedence[type(child)] > precedence[type(self)]:
             return '('+str(child)+')'
@@ -61,12 +79,17 @@ class LRNode:
 # AST Nodes
 
 class DeadNode(LeafNode):
+    __slots__ = ('expr', 'sort')
+
     def __init__(self, expr):
         if isinstance(expr, DeadNode):
             self.expr = expr.expr
         else:
             self.expr = expr
         
+    def clone(self):
+        return DeadNode(clone(self.expr))
+
     def __str__(self):
         return "---- "+str(self.expr)
 
@@ -74,11 +97,18 @@ class DeadNode(LeafNode):
         return "---- "+repr(self.expr)
 
 class SymbolNode(LeafNode):
+    __slots__ = ('_name', 'constraint', 'sort')
+
     def __init__(self, name, constraint):
         self._name = name
         self.constraint = constraint
         self.sort = None
 
+    def clone(self):
+        new = SymbolNode(self._name, clone(self.constraint))
+        new.sort = clone(self.sort)
+        return new
+
     def name(self):
         return self._name
 
@@ -99,6 +129,8 @@ class SymbolNode(LeafNode):
             return self._name
 
 class VarNode(LeafNode):
+    __slots__ = ('_name', 'constraint', 'sort', 'is_metavar', 'is_binder', 'skolemized')
+
     def __init__(self, name, constraint=Universum(), is_metavar=False):
         self._name = name
         self.constraint = constraint
@@ -107,6 +139,17 @@ class VarNode(LeafNode):
         self.is_binder = False # whether this node is a binder variable
         self.skolemized = False # make sure we don't skolemize a variable twice
 
+    def clone(self):
+        new = VarNode.__new__(VarNode)
+        new._name = self._name
+        new.constraint = clone(self.constraint)
+        # the sort is often the constraint itself
+        new.sort = new.constraint if self.sort is self.constraint else clone(self.sort)
+        new.is_metavar = self.is_metavar
+        new.is_binder = self.is_binder
+        new.skolemized = self.skolemized
+        return new
+
     def name(self):
         return self._name
 
@@ -117,6 +160,8 @@ class VarNode(LeafNode):
         return "\\dot{"+self._name+"}" if self.is_metavar else self._name
 
 class SetOfNode(LRNode):
+    __slots__ = ()
+
     def __init__(self, var):
        self.left = var
        self.right = None
@@ -128,11 +173,16 @@ class SetOfNode(LRNode):
        return repr(self.left)
 
 class NaturalNode(LeafNode):
+    __slots__ = ('value', 'constraint', 'sort')
+
     def __init__(self, string):
         self.value = int(string)
         self.constraint = NumberSort('\\mathbb{N}', OrderedSemiringClass())
         self.sort = self.constraint
 
+    def clone(self):
+        return self # immutable, so it can be shared
+
     def __str__(self):
         return str(self.value)
 
@@ -140,6 +190,8 @@ class NaturalNode(LeafNode):
         return str(self.value)
 
 class ExpNode(LRNode):
+    __slots__ = ()
+
     def __str__(self):
         return self.paren_str(self.left)+"^"+self.paren_str(self.right)
 
@@ -147,6 +199,8 @@ class ExpNode(LRNode):
         return self.paren_repr(self.left)+"^"+self.paren_repr(self.right)
 
 class CircNode(LRNode):
+    __slots__ = ()
+
     def __str__(self):
         return self.paren_str(self.left)+"\u03bf"+self.paren_str(self.right)
 
@@ -154,6 +208,9 @@ class CircNode(LRNode):
         return self.paren_repr(self.left)+" \\circ "+self.paren_repr(self.right)
 
 class FnApplNode:
+    __slots__ = ('var', 'args', 'sort', 'is_skolem', 'is_metavar', 'is_binder')
+    __deepcopy__ = deepcopy_slots
+
     def __init__(self, var, args):
         self.var = var # the function symbol (could be an expr like f \circ g)
         self.args = args
@@ -162,6 +219,14 @@ class FnApplNode:
         self.is_metavar = False # Whether this is a metavariable
         self.is_binder = False # whether this function is a binder variable
 
+    def clone(self):
+        new = FnApplNode(clone(self.var), [clone(v) for v in self.args])
+        new.sort = clone(self.sort)
+        new.is_skolem = self.is_skolem
+        new.is_metavar = self.is_metavar
+        new.is_binder = self.is_binder
+        return new
+
     def name(self): # only used to compare against constant names
         return self.var.name() if isinstance(self.var, VarNode) or \
                isinstance(self.var, FnApplNode) else str(self.var)
@@ -187,6 +252,8 @@ class FnApplNode:
         return name+sig
 
 class LambdaNode(LRNode):
+    __slots__ = ()
+
     def __str__(self):
         return "(\u03bb"+str(self.left)+" : "+str(self.right)+")"
 
@@ -194,11 +261,20 @@ class LambdaNode(LRNode):
         return "(\\lambda"+repr(self.left)+" : "+repr(self.right)+")"
 
 class TupleNode:
+    __slots__ = ('name', 'args', 'sort')
+    __deepcopy__ = deepcopy_slots
+
     def __init__(self, args):
         self.name = '_'
         self.args = args
         self.sort = None
 
+    def clone(self):
+        new = TupleNode([clone(v) for v in self.args])
+        new.name = self.name
+        new.sort = clone(self.sort)
+        return new
+
     def __str__(self):
         return "("+', '.join([str(s) for s in self.args])+")"
 
@@ -206,6 +282,8 @@ class TupleNode:
         return "("+', '.join([repr(s) for s in self.args])+")"
 
 class TupleComponentNode(LRNode):
+    __slots__ = ()
+
     def __init__(self, var, idx):
         self.left = var
         self.right = idx
@@ -217,6 +295,8 @@ class TupleComponentNode(LRNode):
         return repr(self.left)+"["+repr(self.right)+"]"
 
 class PowerSetNode(LRNode):
+    __slots__ = ()
+
     def __init__(self, arg):
         self.left = arg
         self.right = None
@@ -228,6 +308,8 @@ class PowerSetNode(LRNode):
         return "\\mathcal{P}("+repr(self.left)+")"
 
 class AddNode(LRNode):
+    __slots__ = ()
+
     def __str__(self):
         return self.paren_str(self.left)+" + "+self.paren_str(self.right)
 
@@ -235,6 +317,8 @@ class AddNode(LRNode):
         return self.paren_repr(self.left)+" + "+self.paren_repr(self.right)
 
 class SubNode(LRNode):
+    __slots__ = ()
+
     def __str__(self):
         return self.paren_str(self.left)+" - "+self.paren_str(self.right)
 
@@ -242,6 +326,8 @@ class SubNode(LRNode):
         return self.paren_repr(self.left)+" - "+self.paren_repr(self.right)
 
 class MulNode(LRNode):
+    __slots__ = ()
+
     def __str__(self):
         return self.paren_str(self.left)+"*"+self.paren_str(self.right)
 
@@ -249,6 +335,8 @@ class MulNode(LRNode):
         return self.paren_repr(self.left)+"*"+self.paren_repr(self.right)
 
 class DivNode(LRNode):
+    __slots__ = ()
+
     def __str__(self):
         return self.paren_str(self.left)+"/"+self.paren_str(self.right)
 
@@ -256,6 +344,8 @@ class DivNode(LRNode):
         return self.paren_repr(self.left)+"/"+self.paren_repr(self.right)
 
 class LtNode(LRNode):
+    __slots__ = ()
+
     def __str__(self):
         return self.paren_str(self.left)+" < "+self.paren_str(self.right)
 
@@ -263,6 +353,8 @@ class LtNode(LRNode):
         return self.paren_repr(self.left)+" < "+self.paren_repr(self.right)
 
 class GtNode(LRNode):
+    __slots__ = ()
+
     def __str__(self):
         return self.paren_str(self.left)+" > "+self.paren_str(self.right)
 
@@ -270,6 +362,8 @@ class GtNode(LRNode):
         return self.paren_repr(self.left)+" > "+self.paren_repr(self.right)
 
 class LeqNode(LRNode):
+    __slots__ = ()
+
     def __str__(self):
         return self.paren_str(self.left)+" \u2264 "+self.paren_str(self.right)
 
@@ -277,6 +371,8 @@ class LeqNode(LRNode):
         return self.paren_repr(self.left)+" \\leq "+self.paren_repr(self.right)
 
 class GeqNode(LRNode):
+    __slots__ = ()
+
     def __str__(self):
         return self.paren_str(self.left)+" \u2265 "+self.paren_str(self.right)
 
@@ -284,6 +380,8 @@ class GeqNode(LRNode):
         return self.paren_repr(self.left)+" \\geq "+self.paren_repr(self.right)
 
 class EqNode(LRNode):
+    __slots__ = ()
+
     def __str__(self):
         return self.paren_str(self.left)+" = "+self.paren_str(self.right)
 
@@ -291,6 +389,8 @@ class EqNode(LRNode):
         return self.paren_repr(self.left)+" = "+self.paren_repr(self.right)
 
 class NeqNode(LRNode):
+    __slots__ = ()
+
     def __str__(self):
         return self.paren_str(self.left)+" \u2260 "+self.paren_str(self.right)
 
@@ -298,11 +398,18 @@ class NeqNode(LRNode):
         return self.paren_repr(self.left)+" \\neq "+self.paren_repr(self.right)
 
 class ImpliesNode(LRNode):
+    __slots__ = ('iff',)
+
     def __init__(self, left, right, iff=False):
         self.left = left
         self.right = right
         self.iff = iff # used by automation to denote implication that came from iff
 
+    def clone(self):
+        new = LRNode.clone(self)
+        new.iff = self.iff
+        return new
+
     def __str__(self):
         return self.paren_str(self.left)+" \u21d2 "+self.paren_str(self.right)
 
@@ -310,6 +417,8 @@ class ImpliesNode(LRNode):
         return self.paren_repr(self.left)+" \\implies "+self.paren_repr(self.right)
 
 class IffNode(LRNode):
+    __slots__ = ()
+
     def __str__(self):
         return self.paren_str(self.left)+" \u21d4 "+self.paren_str(self.right)
 
@@ -317,6 +426,8 @@ class IffNode(LRNode):
         return self.paren_repr(self.left)+" \\iff "+self.paren_repr(self.right)
 
 class AndNode(LRNode):
+    __slots__ = ()
+
     def __str__(self):
         return self.paren_str(self.left)+" \u2227 "+self.paren_str(self.right)
 
@@ -324,6 +435,8 @@ class AndNode(LRNode):
         return self.paren_repr(self.left)+" \\wedge "+self.paren_repr(self.right)
 
 class OrNode(LRNode):
+    __slots__ = ()
+
     def __str__(self):
         return self.paren_str(self.left)+" \u2228 "+self.paren_str(self.right)
 
@@ -331,6 +444,8 @@ class OrNode(LRNode):
         return self.paren_repr(self.left)+" \\vee "+self.paren_repr(self.right)
 
 class CartesianNode(LRNode):
+    __slots__ = ()
+
     def __str__(self):
         return self.paren_str(self.left)+"\u00d7"+self.paren_str(self.right)
 
@@ -338,6 +453,8 @@ class CartesianNode(LRNode):
         return self.paren_repr(self.left)+" \\times "+self.paren_repr(self.right)
 
 class IntersectNode(LRNode):
+    __slots__ = ()
+
     def __str__(self):
         return self.paren_str(self.left)+"\u2229"+self.paren_str(self.right)
 
@@ -345,6 +462,8 @@ class IntersectNode(LRNode):
         return self.paren_repr(self.left)+" \\cap "+self.paren_repr(self.right)
 
 class UnionNode(LRNode):
+    __slots__ = ()
+
     def __str__(self):
         return self.paren_str(self.left)+"\u222a"+self.paren_str(self.right)
 
@@ -352,6 +471,8 @@ class UnionNode(LRNode):
         return self.paren_repr(self.left)+" \\cup "+self.paren_repr(self.right)
 
 class SubsetneqNode(LRNode):
+    __slots__ = ()
+
     def __str__(self):
         return self.paren_str(self.left)+" \u2282 "+self.paren_str(self.right)
 
@@ -359,6 +480,8 @@ class SubsetneqNode(LRNode):
         return self.paren_repr(self.left)+" \\subsetneq "+self.paren_repr(self.right)
 
 class SubseteqNode(LRNode):
+    __slots__ = ()
+
     def __str__(self):
         return self.paren_str(self.left)+" \u2286 "+self.paren_str(self.right)
 
@@ -366,6 +489,8 @@ class SubseteqNode(LRNode):
         return self.paren_repr(self.left)+" \\subseteq "+self.paren_repr(self.right)
 
 class SupsetneqNode(LRNode):
+    __slots__ = ()
+
     def __str__(self):
         return self.paren_str(self.left)+" \u2283 "+self.paren_str(self.right)
 
@@ -373,6 +498,8 @@ class SupsetneqNode(LRNode):
         return self.paren_repr(self.left)+" \\supsetneq "+self.paren_repr(self.right)
 
 class SupseteqNode(LRNode):
+    __slots__ = ()
+
     def __str__(self):
         return self.paren_str(self.left)+" \u2287 "+self.paren_str(self.right)
 
@@ -380,6 +507,8 @@ class SupseteqNode(LRNode):
         return self.paren_repr(self.left)+" \\supseteq "+self.paren_repr(self.right)
 
 class DiffNode(LRNode):
+    __slots__ = ()
+
     def __str__(self):
         return self.paren_str(self.left)+" \\ "+self.paren_str(self.right)
 
@@ -387,6 +516,8 @@ class DiffNode(LRNode):
         return self.paren_repr(self.left)+" \\setminus "+self.paren_repr(self.right)
 
 class SetBuilderNode(LRNode):
+    __slots__ = ()
+
     def __str__(self):
         return "{"+str(self.left)+" | "+str(self.right.right)+"}"
 
@@ -394,6 +525,8 @@ class SetBuilderNode(LRNode):
         return "{"+repr(self.left)+" | "+repr(self.right.right)+"}"
 
 class AbsNode(LRNode):
+    __slots__ = ()
+
     def __init__(self, expr):
         self.left = expr
         self.right = None
@@ -405,6 +538,8 @@ class AbsNode(LRNode):
         return "|"+str(self.left)+"|"
 
 class NotNode(LRNode):
+    __slots__ = ()
+
     def __init__(self, expr):
         self.left = expr
         self.right = None
@@ -422,6 +557,8 @@ class NotNode(LRNode):
             return "\\neg"+repr(self.left)
 
 class NegNode(LRNode):
+    __slots__ = ()
+
     def __init__(self, expr):
         self.left = expr
         self.right = None
@@ -439,11 +576,18 @@ class NegNode(LRNode):
             return "-"+repr(self.left)
 
 class ExistsNode(LRNode):
+    __slots__ = ('var',)
+
     def __init__(self, var, expr):
         self.var = var
         self.left = expr
         self.right = None
 
+    def clone(self):
+        new = LRNode.clone(self)
+        new.var = clone(self.var)
+        return new
+
     def __str__(self):
         str_list = []
         tree = self
@@ -492,11 +636,18 @@ class ExistsNode(LRNode):
             return "\\exists "+repr(self.var)+" \\in "+repr(self.var.constraint)+expr
 
 class ForallNode(LRNode):
+    __slots__ = ('var',)
+
     def __init__(self, var, expr):
         self.var = var
         self.left = expr
         self.right = None
 
+    def clone(self):
+        new = LRNode.clone(self)
+        new.var = clone(self.var)
+        return new
+
     def __str__(self):
         str_list = []
         tree = self
@@ -545,6 +696,8 @@ class ForallNode(LRNode):
             return "\\forall "+repr(self.var)+" \\in "+repr(self.var.constraint)+expr
 
 class ElemNode(LRNode):
+    __slots__ = ()
+
     def __str__(self):
         return self.paren_str(self.left)+" \u2208 "+self.paren_str(self.right)
 
@@ -552,9 +705,14 @@ class ElemNode(LRNode):
         return self.paren_repr(self.left)+" \\in "+self.paren_repr(self.right)
 
 class BoolNode(LeafNode):
+    __slots__ = ('value', 'sort')
+
     def __init__(self, value):
         self.value = value
 
+    def clone(self):
+        return self # immutable, so it can be shared
+
     def __str__(self):
         return "\u22A4" if self.value else "\u22A5"
 
@@ -617,6 +775,8 @@ def mark_binder_vars(tree, var):
 # Nodes for automation
 
 class AutoImplNode:
+    __slots__ = ('left', 'right')
+
     def __init__(self, left, right):
         self.left = left
         self.right = right
@@ -628,6 +788,8 @@ class AutoImplNode:
         return "("+repr(self.left)+", "+repr(self.right)+")"
 
 class AutoIffNode:
+    __slots__ = ('left', 'right')
+
     def __init__(self, left, right):
         self.left = left
         self.right = right
@@ -639,6 +801,8 @@ class AutoIffNode:
         return "('\\iff', "+repr(self.left)+", "+repr(self.right)+")"
 
 class AutoEqNode:
+    __slots__ = ('left', 'right')
+
     def __init__(self, left, right):
         self.left = left
         self.right = right
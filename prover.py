@@ -0,0 +1,112 @@
+from tree import TreeList
+from utility import TargetNode, initialise_sorts, type_vars, process_sorts, append_tree
+from parser import to_ast
+from automation import automate, autocleanup
+import logic
+import time
+
+# Headless prover
+#
+# prove runs the automation on a problem without an interface, for batch
+# runs and for use of the prover by other programs. Nothing is imported that
+# imports curses or flask. The library is read from library.dat in the
+# current directory, as for the interactive interface.
+
+separator = '------------------------------' # separates parts of a problem, as in the library
+
+class NullScreen:
+    """
+    Stand-in for the screen which displays nothing, for running the prover
+    without an interface.
+    """
+    def dialog(self, msg):
+        pass
+
+    def debug(self, msg):
+        pass
+
+def parse_problem(screen, text):
+    """
+    Parse the given problem text, written as a theorem is in the library: an
+    optional quantifier zone, a line of dashes, one hypothesis per line, a
+    line of dashes and then one target per line. Text without lines of dashes
+    is taken to be a list of targets, one per line. Returns a triple (qz,
+    hyps, tars) as for logic.read_statement. An exception is raised if any
+    line does not parse.
+    """
+    lines = [line.strip() for line in text.strip().split('\n')]
+    qz = None
+    hyps = []
+    tars = lines
+    if separator in lines:
+        i = lines.index(separator)
+        if i > 1:
+            raise Exception("Quantifier zone must be a single line")
+        if i == 1:
+            qz = lines[0]
+        rest = lines[i + 1:]
+        if separator not in rest:
+            raise Exception("Expected a line of dashes after the hypotheses")
+        j = rest.index(separator)
+        hyps = rest[0:j]
+        tars = rest[j + 1:]
+
+    def parse(line):
+        tree = to_ast(screen, line)
+        if isinstance(tree, int):
+            raise Exception("Error in statement \""+line+"\" starting at column "+str(tree + 1))
+        return tree
+
+    qz = parse(qz) if qz != None else None
+    hyps = [parse(line) for line in hyps if line]
+    tars = [parse(line) for line in tars if line]
+    if not tars:
+        raise Exception("No targets in problem")
+    return qz, hyps, tars
+
+def load_problem(screen, problem):
+    """
+    Return a tableau for the given problem, which is either the position of a
+    theorem in the library, as an int, or problem text (see parse_problem).
+    Only the library before a theorem is used to prove it.
+    """
+    tl = TreeList()
+    if isinstance(problem, int):
+        with open("library.dat", "r") as library:
+            tl.loaded_theorem = problem
+            logic.library_load(screen, tl, library, problem)
+    else:
+        qz, hyps, tars = parse_problem(screen, problem)
+        if qz != None:
+            append_tree(tl.tlist0.data, qz, None)
+        for stmt in hyps:
+            append_tree(tl.tlist1.data, stmt, None)
+        for stmt in tars:
+            append_tree(tl.tlist2.data, stmt, None)
+    return tl
+
+def prove(problem, schedule='loop', time_limit=None, max_inferences=None, max_memory=None):
+    """
+    Try to prove the given problem, which is either the position of a theorem
+    in library.dat, as an int, or problem text (see parse_problem), without
+    an interface. The schedule and budgets are as for automate, except that
+    time_limit is the number of seconds to allow, including loading the
+    problem. As max_memory bounds the memory the process is currently using,
+    a program embedding the prover should allow for its own memory. Returns
+    a pair (result, tl) where result is the AutoResult of automate and tl is
+    the final tableau. An exception is raised if the problem cannot be parsed
+    or its sorts cannot be processed.
+    """
+    screen = NullScreen()
+    deadline = time.monotonic() + time_limit if time_limit != None else None
+    tl = load_problem(screen, problem)
+    logic.fill_macros(screen, tl)
+    type_vars(screen, tl)
+    initialise_sorts(screen, tl)
+    ok, error = process_sorts(screen, tl)
+    if not ok:
+        raise Exception(error)
+    ttree = TargetNode(-1, [TargetNode(i) for i in range(len(tl.tlist2.data))])
+    autocleanup(screen, tl, ttree)
+    result = automate(screen, tl, ttree, None, schedule, deadline, max_inferences, max_memory)
+    return result, tl
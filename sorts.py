@@ -1,4 +1,5 @@
 from typeclass import SetClass, FunctionClass
+from copy import deepcopy
 
 sig_name = {"\\mathbb{N}" : "Natural",
              "\\mathbb{Z}" : "Integer",
@@ -68,17 +69,62 @@ def univar(name):
     else:
         return name+suffix
 
+slot_names = dict() # class -> names of all slots of instances of the class
+
+def deepcopy_slots(self, memo):
+    """
+    Deep copy an object of a class using __slots__, e.g. a parse tree node or
+    a sort. This avoids the generic copy protocol, which builds and copies a
+    dictionary of the slots of every object.
+    """
+    cls = type(self)
+    names = slot_names.get(cls)
+    if names == None:
+        names = tuple(name for c in cls.__mro__ for name in c.__dict__.get('__slots__', ()))
+        slot_names[cls] = names
+    new = cls.__new__(cls)
+    memo[id(self)] = new # sorts may refer to themselves
+    for name in names:
+        try:
+            value = getattr(self, name)
+        except AttributeError: # slot not set
+            continue
+        setattr(new, name, deepcopy(value, memo))
+    return new
+
+def clone(tree):
+    """
+    Return a copy of the given parse tree or sort, or None if it is None. The
+    copy is made by the clone methods of the classes, which know their own
+    fields and share immutable leaves, so it is much cheaper than deepcopy.
+    As with deepcopy, classes (occasionally used as sorts) are not copied.
+    """
+    if tree == None or isinstance(tree, type):
+        return tree
+    return tree.clone()
+
 class Constraint:
-    pass
+    __slots__ = ()
+    __deepcopy__ = deepcopy_slots
 
 class Sort(Constraint):
-    pass
+    __slots__ = ()
 
 class CartesianConstraint(Constraint):
+    __slots__ = ('sorts', 'sort')
+
     def __init__(self, sorts):
          self.sorts = sorts # the elements of the cartesian product are the sorts
          self.sort = None
 
+    def clone(self):
+         new = CartesianConstraint([clone(v) for v in self.sorts])
+         if isinstance(self.sort, TupleSort) and self.sort.sorts is self.sorts:
+             new.sort = TupleSort(new.sorts) # sort shares the list of sorts
+         else:
+             new.sort = clone(self.sort)
+         return new
+
     def __repr__(self):
          n = len(self.sorts)
          return ' \\times '.join([repr(self.sorts[i]) for i in range(0, n)])
@@ -88,11 +134,18 @@ class CartesianConstraint(Constraint):
          return '\u00d7'.join([str(self.sorts[i]) for i in range(0, n)])
 
 class FunctionConstraint(Constraint):
+    __slots__ = ('domain', 'codomain', 'sort')
+
     def __init__(self, domain, codomain):
          self.domain = domain
          self.codomain = codomain
          self.sort = None
 
+    def clone(self):
+         new = FunctionConstraint(clone(self.domain), clone(self.codomain))
+         new.sort = clone(self.sort)
+         return new
+
     def __repr__(self):
          if self.domain == None:
              return "() \\to "+repr(self.codomain)
@@ -106,11 +159,18 @@ class FunctionConstraint(Constraint):
              return str(self.domain)+" \u2192 "+str(self.codomain)
 
 class DomainTuple(Constraint):
+    __slots__ = ('sets', 'sort')
+
     def __init__(self, sets):
          self.sets = sets
          # sort is that of a tuple to be passed to a function
          self.sort = None
 
+    def clone(self):
+         new = DomainTuple([clone(v) for v in self.sets])
+         new.sort = clone(self.sort)
+         return new
+
     def __repr__(self):
          n = len(self.sets)
          if n == 0:
@@ -126,10 +186,18 @@ class DomainTuple(Constraint):
              return "("+', '.join([str(self.sets[i]) for i in range(0, n)])+")"
 
 class SetSort(Sort):
+    __slots__ = ('sort', 'typeclass')
+
     def __init__(self, universe):
         self.sort = universe # element sort
         self.typeclass = SetClass()
 
+    def clone(self):
+        new = SetSort.__new__(SetSort)
+        new.sort = clone(self.sort)
+        new.typeclass = self.typeclass
+        return new
+
     def __repr__(self):
         if isinstance(self.sort, Universum):
             return "Set"
@@ -143,11 +211,16 @@ class SetSort(Sort):
             return "Set("+str(self.sort)+")"
 
 class Universum(Sort):
+    __slots__ = ('_name', 'sort', 'typeclass')
+
     def __init__(self):
         self._name = "\\mathcal{U}"
         self.sort = self
         self.typeclass = SetClass()
 
+    def clone(self):
+        return self # immutable, so it can be shared
+
     def __repr__(self):
         return self._name
 
@@ -158,11 +231,16 @@ class Universum(Sort):
         return self._name
 
 class NumberSort(Sort):
+    __slots__ = ('_name', 'sort', 'typeclass')
+
     def __init__(self, name, typeclass):
         self._name = sig_name[name]
         self.sort = self
         self.typeclass = typeclass
 
+    def clone(self):
+        return self # immutable, so it can be shared
+
     def __repr__(self):
         return sig_repr[self._name]
 
@@ -173,11 +251,16 @@ class NumberSort(Sort):
         return self._name
 
 class TupleSort(Sort):
+    __slots__ = ('sorts', 'sort', 'typeclass')
+
     def __init__(self, sorts):
          self.sorts = sorts
          self.sort = self
          self.typeclass = SetClass()
 
+    def clone(self):
+         return TupleSort([clone(v) for v in self.sorts])
+
     def __repr__(self):
          n = len(self.sorts)
          if n == 0:
@@ -193,9 +276,14 @@ class TupleSort(Sort):
              return '\u00d7'.join([str(self.sorts[i]) for i in range(0, n)])
 
 class PredSort(Sort):
+    __slots__ = ('sort',)
+
     def __init__(self):
        self.sort = self
 
+    def clone(self):
+       return self # immutable, so it can be shared
+
     def __repr__(self):
        return "Pred"
 
@@ -0,0 +1,242 @@
+from nodes import ForallNode, ExistsNode, FnApplNode, VarNode, LRNode, TupleNode, \
+     SymbolNode, NotNode, EqNode, NeqNode, GtNode, LtNode, LeqNode, GeqNode, \
+     AndNode, OrNode, ImpliesNode, SetOfNode, NaturalNode, BoolNode, DeadNode, \
+     LambdaNode
+from sorts import SetSort, TupleSort, FunctionConstraint, DomainTuple, \
+     CartesianConstraint, Universum, NumberSort, PredSort
+from utility import system_unary_functions, system_binary_functions, \
+     system_predicates, constant_dict
+
+# Hash-consed terms
+#
+# A TermTable turns parse trees built from the classes in nodes.py into
+# immutable Terms, such that structurally identical subterms are always the
+# same object. Terms from the same table are therefore equal if and only if
+# they are identical, their hash is computed once when they are created and
+# anything computed from a term (its constants, its complement, its key for
+# duplicate detection) can be memoised on the term itself and is then shared
+# by every tree in which that subterm occurs.
+#
+# The layer is opt-in: the tableau still holds ordinary parse trees, which
+# are mutable and carry sort information, and a table is only consulted by
+# code that asks for it.
+
+class Term:
+    __slots__ = ('op', 'data', 'args', 'hash', 'consts', 'comp', 'key')
+
+    def __init__(self, op, data, args):
+        self.op = op # class of the node this term was built from
+        self.data = data # tuple of non-term data, e.g. name, value, flags
+        self.args = args # tuple of child terms (entries may be None)
+        self.hash = hash((op, data, args)) # structural hash, computed once
+        self.consts = None # memoised sorted tuple of constants
+        self.comp = None # memoised complement term
+        self.key = None # memoised key for duplicate detection
+
+    def __hash__(self):
+        return self.hash
+
+    def __repr__(self):
+        return self.op.__name__+repr(self.data)+repr(self.args)
+
+# marker used in duplicate keys in place of the name of a metavariable
+metavar_marker = "?"
+
+class TermTable:
+    def __init__(self):
+        self.terms = dict() # (op, data, args) -> unique Term with that structure
+        self.hits = 0 # number of times an existing term was reused
+        self.misses = 0 # number of new terms created
+
+    def __len__(self):
+        return len(self.terms)
+
+    def make(self, op, data, args):
+        """
+        Return the unique term in the table with the given class, data and
+        child terms, creating it if it does not exist yet.
+        """
+        k = (op, data, args)
+        term = self.terms.get(k)
+        if term == None:
+            term = Term(op, data, args)
+            self.terms[k] = term
+            self.misses += 1
+        else:
+            self.hits += 1
+        return term
+
+    def intern(self, tree):
+        """
+        Given a parse tree (or a sort/constraint), return the unique term in
+        the table with the same structure. Sort annotations and other data
+        computed during processing of the tableau are not part of a term.
+        """
+        if tree == None:
+            return None
+        elif isinstance(tree, VarNode):
+            return self.make(VarNode, (tree.name(), tree.is_metavar), \
+                             (self.intern(tree.constraint),))
+        elif isinstance(tree, SymbolNode):
+            return self.make(SymbolNode, (tree.name(),), (self.intern(tree.constraint),))
+        elif isinstance(tree, FnApplNode):
+            args = [self.intern(tree.var)]
+            for v in tree.args:
+                args.append(self.intern(v))
+            return self.make(FnApplNode, (tree.is_skolem, tree.is_metavar), tuple(args))
+        elif isinstance(tree, TupleNode):
+            return self.make(TupleNode, (), tuple(self.intern(v) for v in tree.args))
+        elif isinstance(tree, ForallNode) or isinstance(tree, ExistsNode):
+            return self.make(type(tree), (), (self.intern(tree.var), \
+                             self.intern(tree.left), self.intern(tree.right)))
+        elif isinstance(tree, ImpliesNode):
+            return self.make(ImpliesNode, (tree.iff,), (self.intern(tree.left), \
+                             self.intern(tree.right)))
+        elif isinstance(tree, LRNode):
+            return self.make(type(tree), (), (self.intern(tree.left), self.intern(tree.right)))
+        elif isinstance(tree, NaturalNode) or isinstance(tree, BoolNode):
+            return self.make(type(tree), (tree.value,), ())
+        elif isinstance(tree, DeadNode):
+            return self.make(DeadNode, (), (self.intern(tree.expr),))
+        elif isinstance(tree, Universum) or isinstance(tree, PredSort):
+            return self.make(type(tree), (), ())
+        elif isinstance(tree, NumberSort):
+            return self.make(NumberSort, (tree.name(),), ())
+        elif isinstance(tree, SetSort):
+            return self.make(SetSort, (), (self.intern(tree.sort),))
+        elif isinstance(tree, TupleSort) or isinstance(tree, CartesianConstraint):
+            return self.make(type(tree), (), tuple(self.intern(v) for v in tree.sorts))
+        elif isinstance(tree, FunctionConstraint):
+            return self.make(FunctionConstraint, (), (self.intern(tree.domain), \
+                             self.intern(tree.codomain)))
+        elif isinstance(tree, DomainTuple):
+            return self.make(DomainTuple, (), tuple(self.intern(v) for v in tree.sets))
+        else:
+            raise Exception("Type "+str(type(tree))+" unknown")
+
+    def constants(self, tree):
+        """
+        Return the same list of constants as get_constants for the given parse
+        tree, using the constants memoised on the terms of the table.
+        """
+        return list(term_constants(self.intern(tree)))
+
+    def complement(self, term):
+        """
+        Return the term for the complement of the given term, as computed by
+        complement_tree. The result is memoised on the term.
+        """
+        if term == None:
+            return self.make(NotNode, (), (None, None))
+        if term.comp != None:
+            return term.comp
+        op = term.op
+        args = term.args
+        if op == ForallNode:
+            comp = self.make(ExistsNode, (), (args[0], self.complement(args[1]), None))
+        elif op == ExistsNode:
+            comp = self.make(ForallNode, (), (args[0], self.complement(args[1]), None))
+        elif op in complement_ops:
+            comp = self.make(complement_ops[op], (), args)
+        elif op == AndNode:
+            comp = self.make(OrNode, (), (self.complement(args[0]), self.complement(args[1])))
+        elif op == OrNode:
+            comp = self.make(AndNode, (), (self.complement(args[0]), self.complement(args[1])))
+        elif op == ImpliesNode:
+            comp = self.make(AndNode, (), (args[0], self.complement(args[1])))
+        elif op == NotNode:
+            comp = args[0]
+        else:
+            comp = self.make(NotNode, (), (term, None))
+        term.comp = comp
+        return comp
+
+    def complement_constants(self, tree):
+        """
+        Return the same list of constants as get_constants applied to
+        complement_tree(tree), without copying the tree.
+        """
+        return list(term_constants(self.complement(self.intern(tree))))
+
+    def duplicate_key(self, term):
+        """
+        Return a term which is the same for any two parse trees that
+        is_duplicate_upto_metavars can consider duplicates, i.e. the term with
+        the names of metavariables, variable constraints, binders and any
+        contents of dead nodes removed. Trees with different keys are never
+        duplicates. The result is memoised on the term.
+        """
+        if term == None:
+            return None
+        if term.key != None:
+            return term.key
+        op = term.op
+        args = term.args
+        if op == DeadNode:
+            key = self.make(DeadNode, (), ())
+        elif op == VarNode:
+            name, is_metavar = term.data
+            key = self.make(VarNode, (metavar_marker if is_metavar else name, is_metavar), ())
+        elif op == SymbolNode:
+            key = self.make(SymbolNode, term.data, ())
+        elif op == FnApplNode:
+            key = self.make(FnApplNode, (), tuple(self.duplicate_key(v) for v in args))
+        elif op == ForallNode or op == ExistsNode:
+            key = self.make(op, (), (self.duplicate_key(args[1]), self.duplicate_key(args[2])))
+        elif op == ImpliesNode:
+            key = self.make(op, (), tuple(self.duplicate_key(v) for v in args))
+        else:
+            key = self.make(op, term.data, tuple(self.duplicate_key(v) for v in args))
+        term.key = key
+        return key
+
+# classes of the atomic relations swapped by complement_tree
+complement_ops = {EqNode : NeqNode, NeqNode : EqNode, LtNode : GeqNode,
+                  GtNode : LeqNode, LeqNode : GtNode, GeqNode : LtNode}
+
+# classes of terms that contribute no constants of their own
+no_constants = {VarNode, SetOfNode, DeadNode, LambdaNode, ForallNode, ExistsNode,
+                Universum, AndNode, OrNode, NotNode}
+
+def term_constants(term):
+    """
+    Given a term, return a sorted tuple of the constants used in it, following
+    the same rules as get_constants. The result is memoised on every subterm
+    visited, so that constants of shared subterms are computed only once.
+    """
+    if term == None:
+        return ()
+    if term.consts != None:
+        return term.consts
+    op = term.op
+    args = term.args
+    constants = set()
+    if op == SymbolNode:
+        constants.add(term.data[0])
+    elif op in no_constants:
+        pass
+    elif op == FnApplNode:
+        if args[0] != None and args[0].op == VarNode:
+            name = args[0].data[0]
+            if (name in system_unary_functions and name != 'universe') or \
+               (name in system_binary_functions) or \
+               (name in system_predicates):
+                constants.add(name)
+    elif op == TupleNode or op == TupleSort:
+        constants.add('Tuple('+str(len(args))+')')
+    elif op == NaturalNode:
+        constants.add(str(term.data[0]))
+    elif op == NumberSort:
+        constants.add(term.data[0])
+    else:
+        constants.add(constant_dict[op])
+    if op == ForallNode or op == ExistsNode:
+        # the binder variable itself is skipped, but not its constraint
+        constants.update(term_constants(args[0].args[0]))
+        constants.update(term_constants(args[1]))
+        constants.update(term_constants(args[2]))
+    elif op != VarNode and op != SymbolNode and op != DeadNode:
+        for v in args:
+            constants.update(term_constants(v))
+    term.consts = tuple(sorted(constants))
+    return term.consts
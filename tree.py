@@ -40,6 +40,10 @@ class TreeList:
         self.constraints = dict() # dictionary of constraints for all vars in tableau
         self.constraints_processed = (0, 0, 0) # num of quantifiers/hyps/tars constraint processed
         self.sorts_processed = (0, 0, 0) # num of quantifiers/hyps/tars constraint processed
+        self.constraints_dirty = (set(), set(), set()) # binders/hyps/tars whose constraints need reprocessing
+        self.sorts_dirty = (set(), set(), set()) # binders/hyps/tars whose sorts need reprocessing
+        self.var_lines = dict() # binders/hyps/tars whose typing depends on each variable
+        self.proof_cache = None # unifications tried by check_targets_proved
         self.depmin = 0 # number of variables in qz from original tableau
         self.loaded_theorem = None # filepos of loaded theorem, if any
         self.moves = [] # moves that were used to prove the theorem
@@ -1,4 +1,3 @@
-from copy import deepcopy
 from nodes import LRNode, VarNode, NaturalNode, FnApplNode, ExpNode, AddNode, \
                   SubNode, MulNode, DivNode, IntersectNode, UnionNode, \
                   DiffNode, SymbolNode, TupleNode, PowerSetNode, AndNode, \
@@ -6,12 +5,12 @@ from nodes import LRNode, VarNode, NaturalNode, FnApplNode, ExpNode, AddNode, \
                   LeqNode, GeqNode, SubseteqNode, SubsetneqNode, \
                   SupseteqNode, SupsetneqNode, ImpliesNode, IffNode, \
                   NotNode, ForallNode, ExistsNode, BoolNode, TupleComponentNode, \
-                  SetBuilderNode, LambdaNode, mark_binder_vars
+                  SetBuilderNode, SetOfNode, LambdaNode, mark_binder_vars
 from utility import sorts_equal, find_sort, sorts_compatible, coerce_sorts, subst, \
-                  make_substitution, substitute, is_predicate, is_expression, universe, \
+                  substitute, is_predicate, is_expression, universe, \
                   domain, codomain
 from sorts import Sort, PredSort, SetSort, TupleSort, NumberSort, Universum, \
-                  CartesianConstraint
+                  CartesianConstraint, clone
 
 def node_constraint(tree):
     if isinstance(tree, VarNode):
@@ -22,7 +21,7 @@ def node_constraint(tree):
         return None
 
 def tree_contains_binder(tree, ignorevars=[]):
-    ignore = deepcopy(ignorevars) # default params are mutable
+    ignore = ignorevars[:] # default params are mutable
     if tree == None:
         return False
     elif isinstance(tree, SetBuilderNode):
@@ -44,211 +43,349 @@ def tree_contains_binder(tree, ignorevars=[]):
                 return True
     return False # all other cases
 
-def trees_unify(screen, tl, tree1, tree2, assigned=[], macro=[]):
-    assign = deepcopy(assigned) # default params are mutable
-    macros = deepcopy(macro)
+class Unifier:
+    """
+    The state of a unification. Metavariables are bound as a triangular
+    substitution: each is bound at most once, to a value which may contain
+    other bound metavariables. The lists of bindings and macros act as an undo
+    trail, so that backtracking only needs to pop them.
+    """
+    def __init__(self):
+        self.assign = [] # (var, value) bindings in the order they were made
+        self.bound = dict() # name of each bound metavariable -> its value
+        self.macros = [] # (tree, macro) pairs of unexpanded macros
+
+def unify_undo(u, n1, n2):
+    """
+    Pop the bindings and macros of the Unifier u back to the given lengths.
+    """
+    for (var, value) in u.assign[n1:]:
+        del u.bound[var.name()]
+    del u.assign[n1:]
+    del u.macros[n2:]
+
+def unify_bind(screen, tl, u, var, value):
+    """
+    Bind the metavariable var to the given value in the Unifier u. If var is
+    already bound, its value is unified with the given one instead. Returns
+    True if this succeeds.
+    """
+    while isinstance(value, VarNode) and value.name() in u.bound:
+        value = u.bound[value.name()] # never bind to a bound variable
+    name = var.name()
+    if isinstance(value, VarNode) and value.is_metavar and value.name() == name:
+        return True
+    if name in u.bound:
+        return unify_trail(screen, tl, u.bound[name], value, u)
+    u.bound[name] = value
+    u.assign.append((var, value))
+    return True
+
+def sorts_unify(screen, tl, u, s1, s2):
+    """
+    Return True if the sorts s1 and s2 are compatible, binding in the Unifier
+    u any sort metavariables that sorts_compatible assigns.
+    """
+    assign = []
+    if not sorts_compatible(screen, tl, s1, s2, assign):
+        return False
+    for (var, value) in assign:
+        if not unify_bind(screen, tl, u, var, value):
+            return False
+    return True
+
+def unify_step(screen, tl, tree1, tree2, u):
+    """
+    Try to unify tree1 and tree2, binding metavariables and recording
+    unexpanded macros in the Unifier u. Returns True if the trees unify. This
+    should only be called via unify_trail, which undoes anything added to u if
+    unification fails.
+    """
     # special case to deal with unexpanded macros
     if isinstance(tree1, FnApplNode) and (tree1.name() == 'universe' \
                    or tree1.name == 'domain' or tree1.name == 'codomain'):
-        macros.append((tree2, tree1))
-        return True, assign, macros
+        u.macros.append((tree2, tree1))
+        return True
     if isinstance(tree2, FnApplNode) and (tree2.name() == 'universe'\
                    or tree2.name == 'domain' or tree2.name == 'codomain'):
-        macros.append((tree1, tree2))
-        return True, assign, macros
+        u.macros.append((tree1, tree2))
+        return True
     if isinstance(tree1, FnApplNode) and isinstance(tree2, FnApplNode) \
            and tree1.is_metavar:
         if len(tree1.args) != len(tree2.args):
-            return False, [], []
+            return False
         for i in range(0, len(tree1.args)):
-            unifies, assign, macros = trees_unify(screen, tl, tree1.args[i], tree2.args[i], assign, macros)
-            if not unifies:
-                return False, [], []
+            if not unify_trail(screen, tl, tree1.args[i], tree2.args[i], u):
+                return False
         if sorts_compatible(screen, tl, tree1.var.sort, tree2.var.sort):
-            assign.append(deepcopy((tree1.var, tree2.var)))
-            return True, assign, macros
+            return unify_bind(screen, tl, u, clone(tree1.var), clone(tree2.var))
         else:
-            return False, [], []
+            return False
     if isinstance(tree1, FnApplNode) and isinstance(tree2, FnApplNode) \
            and tree2.is_metavar:
         if len(tree1.args) != len(tree2.args):
-            return False, [], []
+            return False
         for i in range(0, len(tree1.args)):
-            unifies, assign, macros = trees_unify(screen, tl, tree2.args[i], tree1.args[i], assign, macros)
-            if not unifies:
-                return False, [], []
+            if not unify_trail(screen, tl, tree2.args[i], tree1.args[i], u):
+                return False
         if sorts_compatible(screen, tl, tree2.var.sort, tree1.var.sort):
-            assign.append(deepcopy((tree2.var, tree1.var)))
-            return True, assign, macros
+            return unify_bind(screen, tl, u, clone(tree2.var), clone(tree1.var))
         else:
-            return False, [], []
+            return False
     if (isinstance(tree1, VarNode) or isinstance(tree1, FnApplNode)) \
            and tree1.is_metavar:
         if isinstance(tree2, Sort) and isinstance(tree1.sort, SetSort) and \
            isinstance(tree1.sort.sort, Universum):
-            assign.append(deepcopy((tree1, tree2)))
+            if not unify_bind(screen, tl, u, clone(tree1), clone(tree2)):
+                return False
         elif (isinstance(node_constraint(tree1), PredSort) and is_predicate(tree2)) \
               or (not isinstance(node_constraint(tree1), PredSort) and is_expression(tree2)
               and (tree1.is_binder or not tree_contains_binder(tree2))):
-                  if sorts_compatible(screen, tl, tree1.sort, tree2.sort, assign):
+                  if sorts_unify(screen, tl, u, tree1.sort, tree2.sort):
                       if not isinstance(tree2, VarNode) or tree1.name() != tree2.name():
-                           assign.append(deepcopy((tree1, tree2)))
+                           if not unify_bind(screen, tl, u, clone(tree1), clone(tree2)):
+                               return False
                   else:
-                      return False, [], []
+                      return False
         else:
-            return False, [], []
+            return False
     elif (isinstance(tree2, VarNode) or isinstance(tree2, FnApplNode)) \
            and tree2.is_metavar:
         if isinstance(tree1, Sort) and isinstance(tree2.sort, SetSort) and \
            isinstance(tree2.sort.sort, Universum):
-            assign.append(deepcopy((tree2, tree1)))
+            if not unify_bind(screen, tl, u, clone(tree2), clone(tree1)):
+                return False
         elif (isinstance(node_constraint(tree2), PredSort) and is_predicate(tree1)) \
             or (not isinstance(node_constraint(tree2), PredSort) and is_expression(tree1)
             and (tree2.is_binder or not tree_contains_binder(tree1))):
-              if sorts_compatible(screen, tl, tree2.sort, tree1.sort, assign):
+              if sorts_unify(screen, tl, u, tree2.sort, tree1.sort):
                   if not isinstance(tree1, VarNode) or tree2.name() != tree1.name():
-                       assign.append(deepcopy((tree2, tree1)))
+                       if not unify_bind(screen, tl, u, clone(tree2), clone(tree1)):
+                           return False
               else:
-                  return False, [], []
+                  return False
         else:
-            return False, [], []
+            return False
     elif isinstance(tree1, VarNode) or isinstance(tree2, VarNode):
         if not isinstance(tree1, VarNode) or not isinstance(tree2, VarNode):
-            return False, [], []
+            return False
         if tree1.name() != tree2.name(): # if not metavars check names
-            return False, [], []
+            return False
     elif isinstance(tree1, FnApplNode) and isinstance(tree2, FnApplNode):
-        unified, assign, macros = trees_unify(screen, tl, tree1.var, tree2.var, assign, macros)
-        if not unified:
-            return False, [], []
+        if not unify_trail(screen, tl, tree1.var, tree2.var, u):
+            return False
         if len(tree1.args) != len(tree2.args):
-            return False, [], []
+            return False
         for i in range(0, len(tree1.args)):
-            unified, assign, macros = trees_unify(screen, tl, tree1.args[i], tree2.args[i], assign, macros)
-            if not unified:
-                return False, [], []
+            if not unify_trail(screen, tl, tree1.args[i], tree2.args[i], u):
+                return False
     elif isinstance(tree1, LambdaNode) and isinstance(tree2, LambdaNode):
-        t1 = deepcopy(tree1)
-        t2 = deepcopy(tree2)
+        t1 = clone(tree1)
+        t2 = clone(tree2)
         var1 = t1.left
         var2 = t2.left
         mark_binder_vars(t1, var1)
         mark_binder_vars(t2, var2)
-        unified, assign, macros = trees_unify(screen, tl, var1, var2, assign, macros)
-        if not unified:
-            return False, [], []
-        unified, assign, macros = trees_unify(screen, tl, t1.right, t2.right, assign, macros)
-        if not unified:
-            return False, [], []
+        if not unify_trail(screen, tl, var1, var2, u):
+            return False
+        if not unify_trail(screen, tl, t1.right, t2.right, u):
+            return False
     elif isinstance(tree1, EqNode) and isinstance(tree2, EqNode):
         # special case for equality, try both directions
-        ass = deepcopy(assign)
-        mac = deepcopy(macros)
-        unified, ass, mac = trees_unify(screen, tl, tree1.left, tree2.left, ass, mac)
-        if unified:
-            unified, ass, mac = trees_unify(screen, tl, tree1.right, tree2.right, ass, mac)
-        if not unified: # try the other way around
-            unified, assign, macros = trees_unify(screen, tl, tree1.left, tree2.right, assign, macros)
-            if not unified:
-                return False, [], []
-            unified, assign, macros = trees_unify(screen, tl, tree1.right, tree2.left, assign, macros)
-            if not unified:
-                return False, [], []
-        else:
-            assign = ass
-            macros = mac
+        n1 = len(u.assign)
+        n2 = len(u.macros)
+        if not unify_trail(screen, tl, tree1.left, tree2.left, u) or \
+           not unify_trail(screen, tl, tree1.right, tree2.right, u):
+            # pop the trail and try the other way around
+            unify_undo(u, n1, n2)
+            if not unify_trail(screen, tl, tree1.left, tree2.right, u):
+                return False
+            if not unify_trail(screen, tl, tree1.right, tree2.left, u):
+                return False
     elif isinstance(tree1, Universum):
         if isinstance(tree2, Sort) or (isinstance(tree2, VarNode) and \
            isinstance(tree2.sort, SetSort)):
             pass
             # TODO: do assignment of metavariable (type variable)
         else:
-            return False, [], []
+            return False
     elif isinstance(tree2, Universum):
         if isinstance(tree1, Sort) or (isinstance(tree1, VarNode) and \
            isinstance(tree1.sort, SetSort)):
             pass
             # TODO: do assignment of metavariable (type variable)
         else:
-            return False, [], []
+            return False
     else: # we didn't hit a variable, or a pair of functions or a type variable
         if type(tree1) != type(tree2):
-            return False, [], []
+            return False
         elif isinstance(tree1, NaturalNode) or isinstance(tree1, BoolNode):
-            if tree1.value == tree2.value:
-                return True, assign, macros
-            else:
-                return False, [], []
+            return tree1.value == tree2.value
         elif isinstance(tree1, SymbolNode):
             if tree1.name() != tree2.name():
-                return False, [], []
+                return False
             if tree1.name() == '\\emptyset':
-                unified, assign, macros = trees_unify(screen, tl, tree1.sort, tree2.sort, assign, macros)
-                if not unified:
-                    return False, [], []
+                if not unify_trail(screen, tl, tree1.sort, tree2.sort, u):
+                    return False
         elif isinstance(tree1, SetSort):
             if tree1.sort == tree1:
-                return (tree2.sort == tree2 and tree1 == tree2), assign, macros
+                return tree2.sort == tree2 and tree1 == tree2
             if tree2.sort == tree2:
-                return False, [], []
-            unified, assign, macros = trees_unify(screen, tl, tree1.sort, tree2.sort, assign, macros)
-            if not unified:
-                return False, [], []
+                return False
+            if not unify_trail(screen, tl, tree1.sort, tree2.sort, u):
+                return False
         elif isinstance(tree1, TupleSort):
             if len(tree1.sorts) != len(tree2.sorts):
-                return False, [], []
+                return False
             for i in range(len(tree1.sorts)):
-                unified, assign, macros = trees_unify(screen, tl, tree1.sorts[i], tree2.sorts[i], assign, macros)
-                if not unified:
-                    return False, [], []
+                if not unify_trail(screen, tl, tree1.sorts[i], tree2.sorts[i], u):
+                    return False
         elif isinstance(tree1, TupleNode):
             if len(tree1.args) != len(tree2.args):
-                return False, [], []
+                return False
             for i in range(0, len(tree1.args)):
-                unified, assign, macros = trees_unify(screen, tl, tree1.args[i], tree2.args[i], assign, macros)
-                if not unified:
-                    return False, [], []
+                if not unify_trail(screen, tl, tree1.args[i], tree2.args[i], u):
+                    return False
         elif isinstance(tree1, LRNode):
-            unified, assign, macros = trees_unify(screen, tl, tree1.left, tree2.left, assign, macros)
-            if not unified:
-                return False, [], []
-            unified, assign, macros = trees_unify(screen, tl, tree1.right, tree2.right, assign, macros)
-            if not unified:
-                return False, [], []
+            if not unify_trail(screen, tl, tree1.left, tree2.left, u):
+                return False
+            if not unify_trail(screen, tl, tree1.right, tree2.right, u):
+                return False
     # if any case falls through, unification occurred successfully
-    return True, assign, macros
+    return True
+
+def unify_trail(screen, tl, tree1, tree2, u):
+    """
+    Unify tree1 and tree2, adding metavariable bindings and unexpanded macros
+    to the Unifier u. If the trees do not unify, u is popped back to where it
+    was on entry, so that callers can backtrack without copying anything.
+    """
+    n1 = len(u.assign)
+    n2 = len(u.macros)
+    if unify_step(screen, tl, tree1, tree2, u):
+        return True
+    unify_undo(u, n1, n2)
+    return False
+
+def subst_names(tree, names):
+    """
+    Append to the list names the names of all variables in the given tree
+    that subst visits, i.e. that it may replace.
+    """
+    if tree == None:
+        return
+    if isinstance(tree, ForallNode) or isinstance(tree, ExistsNode):
+        subst_names(tree.var.constraint, names)
+        subst_names(tree.left, names)
+    elif isinstance(tree, VarNode):
+        subst_names(tree.constraint, names)
+        names.append(tree.name())
+    elif isinstance(tree, TupleComponentNode):
+        subst_names(tree.left, names)
+    elif isinstance(tree, FnApplNode):
+        names.append(tree.name())
+        subst_names(tree.var, names)
+        for v in tree.args:
+            subst_names(v, names)
+    elif isinstance(tree, TupleNode):
+        for v in tree.args:
+            subst_names(v, names)
+    elif isinstance(tree, SetOfNode):
+        subst_names(tree.left, names)
+    elif isinstance(tree, LRNode):
+        subst_names(tree.left, names)
+        subst_names(tree.right, names)
+    elif isinstance(tree, SymbolNode) and tree.name() == '\\emptyset':
+        subst_names(tree.constraint, names)
+    elif isinstance(tree, SetSort):
+        if tree.sort != tree:
+            subst_names(tree.sort, names)
+    elif isinstance(tree, TupleSort) or isinstance(tree, CartesianConstraint):
+        for v in tree.sorts:
+            subst_names(v, names)
+
+def resolve_bindings(u):
+    """
+    Return the bindings of the Unifier u as a list of (var, value) pairs, in
+    the order they were made, in which every bound metavariable in a variable
+    or value is replaced by its resolved value. Each binding is resolved once,
+    after the bindings it depends on. A metavariable whose value depends on
+    itself is left in place.
+    """
+    index = dict() # name of bound metavariable -> number of its binding
+    for i in range(len(u.assign)):
+        index[u.assign[i][0].name()] = i
+    resolved = [None for i in range(len(u.assign))]
+    active = set() # bindings being resolved
+
+    def depends(tree, i):
+        # bindings other than i whose variables occur in tree, in order
+        names = []
+        subst_names(tree, names)
+        return sorted(set(index[n] for n in names if n in index and index[n] != i))
+
+    def resolve(i):
+        active.add(i)
+        var, value = u.assign[i]
+        jvar = [j for j in depends(var, i) if j not in active]
+        jval = [j for j in depends(value, i) if j not in active]
+        for j in jvar + jval:
+            if resolved[j] == None and j not in active:
+                resolve(j)
+        if jvar:
+            var = clone(var) # in case it is a function
+            for j in jvar:
+                var = subst(var, resolved[j][0], resolved[j][1])
+        if jval:
+            value = clone(value)
+            for j in jval:
+                value = subst(value, resolved[j][0], resolved[j][1])
+        resolved[i] = (var, value)
+        active.remove(i)
+
+    for i in range(len(u.assign)):
+        if resolved[i] == None:
+            resolve(i)
+    return resolved
+
+def trees_unify(screen, tl, tree1, tree2, assigned=[], macro=[]):
+    """
+    Unify tree1 and tree2 given existing lists of assignments and macros.
+    Returns a tuple (unified, assign, macros) where assign and macros are new
+    lists extending the given ones, or (False, [], []) on failure. Unlike
+    those of unify, the assignments are unresolved, i.e. a value may contain
+    metavariables assigned by other entries.
+    """
+    u = Unifier()
+    u.macros = macro[:] # default params are mutable
+    for (var, value) in assigned:
+        if not unify_bind(screen, tl, u, var, value):
+            return False, [], []
+    if not unify_trail(screen, tl, tree1, tree2, u):
+        return False, [], []
+    return True, u.assign, u.macros
 
 def unify(screen, tl, tree1, tree2, assigned=[]):
-    assign = deepcopy(assigned) # default params are mutable
-    unified, assign, macros = trees_unify(screen, tl, tree1, tree2, assign)
-    if not unified:
+    """
+    Unify tree1 and tree2 given an existing list of assignments. Returns a
+    tuple (unified, assign, macros) where assign is a list of (var, value)
+    pairs, in the order the variables were first assigned, in which no value
+    contains an assigned metavariable, so that it can be applied with
+    substitute. On failure (False, [], []) is returned.
+    """
+    u = Unifier()
+    for (var, value) in assigned:
+        if not unify_bind(screen, tl, u, var, value):
+            return False, [], []
+    if not unify_trail(screen, tl, tree1, tree2, u):
         return False, [], []
-    i = 0
-    while i < len(assign):
-        if isinstance(assign[i][1], VarNode) and assign[i][1].is_metavar and \
-           assign[i][0].name() == assign[i][1].name():
-            del assign[i]
-        else:
-            for j in range(0, i):
-                assign[j] = make_substitution(assign[j], assign[i])
-            j = i + 1
-            while j < len(assign):
-                if assign[i][0].name() == assign[j][0].name():
-                    unified, assign, macros = trees_unify(screen, tl, assign[i][1], assign[j][1], assign, macros)
-                    if not unified:
-                        return False, [], []
-                    del assign[j]
-                else:
-                    assign[j] = make_substitution(assign[j], assign[i])
-                    j += 1
-            i += 1
-    return True, assign, macros
+    return True, resolve_bindings(u), u.macros
 
 def check_macros(screen, tl, macros, assign, qz):
     qz = qz[0] if len(qz) > 0 else []
     # check macros after substitution
     for (uni1, tree2) in macros:
-        tree = substitute(deepcopy(tree2.args[0]), assign)
+        tree = substitute(clone(tree2.args[0]), assign)
         if tree2.name() == 'universe':
             tree = universe(tree, qz)
         elif tree2.name() == 'domain':
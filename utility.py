@@ -6,7 +6,7 @@ from nodes import ForallNode, ExistsNode, FnApplNode, VarNode, SetBuilderNode, \
      DivNode, SubsetneqNode, SubseteqNode, SupsetneqNode, SupseteqNode, \
      AbsNode, NegNode, ElemNode, BoolNode, DeadNode, LambdaNode, LeafNode
 from sorts import SetSort, TupleSort, FunctionConstraint, DomainTuple, \
-     CartesianConstraint, Universum, NumberSort, PredSort, Sort
+     CartesianConstraint, Universum, NumberSort, PredSort, Sort, clone
 from typeclass import CompleteValuedFieldClass, CompleteOrderedValuedFieldClass, \
      FieldClass, OrderedRingClass, OrderedSemiringClass, PosetClass, MonoidClass, \
      SemiringClass
@@ -124,7 +124,7 @@ def subst(tree1, var, tree2):
     if isinstance(tree1, VarNode):
         tree1.constraint = subst(tree1.constraint, var, tree2)
         if tree1.name() == var.name():
-            return deepcopy(tree2)
+            return clone(tree2)
         else:
             return tree1
     elif isinstance(tree1, TupleComponentNode):
@@ -135,16 +135,16 @@ def subst(tree1, var, tree2):
             if n >= len(tree2.args):
                 raise Exception("Invalid indexing in tuple")
             return tree2.args[n]
-        p = deepcopy(tree1)
+        p = clone(tree1)
         p.left = subst(p.left, var, tree2)
         return p
     elif isinstance(tree1, FnApplNode):
         if tree1.name() == var.name() and is_predicate(tree2):
-            p = deepcopy(tree2)
+            p = clone(tree2)
             for i in range(0, len(tree1.args)):
                 p = subst(p, var.args[i], tree1.args[i])
             return p
-        p = deepcopy(tree1)
+        p = clone(tree1)
         p.var = subst(p.var, var, tree2)
         if not isinstance(p.var, VarNode) and not isinstance(p.var, FnApplNode):
             p.is_metavar = False
@@ -159,7 +159,7 @@ def subst(tree1, var, tree2):
     elif isinstance(tree1, SetOfNode):
         if isinstance(tree1.left, VarNode) and tree1.left.name() == var.name():
             tree1.left.constraint = subst(tree1.left.constraint, var, tree2)
-            return sort_to_set(deepcopy(tree2))
+            return sort_to_set(clone(tree2))
         else:
             tree1.left = subst(tree1.left, var, tree2)
             return tree1
@@ -185,13 +185,6 @@ def subst(tree1, var, tree2):
     else:
         return tree1
 
-def make_substitution(assign1, assign2):
-    (var1, expr1) = assign1
-    (var2, expr2) = assign2
-
-    var1 = subst(deepcopy(var1), var2, expr2) # in case it is a function
-    return (var1, subst(deepcopy(expr1), var2, expr2))
-
 def substitute(tree, assign):
    for (var, val) in assign:
        tree = subst(tree, var, val)
@@ -230,17 +223,17 @@ def complement_tree(tree):
         else:
             return NotNode(tree)
 
-    return complement(deepcopy(tree))
+    return complement(clone(tree))
 
 def unquantify(screen, tree, positive):
     """
-    Remove forall quantifiers from a statement, returning a deepcopy of the
+    Remove forall quantifiers from a statement, returning a copy of the
     matrix and a list of the quantifiers removed (now unlinked).
 
     The function should be called with positive=True if the statement is
     from the targets, else False.
     """
-    tree = deepcopy(tree)
+    tree = clone(tree)
     mv = []
     univs = []
     while isinstance(tree, ForallNode):
@@ -298,7 +291,7 @@ def qz_copy_var(screen, tl, extras, name, new_name, copied, assign=None):
     if tree == None:
        if node_to_copy != None:
           new_node = copy(node_to_copy)
-          new_node.var = deepcopy(new_node.var)
+          new_node.var = clone(new_node.var)
           if isinstance(new_node.var, VarNode):
               new_node.var._name = new_name # rename
           elif isinstance(new_node.var, FnApplNode): # TODO : not sure if this is used any more
@@ -318,7 +311,7 @@ def qz_copy_var(screen, tl, extras, name, new_name, copied, assign=None):
               node_to_copy = tree
        if tree.left == None and node_to_copy != None: # this is the last node, make copy
           new_node = copy(node_to_copy)
-          new_node.var = deepcopy(new_node.var)
+          new_node.var = clone(new_node.var)
           if isinstance(new_node.var, VarNode):
               new_node.var._name = new_name # rename
           elif isinstance(new_node.var, FnApplNode): # TODO : not sure if this is used any more
@@ -732,13 +725,96 @@ def is_duplicate_upto_metavars(tree1, tree2, sk=None, from_vars=None, to_vars=No
             to_vars.append(i)
     return val
 
+class TargetTour:
+    """
+    An index of a tree of target nodes, shared by all the nodes of the tree.
+    It maps each target number to its node and records the position at which
+    an Euler tour of the tree enters and leaves each node, so that whether one
+    target is a descendant of another is a comparison of intervals. The tour
+    is recomputed on the first query after changed has been called, which
+    must be done by anything that modifies the tree.
+    """
+    def __init__(self, root):
+        self.root = root # root of the tree of targets
+        self.nodes = dict() # target number -> target node
+        self.entry = dict() # target number -> position tour enters node
+        self.exit = dict() # target number -> position tour leaves node
+        self.valid = False # whether the above are up to date
+
+    def changed(self):
+        self.valid = False
+
+    def update(self):
+        self.nodes = dict()
+        self.entry = dict()
+        self.exit = dict()
+        pos = 0
+        unproc = [(self.root, False)]
+        while unproc:
+            node, done = unproc.pop()
+            if done:
+                self.exit[node.num] = pos
+            else:
+                if node.num not in self.nodes: # first occurrence, as for a search
+                    self.nodes[node.num] = node
+                    self.entry[node.num] = pos
+                    unproc.append((node, True))
+                for P in reversed(node.andlist):
+                    unproc.append((P, False))
+            pos += 1
+        self.valid = True
+
+    def find(self, i):
+        """
+        Return the node for target i, or None if it is not in the tree.
+        """
+        if not self.valid:
+            self.update()
+        return self.nodes.get(i)
+
+    def depends(self, i, j):
+        """
+        Return True if target i is target j or a descendant of it.
+        """
+        if not self.valid:
+            self.update()
+        if i not in self.entry or j not in self.entry:
+            return False
+        return self.entry[j] <= self.entry[i] and self.exit[i] <= self.exit[j]
+
+    def intersect(self, deps1, deps2):
+        """
+        Return the targets in either list which are a target in the other list
+        or a descendant of one, i.e. the roots of the subtrees of targets
+        which are below a target in both lists. The lists are swept in order
+        of the Euler tour, keeping a stack of the targets whose subtrees
+        contain the current one.
+        """
+        if not self.valid:
+            self.update()
+        tour = [(self.entry[d], 0, d) for d in deps1 if d in self.entry] + \
+               [(self.entry[d], 1, d) for d in deps2 if d in self.entry]
+        tour.sort()
+        deps = []
+        stack = [] # (exit, list) for enclosing targets
+        count = [0, 0] # number of enclosing targets from each list
+        for (entry, k, d) in tour:
+            while stack and stack[-1][0] < entry:
+                count[stack.pop()[1]] -= 1
+            if count[1 - k] > 0 and d not in deps:
+                deps.append(d)
+            stack.append((self.exit[d], k))
+            count[k] += 1
+        return deps
+
 class TargetNode:
     """
     Used for building a tree of targets so we can keep track of which targets
     when proved will constitute a proof of which other targets. For this
     purpose, the target with number num has an andlist which is a list of
     target nodes of all the targets that have to be proved in order to prove
-    it.
+    it. All the nodes of a tree share a TargetTour, which is used to find
+    targets and answer ancestor queries without searching the tree.
     """
     def __init__(self, num, andlist=[]):
         self.num = num # which target this node corresponds to
@@ -748,6 +824,21 @@ class TargetNode:
         self.unifies = [] # list of hyps this target unifies with on its own
         self.reason = None # how target was proved (hyp. i, contr. (i, j), equal. -1, andlist None)
         self.extra_hyps = [] # any extra hypotheses which were needed to prove node
+        self.parent = None # node whose andlist this node is in
+        self.tour = TargetTour(self) # index of the tree this node belongs to
+        for P in andlist:
+            P.parent = self
+            P.join(self.tour)
+
+    def join(self, tour):
+        """
+        Make this node and its descendants part of the tree with the given
+        index.
+        """
+        self.tour = tour
+        for P in self.andlist:
+            P.join(tour)
+        tour.changed()
 
     def __str__(self):
         if not self.andlist:
@@ -784,19 +875,18 @@ def add_sibling(screen, tl, ttree, i, j):
     target i to close out that branch, so they are added using this function to
     the same andlist that i appeared in.
     """
-    for P in ttree.andlist:
-        if P.num == i:
-            jnode = TargetNode(j)
-            ttree.andlist.append(jnode)
-            for k in range(len(tl.tlist1.data)): # hyps that prove i also prove j
-                if k in tl.tlist1.dep:
-                     if i in tl.tlist1.dep[k]: # add j to list
-                          tl.tlist1.dep[k].append(j)
-            return True
-    for P in ttree.andlist:
-        if add_sibling(screen, tl, P, i, j):
-            return True
-    return False
+    P = ttree.tour.find(i)
+    if P == None or P.parent == None:
+        return False
+    jnode = TargetNode(j)
+    P.parent.andlist.append(jnode)
+    jnode.parent = P.parent
+    jnode.join(ttree.tour)
+    for k in range(len(tl.tlist1.data)): # hyps that prove i also prove j
+        if k in tl.tlist1.dep:
+             if i in tl.tlist1.dep[k]: # add j to list
+                  tl.tlist1.dep[k].append(j)
+    return True
 
 def add_descendant(ttree, i, j, hyp=None):
     """
@@ -804,16 +894,16 @@ def add_descendant(ttree, i, j, hyp=None):
     done when proving target j will be sufficient to prove target i, e.g.
     because we reasoned backwards to j from i.
     """
-    if ttree.num == i:
-        n = TargetNode(j)
-        if hyp:
-            n.extra_hyps.append(hyp)
-        ttree.andlist = [n]
-        return True
-    for P in ttree.andlist:
-        if add_descendant(P, i, j, hyp):
-            return True
-    return False
+    P = ttree.tour.find(i)
+    if P == None:
+        return False
+    n = TargetNode(j)
+    if hyp:
+        n.extra_hyps.append(hyp)
+    P.andlist = [n]
+    n.parent = P
+    n.join(ttree.tour)
+    return True
 
 def deps_compatible(screen, tl, ttree, i, j):
     """
@@ -830,18 +920,8 @@ def deps_compatible(screen, tl, ttree, i, j):
     if -1 in dep_list: # hyp j can prove anything
         return True
 
-    def find(ttree, i):
-        if ttree.num == i:
-            return ttree
-        for P in ttree.andlist:
-            t = find(P, i)
-            if t:
-                return t
-        return None
-
     for d in dep_list:
-        root = find(ttree, d) # find target d
-        if find(root, i): # target i is a descendant of d
+        if ttree.tour.depends(i, d): # target i is a descendant of d
             return True
     return False
 
@@ -864,15 +944,7 @@ def deps_intersect(screen, tl, ttree, i, j):
          return deps_j
     if -1 in deps_j:
          return deps_i
-    deps = []
-    for d1 in deps_j:
-        for d2 in deps_i:
-            if d1 < d2:
-                d1, d2 = d2, d1
-            if target_depends(screen, tl, ttree, d1, d2):
-                if d1 not in deps:
-                    deps.append(d1)
-    return deps
+    return ttree.tour.intersect(deps_j, deps_i)
 
 def deps_defunct(screen, tl, ttree, i, j):
     """
@@ -889,18 +961,8 @@ def deps_defunct(screen, tl, ttree, i, j):
     if -1 in deps_j: # hyp j can prove everything, can't be made defunct
         return False
 
-    def find(ttree, i):
-        if ttree.num == i:
-            return ttree
-        for P in ttree.andlist:
-            t = find(P, i)
-            if t:
-                return t
-        return None
-
-    root = find(ttree, i)
     for d in deps_j:
-        if not find(root, d): # we can't prove d from i
+        if not ttree.tour.depends(d, i): # we can't prove d from i
             return False
     return True
 
@@ -913,19 +975,7 @@ def target_depends(screen, tl, ttree, i, j):
     The function takes a target dependency tree (ttree) which specifies how
     the targets relate to one another.
      """
-     def find(ttree, i):
-        if ttree.num == i:
-            return ttree
-        for P in ttree.andlist:
-            t = find(P, i)
-            if t:
-                return t
-        return None
-
-     root = find(ttree, j) # find target j
-     if find(root, i): # i is a descendant of j
-         return True
-     return False
+     return ttree.tour.depends(i, j)
 
 def target_compatible(screen, tl, ttree, dep_list, j, forward):
     """
@@ -955,15 +1005,7 @@ def target_compatible(screen, tl, ttree, dep_list, j, forward):
             return dep_list
         if -1 in dep_list:
             return deps_j
-        deps = []
-        for d1 in deps_j:
-            for d2 in dep_list:
-               if d1 < d2:
-                   d1, d2 = d2, d1
-               if target_depends(screen, tl, ttree, d1, d2):
-                   if d1 not in deps:
-                       deps.append(d1)
-        return deps
+        return ttree.tour.intersect(deps_j, dep_list)
     else: # return original list or [] depending if target j is target compatible
         if -1 in dep_list:
             return dep_list
@@ -978,13 +1020,107 @@ class SortNode:
         self.follow = True # whether this node really follows from its ancestor (for powersets)
         self.subsorts = []
 
+class SortTree(list):
+    """
+    The internally maintained sort graph. Entry 0 is the root of the tree of
+    sorts, which is \mathcal{U}, and entry n - 1 for n > 1 is the root of the
+    tree of n-tuple sorts. Lookups of sorts in the tree are memoised by sort
+    key, as is the closure of the subsort relation below each node and the
+    results of sorts_compatible and coerce_sorts for sorts without
+    metavariables. The memoised data is discarded whenever changed is called,
+    which must be done by anything that modifies the tree. The tree is shared
+    by a tableau and the fake tableaux automation loads library results into,
+    so the memoised data is too.
+    """
+    def __init__(self, roots):
+        super().__init__(roots)
+        self.version = 0 # number of times the tree has changed
+        self.nodes = None # sort key -> first node with that sort, if computed
+        self.closure = dict() # id of node -> dict of sort key -> first subsort node
+        self.compatible = dict() # pair of sort keys -> result of sorts_compatible
+        self.coercions = dict() # pair of sort keys -> result of coerce_sorts
+        self.hits = 0 # number of results of sorts_compatible/coerce_sorts reused
+        self.misses = 0 # number of results of sorts_compatible/coerce_sorts computed
+
+    def changed(self):
+        self.version += 1
+        self.nodes = None
+        self.closure = dict()
+        self.compatible = dict()
+        self.coercions = dict()
+
+def sort_key(s):
+    """
+    Return a hashable key for the sort s, such that two such sorts are equal
+    according to sorts_equal if and only if their keys are equal. If the sort
+    contains a metavariable or is not a sort, return None.
+    """
+    if isinstance(s, VarNode):
+        return None if s.is_metavar else (VarNode, s.name())
+    elif isinstance(s, NumberSort):
+        return (NumberSort, s.name())
+    elif isinstance(s, SetSort):
+        k = sort_key(s.sort)
+        return None if k == None else (SetSort, k)
+    elif isinstance(s, TupleSort):
+        keys = tuple(sort_key(t) for t in s.sorts)
+        return None if None in keys else (TupleSort, keys)
+    elif isinstance(s, PredSort) or isinstance(s, Universum):
+        return (type(s),)
+    return None
+
+def sort_closure(stree, node):
+    """
+    Return a dictionary mapping the key of each sort that sort_descendant
+    would find starting at the given node of the given sort tree to the node
+    it would return, or None if some sort in the subtree has no key.
+    """
+    closure = stree.closure.get(id(node), False)
+    if closure == False:
+        closure = dict()
+        stack = [node]
+        while stack:
+            t = stack.pop()
+            k = sort_key(t.sort)
+            if k == None:
+                closure = None
+                break
+            if k not in closure:
+                closure[k] = t
+            for u in reversed(t.subsorts):
+                if u.follow:
+                    stack.append(u)
+        stree.closure[id(node)] = closure
+    return closure
+
+def sort_nodes(stree):
+    """
+    Return a dictionary mapping the key of each sort that find_sort would find
+    in the tree of sorts rooted at \mathcal{U} to the node it would return,
+    or None if some sort in the tree has no key.
+    """
+    if stree.nodes == None:
+        nodes = dict()
+        stack = [stree[0]]
+        while stack:
+            t = stack.pop()
+            k = sort_key(t.sort)
+            if k == None:
+                nodes = False
+                break
+            if k not in nodes:
+                nodes[k] = t
+            stack.extend(reversed(t.subsorts))
+        stree.nodes = nodes
+    return stree.nodes if stree.nodes != False else None
+
 def initialise_sorts(screen, tl):
     """
     Initialise the internally maintained sort graph. At the top is the sort
     \mathcal{U} and we add all the number types to this sort graph with the
     obvious inclusions.
     """
-    tl.stree = [SortNode(Universum())]
+    tl.stree = SortTree([SortNode(Universum())])
     C = NumberSort("\\mathbb{C}", CompleteValuedFieldClass())
     R = NumberSort("\\mathbb{R}", CompleteOrderedValuedFieldClass())
     Q = NumberSort("\\mathbb{Q}", FieldClass())
@@ -1015,6 +1151,7 @@ def find_sort(screen, tl, s):
         t = SortNode(s)
         t.follow = False # this is a powerset and is not actually a descendent of r
         r.subsorts.append(t)
+        stree.changed()
         return t
     if isinstance(s, TupleSort):
         for r in s.sorts:
@@ -1029,12 +1166,19 @@ def find_sort(screen, tl, s):
             for t in stree[n - 1].subsorts:
                 if sorts_equal(s, t.sort):
                     return t
-        t = SortNode(deepcopy(s))
+        t = SortNode(clone(s))
         stree[n - 1].subsorts.append(t)
+        stree.changed()
         if tl.sorts_recording: # if we are recording modifications in case of rollback
             tl.sorts_record.append(stree[n-1].subsorts)
         return t
     else:
+        k = sort_key(s)
+        if k != None and stree:
+            nodes = sort_nodes(stree)
+            if nodes != None:
+                return nodes.get(k)
+
         def find(st, s):
             for t in st.subsorts:
                 if sorts_equal(s, t.sort):
@@ -1044,13 +1188,10 @@ def find_sort(screen, tl, s):
                     return r
             return None
         
-        for i in range(len(stree)):
+        if stree: # only the tree rooted at \mathcal{U} needs searching
             if sorts_equal(s, stree[0].sort):
                 return stree[0]
-
-            r = find(stree[0], s)
-            if r:
-                return r
+            return find(stree[0], s)
         return None
 
 def sort_descendant(screen, tl, s1, s2):
@@ -1058,6 +1199,11 @@ def sort_descendant(screen, tl, s1, s2):
     Given a base node s1 in the stree, find s2 starting at that node.
     Otherwise return None.
     """
+    k = sort_key(s2)
+    if k != None:
+        closure = sort_closure(tl.stree, s1)
+        if closure != None:
+            return closure.get(k)
     if sorts_equal(s1.sort, s2):
         return s1
     for t in s1.subsorts:
@@ -1075,6 +1221,7 @@ def insert_sort(screen, tl, s1, s2):
     """
     r = find_sort(screen, tl, s1)
     r.subsorts.append(SortNode(s2))
+    tl.stree.changed()
     if tl.sorts_recording: # if we are recording modifications in case of rollback
         tl.sorts_record.append(r.subsorts)
 
@@ -1083,6 +1230,8 @@ def sorts_mark(screen, tl):
     tl.sorts_record = []
 
 def sorts_rollback(screen, tl):
+    if tl.sorts_record:
+        tl.stree.changed()
     while tl.sorts_record:
         s = tl.sorts_record.pop()
         s.pop()
@@ -1118,6 +1267,29 @@ def sorts_equal(s1, s2, assign=None):
     return False
 
 def coerce_sorts(screen, tl, s1, s2, assign=None):
+    """
+    If s2 can be coerced to s1, return s1 (or the node of the sort tree or
+    the tuple sort which it can be coerced to), otherwise return None. Results
+    for sorts without metavariables are memoised in the sort tree, in which
+    case a sort equal to s1 may be returned in place of s1.
+    """
+    stree = tl.stree
+    k1 = sort_key(s1)
+    k2 = sort_key(s2)
+    if k1 == None or k2 == None or not isinstance(stree, SortTree):
+        return compute_coercion(screen, tl, s1, s2, assign)
+    key = (k1, k2)
+    if key in stree.coercions:
+        stree.hits += 1
+        return stree.coercions[key]
+    stree.misses += 1
+    version = stree.version
+    r = compute_coercion(screen, tl, s1, s2, assign)
+    if stree.version == version: # don't memoise if the tree changed meanwhile
+        stree.coercions[key] = r
+    return r
+
+def compute_coercion(screen, tl, s1, s2, assign=None):
     # special case, used only by sorts_compatible for function domains
     if s1 == None and s2 == None:
         return True
@@ -1147,6 +1319,29 @@ def coerce_sorts(screen, tl, s1, s2, assign=None):
     return None # not coercible
     
 def sorts_compatible(screen, tl, s1, s2, assign=None, both_dirs=True):
+    """
+    Return True if one of the sorts s1 and s2 can be coerced to the other.
+    Metavariables are assigned by appending to the list assign. Results for
+    sorts without metavariables are memoised in the sort tree.
+    """
+    stree = tl.stree
+    k1 = sort_key(s1)
+    k2 = sort_key(s2)
+    if k1 == None or k2 == None or not isinstance(stree, SortTree):
+        return compute_sorts_compatible(screen, tl, s1, s2, assign, both_dirs)
+    key = (k1, k2)
+    r = stree.compatible.get(key)
+    if r != None:
+        stree.hits += 1
+        return r
+    stree.misses += 1
+    version = stree.version
+    r = compute_sorts_compatible(screen, tl, s1, s2, assign, both_dirs)
+    if stree.version == version: # don't memoise if the tree changed meanwhile
+        stree.compatible[key] = r
+    return r
+
+def compute_sorts_compatible(screen, tl, s1, s2, assign=None, both_dirs=True):
     if isinstance(s1, Universum) and isinstance(s2, Universum):
         return True
     if isinstance(s1, VarNode) and s1.is_metavar:
@@ -1235,20 +1430,6 @@ def canonicalise_tags(tags):
             taglist[i] = "#"+canonical_numconstraints[tag]
     return "Tags: "+' '.join(taglist)
 
-def filter_titles(titles, c):
-    """
-    Given a list of pairs consisting of a string representing a theorem title
-    and an integer (representing a position within the library file) and a
-    character c, return a similar list of pairs consisting of just those for
-    which the first letter of the title is the given character (or the upper
-    case version of it).
-    """
-    titles2 = []
-    for (line, v) in titles:
-        if v[0] == c or v[0] == c.upper():
-            titles2.append((line, v))
-    return titles2
-
 def trim_spaces(string, start, end):
     """
     Given a string and a range [start, end) delineating a substring, return a
@@ -1276,19 +1457,6 @@ def find_all(string, substring):
         res.append(start)
         start += n
 
-def find_start_index(lst, chosen_set):
-    """
-    Given a list lst of items, find the index of the first element of the list
-    such that no element from that point on (inclusive) is in the list of items
-    denoted chosen_set.
-    """
-    index = len(lst)
-    for i in reversed(range(len(lst))):
-        if lst[i] in chosen_set:
-            break
-        index = i
-    return index
-
 def list_merge(list1, list2):
     """
     Given two lists, merge the two lists together, eliminating duplicates from
@@ -2098,20 +2266,77 @@ def propagate_sorts(screen, tl, tree0):
         return True, None
     return propagate(tree0)
 
+def record_uses(tl, used, k, key):
+    """
+    Record that the typing of an entry of the tableau depends on the binders
+    of the variables in the set used. Here k is 0 for a binder in the
+    quantifier zone, 1 for a hypothesis and 2 for a target, and key is the
+    name of the binder or the index of the line respectively.
+    """
+    for name in used:
+        if name not in tl.var_lines:
+            tl.var_lines[name] = (set(), set(), set())
+        tl.var_lines[name][k].add(key)
+
+def retype_vars(tl, names, dirty1, dirty2):
+    """
+    After cleanup has added or changed the binders for the variables with the
+    given names, mark them, the given hypotheses and targets and everything
+    whose typing depends on one of the binders (directly or through another
+    binder) as needing to be processed again by update_constraints and
+    process_sorts. Only these lines will be typed again, rather than the
+    whole tableau.
+    """
+    binders = set(names)
+    hyps = set(dirty1)
+    tars = set(dirty2)
+    unproc = list(binders)
+    while unproc:
+        name = unproc.pop()
+        if name in tl.var_lines:
+            deps0, deps1, deps2 = tl.var_lines[name]
+            for v in deps0:
+                if v not in binders:
+                    binders.add(v)
+                    unproc.append(v) # the sort of this binder may change
+            hyps.update(deps1)
+            tars.update(deps2)
+    for dirty in [tl.constraints_dirty, tl.sorts_dirty]:
+        dirty[0].update(binders)
+        dirty[1].update(hyps)
+        dirty[2].update(tars)
+
+def lines_to_type(dirty, n, m):
+    """
+    Given a set of indices of lines that need to be typed again, the number n
+    of lines already processed and the total number of lines m, return a list
+    of the indices of the lines to process, in order.
+    """
+    return [j for j in sorted(dirty) if j < n] + [j for j in range(n, m)]
+
 def process_sorts(screen, tl):
     """
     Every move, this function is called to recompute the types of nodes in any
     quantifier zone, hypothesis or target that hasn't previously been processed
     or which has been modified since last move. A record of the last binder in
     the quantifier zone, the last hypothesis and the last target already
-    processed are stored in the tableau structure and these are reset if an
-    already processed line is changed.
+    processed are stored in the tableau structure, along with the binders and
+    lines which have been marked by retype_vars as needing to be processed
+    again.
     """
     n0, n1, n2 = tl.sorts_processed
+    binders, dirty1, dirty2 = tl.sorts_dirty
     i = 0
     if tl.tlist0.data:
         data = tl.tlist0.data[0]
         while i < n0:
+            if data.var.name() in binders: # type this binder only
+                left = data.left
+                data.left = None
+                ok, error = propagate_sorts(screen, tl, data)
+                data.left = left
+                if not ok:
+                    return False, error
             data = data.left # skip quantifiers we already typed
             i += 1
         if data:
@@ -2121,15 +2346,16 @@ def process_sorts(screen, tl):
             while data != None:
                 data = data.left
                 i += 1
-    for j in range(n1, len(tl.tlist1.data)):
+    for j in lines_to_type(dirty1, n1, len(tl.tlist1.data)):
         ok, error = propagate_sorts(screen, tl, tl.tlist1.data[j])
         if not ok:
             return False, error
-    for k in range(n2, len(tl.tlist2.data)):
+    for k in lines_to_type(dirty2, n2, len(tl.tlist2.data)):
         ok, error = propagate_sorts(screen, tl, tl.tlist2.data[k])
         if not ok:
             return False, error
     tl.sorts_processed = (i, len(tl.tlist1.data), len(tl.tlist2.data))
+    tl.sorts_dirty = (set(), set(), set())
     return True, None
 
 def type_vars(screen, tl):
@@ -2141,6 +2367,8 @@ def type_vars(screen, tl):
     """
     constraints = tl.constraints # all constraints of all vars
     vars = [] # vars currently in scope
+    tl.constraints_dirty = (set(), set(), set()) # everything is typed afresh
+    tl.var_lines = dict() # dependencies are recorded afresh
 
     if len(tl.tlist0.data) > 0:
         qz = tl.tlist0.data[0]
@@ -2151,25 +2379,31 @@ def type_vars(screen, tl):
     while qz != None:
         vars.append(qz.var.name())
         constraints[qz.var.name()] = qz.var.constraint
-        ok, error = process_constraints(screen, qz.var.constraint, constraints, vars)
+        used = set()
+        ok, error = process_constraints(screen, qz.var.constraint, constraints, vars, used)
         if not ok:
             screen.dialog(error)
             return
+        record_uses(tl, used, 0, qz.var.name())
         qz = qz.left
         i += 1
 
     hyps = tl.tlist1.data
-    for tree in hyps:
-        ok, error = process_constraints(screen, tree, constraints, vars)
+    for j in range(len(hyps)):
+        used = set()
+        ok, error = process_constraints(screen, hyps[j], constraints, vars, used)
         if not ok:
             screen.dialog(error)
             return
+        record_uses(tl, used, 1, j)
     tars = tl.tlist2.data
-    for tree in tars:
-        ok, error = process_constraints(screen, tree, constraints, vars)
+    for k in range(len(tars)):
+        used = set()
+        ok, error = process_constraints(screen, tars[k], constraints, vars, used)
         if not ok:
             screen.dialog(error)
             return
+        record_uses(tl, used, 2, k)
     tl.constraints_processed = (i, len(tl.tlist1.data), len(tl.tlist2.data))
 
 def update_constraints(screen, tl):
@@ -2179,11 +2413,13 @@ def update_constraints(screen, tl):
     added to the tableau. In such cases, this function can be called to
     annotate all variables that appear in them with their constraints.
     A count of the number of already processed binders in the quantifier
-    zone, hypotheses and targets is stored in the tableau structure. This
-    can be reset if a change is made to one of the already processed
-    lines of the tableau.
+    zone, hypotheses and targets is stored in the tableau structure, along
+    with the binders and lines which have been marked by retype_vars as
+    needing to be processed again. The variables each binder and line
+    depends on are recorded for use by retype_vars.
     """
     n0, n1, n2 = tl.constraints_processed
+    binders, dirty1, dirty2 = tl.constraints_dirty
     constraints = tl.constraints
 
     if len(tl.tlist0.data) > 0:
@@ -2192,29 +2428,34 @@ def update_constraints(screen, tl):
         qz = None
 
     i = 0
-    while i < n0: # skip already processed quantifiers
-        qz = qz.left
-        i += 1
-
     while qz != None:
-        constraints[qz.var.name()] = qz.var.constraint
-        ok, error = process_constraints(screen, qz.var.constraint, constraints)
-        if not ok:
-            return False, error
+        name = qz.var.name()
+        if i >= n0 or name in binders: # skip already processed quantifiers
+            constraints[name] = qz.var.constraint
+            used = set()
+            ok, error = process_constraints(screen, qz.var.constraint, constraints, None, used)
+            if not ok:
+                return False, error
+            record_uses(tl, used, 0, name)
         qz = qz.left
         i += 1
 
     hyps = tl.tlist1.data
-    for j in range(n1, len(hyps)):
-        ok, error = process_constraints(screen, hyps[j], constraints)
+    for j in lines_to_type(dirty1, n1, len(hyps)):
+        used = set()
+        ok, error = process_constraints(screen, hyps[j], constraints, None, used)
         if not ok:
             return False, error
+        record_uses(tl, used, 1, j)
     tars = tl.tlist2.data
-    for k in range(n2, len(tars)):
-        ok, error = process_constraints(screen, tars[k], constraints)
+    for k in lines_to_type(dirty2, n2, len(tars)):
+        used = set()
+        ok, error = process_constraints(screen, tars[k], constraints, None, used)
         if not ok:
             return False, error
+        record_uses(tl, used, 2, k)
     tl.constraints_processed = (i, len(hyps), len(tars))
+    tl.constraints_dirty = (set(), set(), set())
     return True, None
 
 def skolemize_quantifiers(tree, deps, sk, ex):
@@ -2256,14 +2497,16 @@ def skolemize_quantifiers(tree, deps, sk, ex):
     else:
         return tree, deps, sk, ex
 
-def process_constraints(screen, tree, constraints, vars=None):
+def process_constraints(screen, tree, constraints, vars=None, used=None):
     """
     Given a parse tree and a dictionary of constraints for variables, annotate
     each occurrence of variables in tree with their constraints as stored in
     the dictionary. If an existential or universal binder is encountered, the
     constraint for the variable defined will be added to the dictionary. In
     addition, if one needs a list of such variables for further processing,
-    pass a list through the vars parameter and it will be appended.
+    pass a list through the vars parameter and it will be appended. If a set
+    is passed through the used parameter, the name of every variable that is
+    annotated is added to it.
     """
     def del_last(L, str):
         gen = (len(L) - 1 - i for i, v in enumerate(reversed(L)) if v == str)
@@ -2277,10 +2520,10 @@ def process_constraints(screen, tree, constraints, vars=None):
         if vars != None:
             vars.append(name)
         constraints[tree.var.name()] = tree.var.constraint
-        ok, error = process_constraints(screen, tree.var.constraint, constraints, vars)
+        ok, error = process_constraints(screen, tree.var.constraint, constraints, vars, used)
         if not ok:
             return False, error
-        ok, error = process_constraints(screen, tree.left, constraints, vars)
+        ok, error = process_constraints(screen, tree.left, constraints, vars, used)
         if vars != None:
             del_last(vars, name)
         if not ok:
@@ -2290,12 +2533,12 @@ def process_constraints(screen, tree, constraints, vars=None):
         if vars != None:
             vars.append(name)
         constraints[tree.left.left.name()] = tree.left.left.constraint
-        ok, error = process_constraints(screen, tree.left, constraints, vars)
+        ok, error = process_constraints(screen, tree.left, constraints, vars, used)
         if not ok:
             if vars != None:
                 del_last(vars, name)
             return False, error
-        ok, error = process_constraints(screen, tree.right, constraints, vars)
+        ok, error = process_constraints(screen, tree.right, constraints, vars, used)
         if vars != None:
             del_last(vars, name)
         if not ok:
@@ -2309,40 +2552,42 @@ def process_constraints(screen, tree, constraints, vars=None):
                return False, f"Unknown variable/function {tree.name()}"
         else:
             tree.constraint = constraints[tree.name()]
+            if used != None:
+                used.add(tree.name())
     elif isinstance(tree, LRNode):
-        ok, error = process_constraints(screen, tree.left, constraints, vars)
+        ok, error = process_constraints(screen, tree.left, constraints, vars, used)
         if not ok:
             return False, error
-        ok, error = process_constraints(screen, tree.right, constraints, vars)
+        ok, error = process_constraints(screen, tree.right, constraints, vars, used)
         if not ok:
             return False, error
     elif isinstance(tree, FnApplNode):
-        ok, error = process_constraints(screen, tree.var, constraints, vars)
+        ok, error = process_constraints(screen, tree.var, constraints, vars, used)
         if not ok:
             return False, error
         for v in tree.args:
-            ok, error = process_constraints(screen, v, constraints, vars)
+            ok, error = process_constraints(screen, v, constraints, vars, used)
             if not ok:
                 return False, error
     elif isinstance(tree, TupleNode):
         for v in tree.args:
-            ok, error = process_constraints(screen, v, constraints, vars)
+            ok, error = process_constraints(screen, v, constraints, vars, used)
             if not ok:
                 return False, error
     elif isinstance(tree, SymbolNode):
-         ok, error = process_constraints(screen, tree.constraint, constraints, vars)
+         ok, error = process_constraints(screen, tree.constraint, constraints, vars, used)
          if not ok:
              return False, error
     elif isinstance(tree, FunctionConstraint):
-         ok, error = process_constraints(screen, tree.domain, constraints, vars)
+         ok, error = process_constraints(screen, tree.domain, constraints, vars, used)
          if not ok:
              return False, error
-         ok, error = process_constraints(screen, tree.codomain, constraints, vars)
+         ok, error = process_constraints(screen, tree.codomain, constraints, vars, used)
          if not ok:
              return False, error
     elif isinstance(tree, DomainTuple):
          for v in tree.sets:
-             ok, error = process_constraints(screen, v, constraints, vars)
+             ok, error = process_constraints(screen, v, constraints, vars, used)
          if not ok:
              return False, error
     return True, None